@@ -1,50 +1,156 @@
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
 import numpy as np
-import pandas as pd
 import faiss
-from flask import Flask, jsonify, request
+from flask import Flask, Response, g, jsonify, request
 from flask_cors import CORS
-from sentence_transformers import SentenceTransformer
+
+from batcher import MicroBatcher
+from cache import LRUCache, embedding_key, normalize_query
+from config import load_config
+from disk_index import DiskIndex
+from encoders import QueryEncoder
+from exact_refine import EmbeddingVectors, RefinedIndex
+from hybrid import FUSION_METHODS, SEARCH_MODES, LexicalSearcher, fuse, to_arrays
+from index_search import read_index, search_index
+from live_index import LiveIndex, current_index_path
+from metadata_store import MetadataStore
+from metrics import SIZE_BUCKETS, Registry, SlowRequestProfiler
+from namespaces import Namespace, NamespaceRegistry, load_collection_specs
+from passage_store import PassageStore
+from rerank import CrossEncoderReranker
+from sharded_index import ShardedIndex
+from startup import StartupTimer, prefetch_files
 
 # Initialize the Flask application
 app = Flask(__name__)
 CORS(app)
 
-# Load the MSMARCO MiniLM model
-model_name = "msmarco-MiniLM-L6-cos-v5"
-model = SentenceTransformer(model_name)
+# Paths and knobs come from config.py (YAML file named by VECTORDB_CONFIG,
+# overridden by VECTORDB_* environment variables)
+config = load_config()
+
+# Prometheus metrics, served on /metrics
+metrics = Registry()
+stage_seconds = metrics.histogram(
+    "search_stage_seconds", "Wall time per call of each search pipeline stage.", ["stage"]
+)
+request_seconds = metrics.histogram("http_request_seconds", "Request latency by endpoint.", ["endpoint"])
+requests_total = metrics.counter("http_requests_total", "Requests by endpoint and status code.", ["endpoint", "status"])
+errors_total = metrics.counter("http_errors_total", "Requests answered with an error status.", ["endpoint", "status"])
+batch_size = metrics.histogram("search_batch_size", "Queries per encode and index search call.", buckets=SIZE_BUCKETS)
+profiler = SlowRequestProfiler(config["profile_sample_rate"], config["profile_slow_ms"], config["profile_dir"])
+
+# The query model, the index and the passage store load in parallel; the
+# time of each stage is printed once loading is done and served on /ready
+startup = StartupTimer()
+loader = ThreadPoolExecutor(max_workers=3)
 
-# Index
-index_path = "/Users/sahilfaizal/Desktop/BigData/project/backend/hnsw_index.bin"
-index = faiss.read_index(index_path)
+# Load the MSMARCO MiniLM query encoder. encoder_backend "onnx" serves an
+# ONNX (optionally int8-quantized) export written by encoders.py from
+# encoder_path; onnx models are loaded per worker in init_worker().
+model_name = config["model_name"]
+encoder_backend = config["encoder_backend"]
+model_future = loader.submit(
+    startup.timed, "model", QueryEncoder, config["encoder_path"] or model_name, encoder_backend, config["encoder_file"]
+)
 
-def load_tsv(file_path):
+# Disk index search knobs (used when index_path points at a disk_index.json)
+disk_beam_width = config["disk_beam_width"]
+disk_search_list_size = config["disk_search_list_size"]
+disk_io_budget = config["disk_io_budget"]  # node reads per query
+
+# Memory-map index files instead of reading them into memory, so startup
+# does not wait for the whole index. Compaction adds to a copy of the main
+# index, which a mapped index cannot do, so single index files are only
+# mapped with live_updates off (sharded indexes are never compacted).
+index_mmap = config["index_mmap"]
+index_prefetch = config["index_prefetch"]
+
+def load_index(index_path, read_only=False):
     """
-    Load a TSV file into a Pandas DataFrame.
+    Load a FAISS index file, a sharded index or a disk-resident graph index.
 
     Parameters:
-    - file_path: Path to the TSV file.
+    - index_path: Path to hnsw_index.bin, to shards.json written by
+      create_index.py --shards, or to disk_index.json written by
+      create_disk_index.py.
+    - read_only: True if the index will never be compacted, so that a
+      single index file can be memory-mapped even with live_updates on.
 
     Returns:
-    - DataFrame with TSV contents.
+    - Index object exposing search(query_embeddings, top_k).
+    """
+    if os.path.basename(index_path) == "disk_index.json":
+        return DiskIndex(os.path.dirname(index_path), disk_beam_width, disk_search_list_size, disk_io_budget)
+    if index_path.endswith(".json"):
+        return ShardedIndex(index_path, mmap=index_mmap)
+    return read_index(index_path, index_mmap and (read_only or not config["live_updates"]))
+
+def index_resident_bytes(index, index_path):
     """
-    return pd.read_csv(file_path, sep="\t", header=None, names=["id", "text"])
+    Estimate the memory a loaded index takes from the files it was read
+    from (disk indexes only keep their PQ codes in memory).
+    """
+    if isinstance(index, DiskIndex):
+        return index.pq_codes.nbytes + index.pq_centroids.nbytes
+    if isinstance(index, ShardedIndex):
+        return sum(os.path.getsize(path) for path in index.paths)
+    return os.path.getsize(index_path)
+
+def mapped_index_files(index):
+    """
+    Return the files a loaded index reads through memory mappings.
+    """
+    if isinstance(index, ShardedIndex):
+        return index.paths if index_mmap else []
+    if isinstance(index, faiss.Index) and index_mmap and not config["live_updates"]:
+        return [loaded_index_path]
+    return []
+
+# Index (a single hnsw_index.bin, a shards.json or a disk_index.json).
+# Upserts and deletes are logged to wal_path; after a compaction the WAL
+# points at the newest compacted index, which is loaded instead.
+index_path = config["index_path"]
+wal_path = config["wal_path"]
+loaded_index_path = current_index_path(wal_path, index_path)
+index_future = loader.submit(startup.timed, "index", load_index, loaded_index_path)
+
+# Collection, memory-mapped from a store built by passage_store.py
+passage_store_path = config["passage_store_path"]
+passage_store_future = loader.submit(startup.timed, "passage_store", PassageStore, passage_store_path)
+
+index = index_future.result()
+index_files = mapped_index_files(index)
+
+# Compressed indexes (create_index.py --index-type hnsw_sq8/ivf_pq) re-rank
+# refine_factor * top_k candidates by exact inner product against the full
+# vectors on disk. Leave refine_vectors_path as None for hnsw_flat.
+refine_vectors_path = config["refine_vectors_path"]  # e.g. ".../embeddings.h5" or ".../collection_shards/manifest.json"
+refine_factor = config["refine_factor"]
+if refine_vectors_path:
+    index = RefinedIndex(index, startup.timed("refine_vectors", EmbeddingVectors, refine_vectors_path), refine_factor)
 
 def encode_texts(texts, model):
     """
-    Encode a list of texts using a SentenceTransformer model.
+    Encode a list of texts with the query encoder.
 
     Parameters:
     - texts: List of strings to encode.
-    - model: Preloaded SentenceTransformer model.
+    - model: QueryEncoder.
 
     Returns:
     - Numpy array of embeddings.
     """
-    embeddings = model.encode(texts, show_progress_bar=True)
-    return np.array(embeddings)
+    with stage_seconds.time(stage="encode"):
+        embeddings = model.encode(texts)
+    return embeddings
 
 
-def query_index(index, query_embeddings, top_k=10):
+def query_index(index, query_embeddings, top_k=10, ef_search=None, allowed_rows=None):
     """
     Query the FAISS index with query embeddings.
 
@@ -52,45 +158,651 @@ def query_index(index, query_embeddings, top_k=10):
     - index: Loaded FAISS index.
     - query_embeddings: Query embeddings (NumPy array).
     - top_k: Number of nearest neighbors to retrieve.
+    - ef_search: HNSW efSearch for this call (None keeps the index default).
+    - allowed_rows: Sorted rows the results are restricted to (None for all).
 
     Returns:
     - distances: Distance scores of the nearest neighbors.
     - indices: Indices of the nearest neighbors in the index.
     """
-    distances, indices = index.search(query_embeddings, top_k)
+    with stage_seconds.time(stage="search"):
+        distances, indices = search_index(index, query_embeddings, top_k, ef_search, allowed_rows)
+    batch_size.observe(len(query_embeddings))
     return distances, indices
 
-# Collection
-collection_path = "/Users/sahilfaizal/Desktop/BigData/project/backend/collection.tsv"
-collection_df = load_tsv(collection_path)
+passage_store = passage_store_future.result()
+
+# Live upserts/deletes on top of the main index. The compactor folds the
+# delta into a new main index once it holds compact_min_rows vectors
+# (native FAISS indexes only; sharded and disk indexes keep their delta).
+# With live_updates off the WAL is only replayed and the index is read-only,
+# which is what lets several worker processes serve the same files.
+live_updates = config["live_updates"]
+live_index = startup.timed("wal_replay", LiveIndex, index, passage_store, wal_path, not live_updates)
+index = live_index
+compact_interval_s = config["compact_interval_s"]
+compact_min_rows = config["compact_min_rows"]
+
+model = model_future.result()
+loader.shutdown()
+print(startup.report())
+
+# Two-level query cache: normalized query text -> embedding, and
+# (embedding key, top_k, efSearch) -> (distances, indices). The model is
+# uncased, so lowercasing during normalization does not change the embedding.
+embedding_cache = LRUCache(max_entries=config["embedding_cache_size"], ttl_seconds=config["embedding_cache_ttl_s"])
+result_cache = LRUCache(max_entries=config["result_cache_size"], ttl_seconds=config["result_cache_ttl_s"])
+
+def cache_samples(field):
+    return lambda: [
+        ({"cache": name}, cache.stats()[field]) for name, cache in (("embedding", embedding_cache), ("result", result_cache))
+    ]
+
+metrics.callback("cache_hits_total", "Cache lookups that hit.", "counter", cache_samples("hits"))
+metrics.callback("cache_misses_total", "Cache lookups that missed.", "counter", cache_samples("misses"))
+metrics.callback("cache_evictions_total", "Entries evicted to make room.", "counter", cache_samples("evictions"))
+metrics.callback("cache_entries", "Entries currently cached.", "gauge", cache_samples("size"))
+
+def encode_missing(queries, embeddings):
+    """
+    Encode the queries whose embedding is None in one model call, caching
+    the new embeddings. Returns the completed list of embeddings.
+    """
+    missing = [i for i, embedding in enumerate(embeddings) if embedding is None]
+    if missing:
+        encoded = encode_texts([queries[i] for i in missing], model)
+        encoded = encoded.reshape(1, -1) if encoded.ndim == 1 else encoded
+        for i, embedding in zip(missing, encoded):
+            embedding_cache.put(queries[i], embedding)
+            embeddings[i] = embedding
+    return embeddings
+
+def search_batch(batch):
+    """
+    Encode and search a batch of queries with one model call and one index
+    search per distinct efSearch value (normally one for the whole batch).
+
+    Parameters:
+    - batch: List of (query_text, top_k, ef_search, embedding, namespace)
+      tuples. embedding is the cached query embedding, or None if the query
+      still has to be encoded; namespace is the collection to search.
+
+    Returns:
+    - List of (distances, indices) pairs, one per query, each cut to its own top_k.
+    """
+    embeddings = encode_missing([item[0] for item in batch], [item[3] for item in batch])
+
+    groups = {}
+    for i, (_, _, ef_search, _, namespace) in enumerate(batch):
+        groups.setdefault((namespace.name, ef_search), []).append(i)
+    results = [None] * len(batch)
+    for (name, ef_search), positions in groups.items():
+        namespace = batch[positions[0]][4]
+        query_embeddings = np.vstack([embeddings[i] for i in positions]).astype(np.float32, copy=False)
+        max_top_k = max(batch[i][1] for i in positions)
+        distances, indices = query_index(namespace.index, query_embeddings, max_top_k, ef_search)
+        for row, i in enumerate(positions):
+            top_k = batch[i][1]
+            result = (distances[row, :top_k].copy(), indices[row, :top_k].copy())
+            result_cache.put((name, embedding_key(embeddings[i]), top_k, ef_search), result)
+            results[i] = result
+    return results
+
+# Requests arriving within max_wait_ms of each other share one encode + search call
+max_batch_size = config["batch_max_size"]
+max_wait_ms = config["batch_max_wait_ms"]
+search_batcher = MicroBatcher(search_batch, max_batch_size=max_batch_size, max_wait_ms=max_wait_ms)
+
+def prepare_query(query, top_k, ef_search, namespace):
+    """
+    Normalize a query and look it up in both cache levels. Embeddings are
+    shared by every collection (they all use the same model); results are
+    cached per collection.
+
+    Returns:
+    - item: (query_text, top_k, ef_search, embedding, namespace) tuple for search_batch.
+    - cached: Cached (distances, indices), or None on a miss.
+    """
+    query = normalize_query(query)
+    embedding = embedding_cache.get(query)
+    cached = None
+    if embedding is not None:
+        cached = result_cache.get((namespace.name, embedding_key(embedding), top_k, ef_search))
+    return (query, top_k, ef_search, embedding, namespace), cached
+
+def search(query, top_k, ef_search, namespace):
+    """
+    Return (distances, indices) for one query, skipping the model and the
+    index entirely when both cache levels hit.
+    """
+    item, cached = prepare_query(query, top_k, ef_search, namespace)
+    if cached is not None:
+        return cached
+    return search_batcher(item)
+
+def search_many(queries, top_k, ef_search, namespace):
+    """
+    Return (distances, indices) for each of a list of queries. Cache misses
+    are encoded and searched together in one search_batch call.
+    """
+    prepared = [prepare_query(query, top_k, ef_search, namespace) for query in queries]
+    results = [cached for _, cached in prepared]
+    missing = [i for i, result in enumerate(results) if result is None]
+    if missing:
+        for i, result in zip(missing, search_batch([prepared[i][0] for i in missing])):
+            results[i] = result
+    return results
+
+def filtered_search_many(queries, top_k, ef_search, allowed_rows, namespace):
+    """
+    Return (distances, indices) for each query, restricted to allowed_rows.
+    Filtered searches skip the micro-batcher and the result cache, whose keys
+    carry no filter, but reuse cached query embeddings.
+    """
+    queries = [normalize_query(query) for query in queries]
+    embeddings = encode_missing(queries, [embedding_cache.get(query) for query in queries])
+    query_embeddings = np.vstack(embeddings).astype(np.float32, copy=False)
+    distances, indices = query_index(namespace.index, query_embeddings, top_k, ef_search, allowed_rows)
+    return list(zip(distances, indices))
+
+# Passage metadata (msmarco_document_id per FAISS row) for filtered search,
+# built by metadata_store.py. Leave as None to filter by passage id only.
+metadata_store_path = config["metadata_store_path"]
+metadata_store = MetadataStore(metadata_store_path) if metadata_store_path else None
+max_filter_values = 10000
+
+# BM25 leg of sparse/hybrid search: the Pyserini Lucene index used by
+# evaluations/eval_BM25.py. Leave as None to serve dense search only.
+bm25_index_path = config["bm25_index_path"]  # e.g. ".../indexes/msmarco-passage"
+lexical_searcher = LexicalSearcher(bm25_index_path) if bm25_index_path else None
+hybrid_depth = 100  # candidates taken from each leg before fusion
+hybrid_executor = ThreadPoolExecutor(max_workers=8)
+
+# Collections: the index and stores configured above form the default
+# collection, which takes live updates and is always resident. Further
+# collections are listed in a collections file (see
+# collections.example.yaml), loaded read-only when a request first names
+# them, and evicted least recently used once their indexes exceed
+# collections_memory_budget_mb. Every collection must be embedded with the
+# query model. The budget is per serving process.
+default_collection = config["default_collection"]
+default_namespace = Namespace(default_collection, live_index, metadata_store, lexical_searcher)
+
+def load_namespace(name, spec):
+    """
+    Load a collection from the collections file as a read-only namespace.
+    """
+    collection_index = load_index(spec["index_path"], read_only=True)
+    resident_bytes = index_resident_bytes(collection_index, spec["index_path"])
+    if spec["refine_vectors_path"]:
+        collection_index = RefinedIndex(collection_index, EmbeddingVectors(spec["refine_vectors_path"]), refine_factor)
+    return Namespace(
+        name,
+        LiveIndex(collection_index, PassageStore(spec["passage_store_path"]), None),
+        MetadataStore(spec["metadata_store_path"]) if spec["metadata_store_path"] else None,
+        LexicalSearcher(spec["bm25_index_path"]) if spec["bm25_index_path"] else None,
+        resident_bytes,
+    )
+
+collections_path = config["collections_path"]
+collections = None
+if collections_path:
+    collections = NamespaceRegistry(
+        load_collection_specs(collections_path), load_namespace,
+        config["collections_memory_budget_mb"] * 2**20, pinned=[default_namespace],
+    )
+    for field, kind, help in [
+        ("loads", "counter", "Collections loaded on demand."),
+        ("evictions", "counter", "Collections evicted to stay within the memory budget."),
+        ("load_seconds", "counter", "Time spent loading collections."),
+    ]:
+        metrics.callback(
+            f"collection_{field}_total", help, kind,
+            lambda field=field: [({"collection": name}, value) for name, value in collections.stats()[field].items()],
+        )
+    metrics.callback(
+        "collection_resident_bytes", "Estimated memory of each resident collection's index.", "gauge",
+        lambda: [({"collection": name}, value) for name, value in collections.stats()["resident_bytes"].items()],
+    )
+
+def parse_collection(input):
+    """
+    Resolve the optional collection field to its namespace, loading it if needed.
+    """
+    name = input.get('collection', default_collection)
+    if name == default_collection:
+        return default_namespace
+    if collections is None or not isinstance(name, str):
+        raise ValueError(f"Unknown collection '{name}'.")
+    try:
+        return collections.get(name)
+    except KeyError:
+        raise ValueError(f"Unknown collection '{name}'; available: {', '.join(collections.names())}.")
+
+def dense_results(queries, top_k, ef_search, namespace, allowed_rows=None):
+    """
+    Dense leg: [(row, score), ...] per query, best first.
+    """
+    if allowed_rows is not None:
+        results = filtered_search_many(queries, top_k, ef_search, allowed_rows, namespace)
+    elif len(queries) == 1:
+        results = [search(queries[0], top_k, ef_search, namespace)]
+    else:
+        results = search_many(queries, top_k, ef_search, namespace)
+    return [[(int(row), float(score)) for score, row in zip(*result) if row >= 0] for result in results]
+
+def sparse_results(queries, top_k, namespace, allowed_rows=None):
+    """
+    BM25 leg: [(row, score), ...] per query, best first. Passage ids are
+    mapped to rows so both legs share keys; deleted or unknown passages, and
+    rows outside allowed_rows, are dropped.
+    """
+    with stage_seconds.time(stage="bm25"):
+        lexical_hits = namespace.lexical_searcher.search_many([normalize_query(query) for query in queries], top_k)
+    results = []
+    for hits in lexical_hits:
+        rows = ((namespace.index.find_row(passage_id), score) for passage_id, score in hits)
+        rows = [(row, score) for row, score in rows if row is not None]
+        if allowed_rows is not None and rows:
+            positions = np.searchsorted(allowed_rows, [row for row, _ in rows])
+            rows = [
+                (row, score) for (row, score), position in zip(rows, positions)
+                if position < len(allowed_rows) and allowed_rows[position] == row
+            ]
+        results.append(rows)
+    return results
+
+def hybrid_search_many(queries, top_k, ef_search, mode, fusion, weights, namespace, allowed_rows=None):
+    """
+    Run the enabled legs in parallel and fuse them per query.
+
+    Parameters:
+    - queries: List of query strings.
+    - mode: "sparse" for BM25 only, "hybrid" for BM25 + dense.
+    - fusion: "rrf" or "weighted".
+    - weights: (dense_weight, sparse_weight).
+    - allowed_rows: Sorted rows the results are restricted to (None for all).
+      The dense leg filters inside the index search; BM25 hits are filtered
+      afterwards, so a selective filter can leave the sparse leg short.
+
+    Returns:
+    - List of (scores, rows) pairs, one per query. Hybrid scores are fused
+      scores; sparse-only scores are BM25 scores.
+    """
+    depth = max(top_k, hybrid_depth)
+    sparse = hybrid_executor.submit(sparse_results, queries, depth, namespace, allowed_rows)
+    if mode == "sparse":
+        return [to_arrays(hits, top_k) for hits in sparse.result()]
+    dense = hybrid_executor.submit(dense_results, queries, depth, ef_search, namespace, allowed_rows)
+    return [
+        fuse([dense_hits, sparse_hits], weights, fusion, top_k)
+        for dense_hits, sparse_hits in zip(dense.result(), sparse.result())
+    ]
+
+# Optional cross-encoder re-rank stage: the top rerank_candidates dense (or
+# hybrid) results are re-scored and the best top_k returned. Requests whose
+# scores are not ready within rerank_deadline_ms keep the first-stage order.
+rerank_model_name = config["rerank_model_name"]  # e.g. "cross-encoder/ms-marco-MiniLM-L-6-v2"
+rerank_candidates = config["rerank_candidates"]
+rerank_deadline_ms = config["rerank_deadline_ms"]
+reranker = CrossEncoderReranker(rerank_model_name) if rerank_model_name else None
+if reranker is not None:
+    for field, kind, help in [
+        ("pairs_scored", "counter", "Query-passage pairs scored by the cross-encoder."),
+        ("model_calls", "counter", "Batched cross-encoder calls."),
+        ("scoring_seconds", "counter", "Time spent in cross-encoder calls."),
+        ("fallbacks", "counter", "Requests that missed the re-rank deadline and kept dense order."),
+    ]:
+        metrics.callback(f"rerank_{field}_total", help, kind, lambda field=field: [({}, reranker.stats()[field])])
+
+def rerank_hits(queries, hit_lists, top_k):
+    """
+    Re-order each query's hits by cross-encoder score and cut them to top_k.
+    Hits keep their first-stage order and scores if re-ranking misses the deadline.
+    """
+    passage_lists = [[hit["passage"] for hit in hits] for hits in hit_lists]
+    with stage_seconds.time(stage="rerank"):
+        score_lists = reranker.score_many(queries, passage_lists, rerank_deadline_ms / 1000)
+    reranked = []
+    for hits, scores in zip(hit_lists, score_lists):
+        if scores is None:
+            reranked.append(hits[:top_k])
+            continue
+        order = np.argsort(-scores, kind="stable")[:top_k]
+        reranked.append([dict(hits[i], score=float(scores[i])) for i in order])
+    return reranked
+
+# Request limits
+max_top_k = 1000
+max_batch_queries = 1024
+
+def parse_search_options(input, default_top_k):
+    """
+    Read and validate the optional top_k, efSearch and score_threshold fields.
+
+    Returns:
+    - (top_k, ef_search, score_threshold); raises ValueError with a message
+      for the client on invalid values.
+    """
+    top_k = input.get('top_k', default_top_k)
+    ef_search = input.get('efSearch')
+    score_threshold = input.get('score_threshold')
+    if not isinstance(top_k, int) or not 1 <= top_k <= max_top_k:
+        raise ValueError(f"'top_k' must be an integer between 1 and {max_top_k}.")
+    if ef_search is not None and (not isinstance(ef_search, int) or ef_search < 1):
+        raise ValueError("'efSearch' must be a positive integer.")
+    if score_threshold is not None and not isinstance(score_threshold, (int, float)):
+        raise ValueError("'score_threshold' must be a number.")
+    return top_k, ef_search, score_threshold
+
+def parse_filter(input, namespace):
+    """
+    Resolve the optional filter field to the rows a search may return.
+
+    The filter maps a field to a value or a list of values. A row matches a
+    field if it has any of the values, and must match every field given.
+    Fields: 'msmarco_document_id' (needs the metadata store) and 'id'
+    (passage ids).
+
+    Returns:
+    - Sorted int64 array of allowed rows, or None without a filter; raises
+      ValueError with a message for the client on invalid filters.
+    """
+    filter = input.get('filter')
+    if filter is None:
+        return None
+    if not isinstance(filter, dict) or not filter:
+        raise ValueError("'filter' must be an object mapping fields to values.")
+    allowed_rows = None
+    for field, values in filter.items():
+        values = [values] if isinstance(values, str) else values
+        if not isinstance(values, list) or not all(isinstance(value, str) for value in values):
+            raise ValueError(f"Filter values for '{field}' must be a string or a list of strings.")
+        if len(values) > max_filter_values:
+            raise ValueError(f"At most {max_filter_values} values per filter field.")
+        if field == 'msmarco_document_id':
+            if namespace.metadata_store is None:
+                raise ValueError("Filtering by 'msmarco_document_id' needs a metadata store; none is configured.")
+            rows = namespace.metadata_store.rows_for_documents(values)
+        elif field == 'id':
+            rows = [namespace.index.find_row(value) for value in values]
+            rows = np.unique(np.array([row for row in rows if row is not None], dtype=np.int64))
+        else:
+            raise ValueError(f"Unknown filter field '{field}'.")
+        allowed_rows = rows if allowed_rows is None else np.intersect1d(allowed_rows, rows)
+    return allowed_rows
+
+def parse_rerank_option(input):
+    """
+    Read the optional rerank flag (on by default when a re-ranker is configured).
+    """
+    rerank = input.get('rerank', reranker is not None)
+    if not isinstance(rerank, bool):
+        raise ValueError("'rerank' must be true or false.")
+    if rerank and reranker is None:
+        raise ValueError("Re-ranking needs a cross-encoder, and none is configured.")
+    return rerank
+
+def parse_mode_options(input, namespace):
+    """
+    Read and validate the optional mode, fusion, dense_weight and sparse_weight fields.
+
+    Returns:
+    - (mode, fusion, (dense_weight, sparse_weight)); raises ValueError with a
+      message for the client on invalid values.
+    """
+    mode = input.get('mode', 'dense')
+    fusion = input.get('fusion', 'rrf')
+    weights = (input.get('dense_weight', 1.0), input.get('sparse_weight', 1.0))
+    if mode not in SEARCH_MODES:
+        raise ValueError(f"'mode' must be one of {', '.join(SEARCH_MODES)}.")
+    if fusion not in FUSION_METHODS:
+        raise ValueError(f"'fusion' must be one of {', '.join(FUSION_METHODS)}.")
+    if not all(isinstance(w, (int, float)) and w >= 0 for w in weights):
+        raise ValueError("'dense_weight' and 'sparse_weight' must be non-negative numbers.")
+    if mode != 'dense' and namespace.lexical_searcher is None:
+        raise ValueError(f"Mode '{mode}' needs a BM25 index, and none is configured.")
+    return mode, fusion, weights
+
+def build_hits(distances, indices, namespace, score_threshold=None):
+    """
+    Map one query's results to [{"id", "passage", "score"}, ...], dropping
+    padding, hits scoring below score_threshold and rows deleted since the
+    search.
+    """
+    keep = [
+        (float(score), int(row)) for score, row in zip(distances, indices)
+        if row >= 0 and (score_threshold is None or score >= score_threshold)
+    ]
+    with stage_seconds.time(stage="mapping"):
+        retrieved_ids, retrieved_texts = namespace.index.lookup([row for _, row in keep])
+    return [
+        {"id": passage_id, "passage": passage, "score": score}
+        for passage_id, passage, (score, _) in zip(retrieved_ids, retrieved_texts, keep)
+        if passage_id is not None
+    ]
 
 @app.route('/search', methods=['POST'])
 def retrieve_items():
     input = request.get_json()
-    response_data = []
-    # Generate embeddings
-    query_embeddings = encode_texts([input['query']], model)
-    query_embeddings = query_embeddings.reshape(1, -1) if query_embeddings.ndim == 1 else query_embeddings
-    # Query the index
-    top_k = 3  # Retrieve top 3 results per query
-    distances, indices = query_index(index, query_embeddings, top_k)
+    if not input or not input.get('query'):
+        return jsonify({"error": "No 'query' field found in request."}), 400
+    try:
+        namespace = parse_collection(input)
+        top_k, ef_search, score_threshold = parse_search_options(input, 3)  # top 3 results by default
+        mode, fusion, weights = parse_mode_options(input, namespace)
+        rerank = parse_rerank_option(input)
+        allowed_rows = parse_filter(input, namespace)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    fetch_k = max(top_k, rerank_candidates) if rerank else top_k
+    if mode != 'dense':
+        distances, indices = hybrid_search_many(
+            [input['query']], fetch_k, ef_search, mode, fusion, weights, namespace, allowed_rows
+        )[0]
+    elif allowed_rows is not None:
+        distances, indices = filtered_search_many([input['query']], fetch_k, ef_search, allowed_rows, namespace)[0]
+    else:
+        distances, indices = search(input['query'], fetch_k, ef_search, namespace)
     # Map retrieved indices to passage IDs and texts
-    print("Mapping results to passages...")
-    results = []
-    for query_idx, retrieved_indices in enumerate(indices):
-        # retrieved_passages = collection_df.iloc[retrieved_indices]
-        retrieved_passages = collection_df.iloc[retrieved_indices.tolist()]
-        results.append({
-        "query_text": input['query'],
-        "retrieved_ids": retrieved_passages["id"].tolist(),
-        "retrieved_texts": retrieved_passages["text"].tolist(),
-        "distances": distances[query_idx].tolist()
-    })
-    for result in results:
-        for i, passage_id in enumerate(result['retrieved_ids']):
-            response_data.append({"id": passage_id, "passage": result['retrieved_texts'][i]})
-    return jsonify(response_data), 200
-
-# Start the Flask application
+    hits = build_hits(distances, indices, namespace, score_threshold)
+    if rerank:
+        hits = rerank_hits([input['query']], [hits], top_k)[0]
+    response_data = [{"id": hit["id"], "passage": hit["passage"]} for hit in hits]
+    with stage_seconds.time(stage="serialize"):
+        response = jsonify(response_data)
+    return response, 200
+
+@app.route('/search/batch', methods=['POST'])
+def retrieve_items_batch():
+    input = request.get_json()
+    queries = input.get('queries') if input else None
+    if not isinstance(queries, list) or not queries or not all(isinstance(q, str) and q for q in queries):
+        return jsonify({"error": "'queries' must be a non-empty list of strings."}), 400
+    if len(queries) > max_batch_queries:
+        return jsonify({"error": f"At most {max_batch_queries} queries per request."}), 400
+    try:
+        namespace = parse_collection(input)
+        top_k, ef_search, score_threshold = parse_search_options(input, 10)
+        mode, fusion, weights = parse_mode_options(input, namespace)
+        rerank = parse_rerank_option(input)
+        allowed_rows = parse_filter(input, namespace)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    fetch_k = max(top_k, rerank_candidates) if rerank else top_k
+    if mode != 'dense':
+        search_results = hybrid_search_many(queries, fetch_k, ef_search, mode, fusion, weights, namespace, allowed_rows)
+    elif allowed_rows is not None:
+        search_results = filtered_search_many(queries, fetch_k, ef_search, allowed_rows, namespace)
+    else:
+        search_results = search_many(queries, fetch_k, ef_search, namespace)
+    hit_lists = [build_hits(distances, indices, namespace, score_threshold) for distances, indices in search_results]
+    if rerank:
+        hit_lists = rerank_hits(queries, hit_lists, top_k)
+    results = [{"query": query, "hits": hits} for query, hits in zip(queries, hit_lists)]
+    with stage_seconds.time(stage="serialize"):
+        response = jsonify({"results": results})
+    return response, 200
+
+@app.route('/upsert', methods=['POST'])
+def upsert_items():
+    if not live_updates:
+        return jsonify({"error": "This server is read-only (live_updates is off)."}), 403
+    input = request.get_json(silent=True)
+    if not isinstance(input, dict):
+        return jsonify({"error": "The request body must be a JSON object."}), 400
+    if input.get('collection', default_collection) != default_collection:
+        return jsonify({"error": f"Only the default collection '{default_collection}' takes updates."}), 403
+    passages = input.get('passages') or [input]
+    if not isinstance(passages, list) or not all(
+        isinstance(p, dict) and isinstance(p.get('id'), (str, int)) and p.get('id') != ''
+        and isinstance(p.get('passage'), str) and p['passage'] for p in passages
+    ):
+        return jsonify({"error": "Each passage needs an 'id' and a 'passage'."}), 400
+    ids = [str(p['id']) for p in passages]
+    texts = [p['passage'] for p in passages]
+    live_index.upsert(ids, texts, encode_texts(texts, model))
+    # Cached results may no longer reflect the index
+    result_cache.clear()
+    return jsonify({"upserted": len(ids)}), 200
+
+@app.route('/delete', methods=['POST'])
+def delete_items():
+    if not live_updates:
+        return jsonify({"error": "This server is read-only (live_updates is off)."}), 403
+    input = request.get_json(silent=True)
+    if not isinstance(input, dict):
+        return jsonify({"error": "The request body must be a JSON object."}), 400
+    if input.get('collection', default_collection) != default_collection:
+        return jsonify({"error": f"Only the default collection '{default_collection}' takes updates."}), 403
+    ids = input.get('ids') or ([input['id']] if input.get('id') else [])
+    if not ids:
+        return jsonify({"error": "No 'ids' field found in request."}), 400
+    if not isinstance(ids, list) or not all(isinstance(i, (str, int)) for i in ids):
+        return jsonify({"error": "'ids' must be a list of passage ids."}), 400
+    deleted = live_index.delete([str(i) for i in ids])
+    result_cache.clear()
+    return jsonify({"deleted": deleted}), 200
+
+@app.before_request
+def start_request_timer():
+    g.request_start = time.perf_counter()
+    g.profile = profiler.start()
+
+def request_endpoint():
+    return request.url_rule.rule if request.url_rule else "unmatched"
+
+def record_request(status):
+    endpoint = request_endpoint()
+    request_seconds.observe(time.perf_counter() - g.request_start, endpoint=endpoint)
+    requests_total.inc(endpoint=endpoint, status=status)
+    if status >= 400:
+        errors_total.inc(endpoint=endpoint, status=status)
+    g.request_recorded = True
+
+@app.after_request
+def record_request_metrics(response):
+    record_request(response.status_code)
+    return response
+
+@app.teardown_request
+def finish_request(exc):
+    # Runs even when an exception propagates past the after_request hooks
+    # (e.g. with debug=True), so the profiler is always stopped and released
+    if "request_start" in g and not g.get("request_recorded"):
+        record_request(500)
+    path = profiler.stop(g.pop("profile", None), request_endpoint().strip("/").replace("/", "_") or "root")
+    if path:
+        print(f"Slow request profile written to {path}")
+
+@app.route('/metrics', methods=['GET'])
+def prometheus_metrics():
+    return Response(metrics.render(), mimetype="text/plain; version=0.0.4")
+
+@app.route('/stats', methods=['GET'])
+def cache_stats():
+    stats = {
+        "embedding_cache": embedding_cache.stats(),
+        "result_cache": result_cache.stats(),
+    }
+    if reranker is not None:
+        stats["rerank"] = reranker.stats()
+    if collections is not None:
+        stats["collections"] = collections.stats()
+    return jsonify(stats), 200
+
+# Readiness stages of this process: loading until the warmup queries have
+# run, then serving (ready) while memory-mapped index files are still being
+# pulled into the page cache, then warm
+ready = threading.Event()
+warm = threading.Event()
+
+def warmup():
+    """
+    Run the configured warmup queries through the full search path, so the
+    first real requests do not pay for lazy initialization and cold pages.
+    """
+    start = time.time()
+    for query in config["warmup_queries"]:
+        distances, indices = search(query, 10, None, default_namespace)
+        build_hits(distances, indices, default_namespace)
+    # Warmup results must not be served from the cache as if they were real traffic
+    result_cache.clear()
+    startup.record("warmup", time.time() - start)
+    startup.record("time_to_ready", startup.elapsed())
+    ready.set()
+    print(f"Worker {os.getpid()} warmed up in {time.time() - start:.1f}s")
+
+def prefetch_index():
+    """
+    Read the memory-mapped index files once, so searches stop faulting pages in from disk.
+    """
+    start = time.time()
+    count = prefetch_files(index_files)
+    startup.record("prefetch", time.time() - start)
+    warm.set()
+    print(f"Worker {os.getpid()} prefetched {count / 2**20:.0f} MiB of index files in {time.time() - start:.1f}s")
+
+def init_worker(num_threads=None):
+    """
+    Start this serving process's threads. Called once per process after it
+    is forked (see gunicorn.conf.py), since threads started before a fork
+    do not exist in the child.
+
+    Parameters:
+    - num_threads: Encoder and FAISS threads for this process (None keeps the defaults).
+    """
+    model.start(num_threads)
+    if num_threads:
+        faiss.omp_set_num_threads(num_threads)
+    if live_updates and isinstance(live_index.main, faiss.Index):
+        live_index.start_compactor(os.path.dirname(wal_path), compact_interval_s, compact_min_rows)
+    threading.Thread(target=warmup, daemon=True).start()
+    if index_prefetch and index_files:
+        threading.Thread(target=prefetch_index, daemon=True).start()
+    else:
+        warm.set()
+
+@app.route('/health', methods=['GET'])
+def health():
+    # Liveness: the process is up and serving requests
+    return jsonify({"status": "ok"}), 200
+
+@app.route('/ready', methods=['GET'])
+def readiness():
+    # Readiness: models and indexes are loaded and the warmup queries have run.
+    # stage stays "serving" until mapped index files are in the page cache.
+    if not ready.is_set():
+        return jsonify({"status": "warming up", "stage": "loading"}), 503
+    return jsonify({
+        "status": "ready",
+        "stage": "warm" if warm.is_set() else "serving",
+        "pid": os.getpid(),
+        "ntotal": live_index.ntotal,
+        "startup": startup.stages,
+    }), 200
+
+# Start the Flask development server; use gunicorn.conf.py in production
 if __name__ == '__main__':
-    app.run(debug=True)
+    init_worker()
+    app.run(debug=True, use_reloader=False)
@@ -0,0 +1,85 @@
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+
+class MicroBatcher:
+    """
+    Coalesce concurrent requests into batches for a single batched call.
+
+    Callers submit one item at a time and block on the returned future. A
+    background thread collects items until either max_batch_size items are
+    waiting or max_wait_ms has passed since the first one arrived, then calls
+    process_batch once with the whole list.
+
+    Parameters:
+    - process_batch: Function taking a list of items and returning a list of
+      results in the same order.
+    - max_batch_size: Maximum number of items per batch.
+    - max_wait_ms: Maximum time the oldest item waits for the batch to fill.
+    """
+
+    def __init__(self, process_batch, max_batch_size=32, max_wait_ms=5):
+        self.process_batch = process_batch
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.0
+        self._queue = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def _ensure_started(self):
+        # Started lazily so the thread is created in the process that serves requests
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, daemon=True)
+                self._thread.start()
+
+    def submit(self, item):
+        """
+        Queue an item for the next batch.
+
+        Returns:
+        - Future resolving to the item's result.
+        """
+        self._ensure_started()
+        future = Future()
+        self._queue.put((item, future))
+        return future
+
+    def __call__(self, item, timeout=None):
+        """
+        Submit an item and wait for its result.
+        """
+        return self.submit(item).result(timeout=timeout)
+
+    def _collect(self):
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            # Callers that gave up and cancelled their future are skipped
+            batch = [(item, future) for item, future in self._collect() if future.set_running_or_notify_cancel()]
+            if not batch:
+                continue
+            items = [item for item, _ in batch]
+            try:
+                results = self.process_batch(items)
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+            for (_, future), result in zip(batch, results):
+                future.set_result(result)
@@ -0,0 +1,86 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+
+def normalize_query(text):
+    """
+    Normalize query text so trivially different spellings share cache entries.
+
+    Lowercases the text and collapses runs of whitespace.
+    """
+    return " ".join(text.lower().split())
+
+
+def embedding_key(embedding):
+    """
+    Return a compact, hashable key for a query embedding.
+    """
+    return hashlib.blake2b(embedding.tobytes(), digest_size=16).digest()
+
+
+class LRUCache:
+    """
+    Thread-safe cache with LRU eviction, a per-entry TTL and hit/miss counters.
+
+    Parameters:
+    - max_entries: Maximum number of entries kept; the least recently used
+      entry is evicted when the cache is full.
+    - ttl_seconds: Entries older than this are treated as misses and dropped.
+      None disables expiry.
+    """
+
+    def __init__(self, max_entries=10000, ttl_seconds=3600):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        """
+        Return the cached value for key, or None on a miss.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                value, expires_at = entry
+                if expires_at is None or expires_at > time.monotonic():
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._entries[key]
+            self.misses += 1
+            return None
+
+    def put(self, key, value):
+        expires_at = None if self.ttl_seconds is None else time.monotonic() + self.ttl_seconds
+        with self._lock:
+            self._entries[key] = (value, expires_at)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        """
+        Return size and hit/miss counters as a dict.
+        """
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "max_entries": self.max_entries,
+                "ttl_seconds": self.ttl_seconds,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
@@ -0,0 +1,106 @@
+import os
+
+import yaml
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Every setting and its default. A YAML file named by VECTORDB_CONFIG
+# overrides these, and VECTORDB_<KEY> environment variables (parsed as YAML
+# values, e.g. VECTORDB_DISK_IO_BUDGET=512 or VECTORDB_BM25_INDEX_PATH=null)
+# override both. Relative paths are resolved against the config file's
+# directory, or the backend directory when there is no file.
+DEFAULTS = {
+    "model_name": "msmarco-MiniLM-L6-cos-v5",
+    # "torch", or "onnx" to serve an export written by encoders.py from
+    # encoder_path (encoder_file picks the plain or int8 graph inside it)
+    "encoder_backend": "torch",
+    "encoder_path": None,
+    "encoder_file": None,
+    # hnsw_index.bin, shards.json or disk_index.json
+    "index_path": "hnsw_index.bin",
+    "wal_path": "live_index.wal",
+    "passage_store_path": "passage_store",
+    # Full vectors for exact re-ranking of compressed indexes (None for hnsw_flat)
+    "refine_vectors_path": None,
+    "refine_factor": 4,
+    # Memory-map index files (single files only with live_updates off) and
+    # read them into the page cache in the background once serving
+    "index_mmap": True,
+    "index_prefetch": True,
+    # Query caches: normalized query -> embedding, and embedding + search
+    # options -> results (entries are evicted least recently used or on expiry)
+    "embedding_cache_size": 100000,
+    "embedding_cache_ttl_s": 3600,
+    "result_cache_size": 100000,
+    "result_cache_ttl_s": 600,
+    # Micro-batching window: concurrent searches arriving within
+    # batch_max_wait_ms of each other share one encode + search call
+    "batch_max_size": 32,
+    "batch_max_wait_ms": 5,
+    # Disk index search knobs (used when index_path points at a disk_index.json)
+    "disk_beam_width": 4,
+    "disk_search_list_size": 64,
+    "disk_io_budget": 256,
+    # Upserts/deletes and background compaction; needs a single serving process
+    "live_updates": True,
+    "compact_interval_s": 300,
+    "compact_min_rows": 10000,
+    # Name of the collection above, and a YAML file of further collections
+    # loaded on demand under a per-process memory budget
+    "default_collection": "msmarco-passage",
+    "collections_path": None,
+    "collections_memory_budget_mb": 8192,
+    # Column store of passage metadata for filtered search (built by metadata_store.py)
+    "metadata_store_path": None,
+    "bm25_index_path": None,
+    "rerank_model_name": None,
+    "rerank_candidates": 100,
+    "rerank_deadline_ms": 150,
+    # Sampled cProfile traces of slow requests (profile_sample_rate 0 disables)
+    "profile_sample_rate": 0.0,
+    "profile_slow_ms": 500,
+    "profile_dir": "profiles",
+    # Queries run by every worker before /ready reports ready
+    "warmup_queries": [
+        "what is the capital of france",
+        "how long does it take to boil an egg",
+        "symptoms of vitamin d deficiency",
+    ],
+}
+
+PATH_KEYS = (
+    "encoder_path", "index_path", "wal_path", "passage_store_path", "refine_vectors_path", "metadata_store_path",
+    "bm25_index_path", "collections_path", "profile_dir",
+)
+
+
+def load_config(path=None):
+    """
+    Load the serving configuration.
+
+    Parameters:
+    - path: YAML config file; defaults to $VECTORDB_CONFIG, and to the
+      built-in defaults when neither is set.
+
+    Returns:
+    - Dict with every key of DEFAULTS; raises ValueError on unknown keys.
+    """
+    path = path or os.environ.get("VECTORDB_CONFIG")
+    config = dict(DEFAULTS)
+    base_dir = BACKEND_DIR
+    if path:
+        with open(path) as f:
+            config.update(yaml.safe_load(f) or {})
+        base_dir = os.path.dirname(os.path.abspath(path))
+    for key in DEFAULTS:
+        value = os.environ.get(f"VECTORDB_{key.upper()}")
+        if value is not None:
+            config[key] = yaml.safe_load(value)
+
+    unknown = set(config) - set(DEFAULTS)
+    if unknown:
+        raise ValueError(f"Unknown config keys: {', '.join(sorted(unknown))}")
+    for key in PATH_KEYS:
+        if config[key] is not None:
+            config[key] = os.path.join(base_dir, os.path.expanduser(config[key]))
+    return config
@@ -0,0 +1,140 @@
+import json
+import os
+import sys
+
+import numpy as np
+
+from index_search import BRUTE_FORCE_MAX_ROWS, empty_results, exact_search
+
+# The on-disk layout is defined once, next to the index builder
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "index_creation"))
+from disk_index_format import FORMAT_VERSION, GRAPH_FILE, META_FILE, PQ_CENTROIDS_FILE, PQ_CODES_FILE, node_record_dtype
+
+
+def is_allowed(rows, allowed_rows):
+    """
+    Mask of the rows that appear in the sorted allowed_rows, by binary search
+    (a bitmap over every row would cost ntotal bytes per filtered query).
+    """
+    positions = np.minimum(np.searchsorted(allowed_rows, rows), len(allowed_rows) - 1)
+    return allowed_rows[positions] == rows
+
+
+class DiskIndex:
+    """
+    Beam search over a disk-resident graph index.
+
+    Node records (neighbors + full vector) stay on disk in a memory-mapped
+    file, so opening the index costs only loading the PQ codes. The search
+    keeps a candidate list ranked by PQ-approximated scores, reads the
+    beam_width best unexpanded nodes per step in one batched read, and ranks
+    the final results by exact scores from the full vectors it has read.
+
+    Parameters:
+    - index_dir: Directory written by create_disk_index.py.
+    - beam_width: Nodes read from disk per search step.
+    - search_list_size: Size of the candidate list (the recall/latency knob).
+    - io_budget: Maximum node reads per query (None for unlimited).
+    """
+
+    def __init__(self, index_dir, beam_width=4, search_list_size=64, io_budget=None):
+        if beam_width < 1 or search_list_size < 1 or (io_budget is not None and io_budget < 1):
+            raise ValueError("beam_width, search_list_size and io_budget must be at least 1")
+        with open(os.path.join(index_dir, META_FILE)) as f:
+            self.meta = json.load(f)
+        if self.meta.get("version", 1) > FORMAT_VERSION:
+            raise ValueError(f"{index_dir} has disk index format version {self.meta['version']}; "
+                             f"this reader supports up to {FORMAT_VERSION}")
+        self.d = self.meta["dim"]
+        self.ntotal = self.meta["ntotal"]
+        self.entry_point = self.meta["entry_point"]
+        self.beam_width = beam_width
+        self.search_list_size = search_list_size
+        self.io_budget = io_budget
+
+        record_dtype = node_record_dtype(self.meta["max_degree"], self.d)
+        self.records = np.memmap(
+            os.path.join(index_dir, GRAPH_FILE), dtype=record_dtype, mode="r", shape=(self.ntotal,)
+        )
+        self.pq_codes = np.load(os.path.join(index_dir, PQ_CODES_FILE))
+        self.pq_centroids = np.load(os.path.join(index_dir, PQ_CENTROIDS_FILE))
+        self._subspaces = np.arange(self.pq_codes.shape[1])[None, :]
+
+    def _read_nodes(self, rows):
+        # One batched read of the requested records, in file order
+        order = np.argsort(rows)
+        records = np.empty(len(rows), dtype=self.records.dtype)
+        records[order] = self.records[rows[order]]
+        return records
+
+    def _search_one(self, query, top_k, search_list_size, beam_width, io_budget, allowed_rows=None):
+        num_subspaces, _, sub_dim = self.pq_centroids.shape
+        # Inner product of each query sub-vector with every PQ centroid
+        table = np.einsum("mkd,md->mk", self.pq_centroids, query.reshape(num_subspaces, sub_dim))
+
+        def approx_scores(rows):
+            return table[self._subspaces, self.pq_codes[rows]].sum(axis=1)
+
+        candidates = np.array([self.entry_point], dtype=np.int64)
+        scores = approx_scores(candidates)
+        expanded = np.zeros(1, dtype=bool)
+        seen = {self.entry_point}
+        result_rows, result_scores = [], []
+        reads = 0
+
+        while io_budget is None or reads < io_budget:
+            keep = np.argsort(-scores, kind="stable")[:search_list_size]
+            candidates, scores, expanded = candidates[keep], scores[keep], expanded[keep]
+            frontier = np.nonzero(~expanded)[0][:beam_width]
+            if io_budget is not None:
+                frontier = frontier[:io_budget - reads]
+            if len(frontier) == 0:
+                break
+            expanded[frontier] = True
+            reads += len(frontier)
+
+            records = self._read_nodes(candidates[frontier])
+            # Filtered-out nodes are still expanded, so the walk can pass through them
+            keep = slice(None) if allowed_rows is None else is_allowed(candidates[frontier], allowed_rows)
+            result_rows.append(candidates[frontier][keep])
+            result_scores.append((records["vector"] @ query)[keep])
+
+            new_rows = [
+                int(n) for record in records for n in record["neighbors"][:record["degree"]] if int(n) not in seen
+            ]
+            if new_rows:
+                new_rows = np.unique(np.array(new_rows, dtype=np.int64))
+                seen.update(new_rows.tolist())
+                candidates = np.concatenate([candidates, new_rows])
+                scores = np.concatenate([scores, approx_scores(new_rows)])
+                expanded = np.concatenate([expanded, np.zeros(len(new_rows), dtype=bool)])
+
+        rows = np.concatenate(result_rows)
+        exact = np.concatenate(result_scores)
+        best = np.argsort(-exact)[:top_k]
+        return exact[best], rows[best]
+
+    def search(self, query_embeddings, top_k, ef_search=None, allowed_rows=None):
+        """
+        Search the graph for each query; returns FAISS-style (distances, indices).
+
+        Parameters:
+        - query_embeddings: (num_queries, dim) float32 array.
+        - top_k: Number of results per query.
+        - ef_search: Overrides the default candidate list size (the disk
+          index's equivalent of HNSW efSearch); raised to at least top_k.
+        - allowed_rows: Sorted rows that may be returned (None for all). Small
+          sets are read and scored exactly; larger ones filter the beam
+          search's results.
+        """
+        if allowed_rows is not None and len(allowed_rows) <= BRUTE_FORCE_MAX_ROWS:
+            if len(allowed_rows) == 0:
+                return empty_results(len(query_embeddings), top_k)
+            return exact_search(self._read_nodes(allowed_rows)["vector"], allowed_rows, query_embeddings, top_k)
+        search_list_size = max(top_k, ef_search or self.search_list_size)
+        distances, indices = empty_results(len(query_embeddings), top_k)
+        for q, query in enumerate(query_embeddings):
+            d, i = self._search_one(query, top_k, search_list_size, self.beam_width, self.io_budget, allowed_rows)
+            distances[q, :len(d)] = d
+            indices[q, :len(i)] = i
+        return distances, indices
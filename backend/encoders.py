@@ -0,0 +1,127 @@
+import argparse
+import threading
+
+import numpy as np
+
+# torch runs the model as loaded; onnx runs an exported ONNX graph (plain or
+# int8 dynamically quantized) on ONNX Runtime, which needs
+# `pip install optimum[onnxruntime]`
+ENCODER_BACKENDS = ("torch", "onnx")
+# Instruction sets export_dynamic_quantized_onnx_model can target
+QUANTIZATION_CONFIGS = ("arm64", "avx2", "avx512", "avx512_vnni")
+
+
+def load_sentence_transformer(model_name, backend="torch", file_name=None, num_threads=None):
+    """
+    Load a SentenceTransformer with the given backend.
+
+    Parameters:
+    - model_name: Model name or path; for onnx, usually a directory written by export_onnx().
+    - backend: "torch" or "onnx".
+    - file_name: ONNX file inside the model directory (e.g.
+      "onnx/model_qint8_avx512_vnni.onnx"); None picks onnx/model.onnx.
+    - num_threads: Intra-op threads of the ONNX Runtime session (None keeps
+      its default). torch threads are process-wide and set with torch.set_num_threads.
+    """
+    if backend not in ENCODER_BACKENDS:
+        raise ValueError(f"Unknown encoder backend '{backend}'; expected one of {', '.join(ENCODER_BACKENDS)}")
+    # Imported here so that importing torch overlaps with loading the index
+    from sentence_transformers import SentenceTransformer
+    if backend == "torch":
+        return SentenceTransformer(model_name)
+    model_kwargs = {"provider": "CPUExecutionProvider"}
+    if file_name:
+        model_kwargs["file_name"] = file_name
+    if num_threads:
+        import onnxruntime
+        session_options = onnxruntime.SessionOptions()
+        session_options.intra_op_num_threads = num_threads
+        session_options.inter_op_num_threads = 1
+        model_kwargs["session_options"] = session_options
+    return SentenceTransformer(model_name, backend="onnx", model_kwargs=model_kwargs)
+
+
+class QueryEncoder:
+    """
+    Query encoder with a pluggable backend.
+
+    torch models are loaded at construction, so gunicorn's preloading master
+    shares them copy-on-write with its workers. ONNX Runtime sessions start
+    their thread pools when created and those threads do not survive a fork,
+    so onnx models are loaded by start() in each worker instead (or by the
+    first encode() call).
+
+    Parameters:
+    - model_name: Model name or path.
+    - backend: "torch" or "onnx".
+    - file_name: ONNX file inside the model directory, for the onnx backend.
+    - batch_size: Texts per forward pass.
+    """
+
+    def __init__(self, model_name, backend="torch", file_name=None, batch_size=64):
+        if backend not in ENCODER_BACKENDS:
+            raise ValueError(f"Unknown encoder backend '{backend}'; expected one of {', '.join(ENCODER_BACKENDS)}")
+        self.model_name = model_name
+        self.backend = backend
+        self.file_name = file_name
+        self.batch_size = batch_size
+        self._lock = threading.Lock()
+        self.model = load_sentence_transformer(model_name) if backend == "torch" else None
+
+    def start(self, num_threads=None):
+        """
+        Pin this process's encoder threads and load the model if it is not loaded yet.
+        """
+        if num_threads and self.backend == "torch":
+            import torch
+            torch.set_num_threads(num_threads)
+        with self._lock:
+            if self.model is None:
+                self.model = load_sentence_transformer(self.model_name, self.backend, self.file_name, num_threads)
+        return self.model
+
+    def encode(self, texts):
+        """
+        Encode a list of texts into a float32 array of shape (len(texts), dim).
+        """
+        model = self.model or self.start()
+        embeddings = model.encode(texts, batch_size=self.batch_size, show_progress_bar=False, convert_to_numpy=True)
+        return np.asarray(embeddings, dtype=np.float32)
+
+
+def export_onnx(model_name, output_dir, quantization=None):
+    """
+    Export a SentenceTransformer to ONNX, optionally with an int8 dynamically
+    quantized copy of the graph.
+
+    Parameters:
+    - model_name: Model name or path to export.
+    - output_dir: Directory the model (tokenizer, config and onnx/ graphs) is saved to.
+    - quantization: One of QUANTIZATION_CONFIGS to also write an int8 graph
+      for that instruction set, or None.
+
+    Returns:
+    - The file_name to serve, relative to output_dir.
+    """
+    from sentence_transformers import SentenceTransformer, export_dynamic_quantized_onnx_model
+    model = SentenceTransformer(model_name, backend="onnx", model_kwargs={"provider": "CPUExecutionProvider"})
+    model.save_pretrained(output_dir)
+    if quantization is None:
+        return "onnx/model.onnx"
+    export_dynamic_quantized_onnx_model(model, quantization, output_dir)
+    return f"onnx/model_qint8_{quantization}.onnx"
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export the query encoder to ONNX for encoder_backend: onnx.")
+    parser.add_argument("model_name", help="Model name or path, e.g. msmarco-MiniLM-L6-cos-v5")
+    parser.add_argument("output_dir", help="Directory to write the exported model to")
+    parser.add_argument("--quantize", choices=QUANTIZATION_CONFIGS, default=None,
+                        help="Also write an int8 dynamically quantized graph for this instruction set")
+    args = parser.parse_args()
+
+    file_name = export_onnx(args.model_name, args.output_dir, args.quantize)
+    print("Serve it with:")
+    print("  encoder_backend: onnx")
+    print(f"  encoder_path: {args.output_dir}")
+    print(f"  encoder_file: {file_name}")
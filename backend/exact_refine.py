@@ -0,0 +1,73 @@
+import os
+import sys
+
+import numpy as np
+
+from index_search import search_index
+
+# The embedding readers are shared with the index builder
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "index_creation"))
+
+
+class EmbeddingVectors:
+    """
+    Random access to the full float32 embeddings by FAISS row id, memory-mapped from disk.
+
+    Parameters:
+    - path: HDF5 file read by index_creation/embedding_format.py's
+      EmbeddingFile (the versioned float32 / float16 / int8 format, or a
+      legacy file with an 'embedding' or 'embeddings' dataset), or the
+      manifest.json of the .npy shards written by spark_embeddings.py.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        if path.endswith(".json"):
+            from embedding_shards import ShardedEmbeddings
+            self._source = ShardedEmbeddings(path)
+        else:
+            from embedding_format import EmbeddingFile
+            self._source = EmbeddingFile(path)
+
+    def take(self, rows):
+        """
+        Return the float32 vectors of the given rows, in the given order.
+        """
+        return self._source.take(rows)
+
+
+class RefinedIndex:
+    """
+    Re-rank the candidates of a compressed index by exact inner product.
+
+    Fetches refine_factor * top_k candidates from the wrapped index, scores
+    them against the full vectors read from disk and keeps the best top_k,
+    so the compressed codes only need to get the right passages into the
+    candidate list.
+
+    Parameters:
+    - index: Compressed index (e.g. IVF-PQ or HNSW-SQ8) exposing search().
+    - vectors: EmbeddingVectors holding the full embeddings.
+    - refine_factor: Candidates fetched per result kept.
+    """
+
+    def __init__(self, index, vectors, refine_factor=4):
+        self.index = index
+        self.vectors = vectors
+        self.refine_factor = refine_factor
+        self.d = index.d
+        self.ntotal = index.ntotal
+
+    def search(self, query_embeddings, top_k, ef_search=None, allowed_rows=None):
+        _, candidates = search_index(self.index, query_embeddings, top_k * self.refine_factor, ef_search, allowed_rows)
+        distances = np.full((len(query_embeddings), top_k), -np.inf, dtype=np.float32)
+        indices = np.full((len(query_embeddings), top_k), -1, dtype=np.int64)
+        for q, rows in enumerate(candidates):
+            rows = np.unique(rows[rows >= 0])
+            if len(rows) == 0:
+                continue
+            scores = self.vectors.take(rows) @ query_embeddings[q]
+            best = np.argsort(-scores)[:top_k]
+            distances[q, :len(best)] = scores[best]
+            indices[q, :len(best)] = rows[best]
+        return distances, indices
@@ -0,0 +1,36 @@
+# Production server: gunicorn -c gunicorn.conf.py (run from backend/)
+#
+# The app is imported once in the master before the workers fork
+# (preload_app), so the model weights are shared copy-on-write and the
+# memory-mapped index files, passage store, disk index and embedding files
+# are shared through the page cache. Each worker then starts its own threads
+# and warms up; /ready answers 503 until it has.
+import multiprocessing
+import os
+
+from config import load_config
+
+wsgi_app = "app:app"
+bind = os.environ.get("VECTORDB_BIND", "0.0.0.0:5000")
+preload_app = True
+
+workers = int(os.environ.get("VECTORDB_WORKERS", multiprocessing.cpu_count() // 2 or 1))
+# Threads per worker let concurrent requests share micro-batches
+worker_class = "gthread"
+threads = int(os.environ.get("VECTORDB_THREADS", 8))
+timeout = 120
+keepalive = 5
+
+# Split the cores between workers instead of every worker using all of them
+compute_threads = max(1, multiprocessing.cpu_count() // workers)
+
+if workers > 1 and load_config()["live_updates"]:
+    raise SystemExit(
+        "live_updates needs a single worker (each worker would keep its own delta "
+        "and write the same WAL); set VECTORDB_LIVE_UPDATES=false or VECTORDB_WORKERS=1"
+    )
+
+
+def post_fork(server, worker):
+    from app import init_worker
+    init_worker(compute_threads)
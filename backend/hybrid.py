@@ -0,0 +1,97 @@
+import numpy as np
+
+SEARCH_MODES = ("dense", "sparse", "hybrid")
+FUSION_METHODS = ("rrf", "weighted")
+
+
+class LexicalSearcher:
+    """
+    BM25 search over a Pyserini Lucene index (the one used by
+    evaluations/eval_BM25.py). Pyserini is only needed when this is used.
+
+    Parameters:
+    - index_dir: Path to the Lucene index.
+    - k1, b: BM25 parameters.
+    - threads: Threads used by Lucene for batch searches.
+    """
+
+    def __init__(self, index_dir, k1=0.9, b=0.4, threads=4):
+        try:
+            from pyserini.search.lucene import LuceneSearcher
+        except ImportError:
+            from pyserini.search import SimpleSearcher as LuceneSearcher
+        self.searcher = LuceneSearcher(index_dir)
+        self.searcher.set_bm25(k1=k1, b=b)
+        self.threads = threads
+
+    def search_many(self, queries, top_k):
+        """
+        Return a [(docid, score), ...] list per query, best first.
+        """
+        qids = [str(i) for i in range(len(queries))]
+        hits = self.searcher.batch_search(queries, qids, k=top_k, threads=self.threads)
+        return [[(hit.docid, float(hit.score)) for hit in hits.get(qid, [])] for qid in qids]
+
+
+def reciprocal_rank_fusion(result_lists, weights, k=60):
+    """
+    Fuse ranked lists by weighted reciprocal rank: sum of weight / (k + rank).
+
+    Parameters:
+    - result_lists: Lists of (key, score) pairs, each best first.
+    - weights: One weight per list.
+    - k: RRF damping constant.
+
+    Returns:
+    - [(key, fused_score), ...] sorted best first; keys found in several
+      lists appear once.
+    """
+    fused = {}
+    for results, weight in zip(result_lists, weights):
+        for rank, (key, _) in enumerate(results, start=1):
+            fused[key] = fused.get(key, 0.0) + weight / (k + rank)
+    return sorted(fused.items(), key=lambda item: -item[1])
+
+
+def weighted_score_fusion(result_lists, weights):
+    """
+    Fuse scored lists by a weighted sum of min-max normalized scores; a key
+    missing from a list contributes 0 for that list.
+
+    Parameters and return value as for reciprocal_rank_fusion.
+    """
+    fused = {}
+    for results, weight in zip(result_lists, weights):
+        if not results:
+            continue
+        scores = np.array([score for _, score in results], dtype=np.float64)
+        low, span = scores.min(), scores.max() - scores.min()
+        for (key, _), score in zip(results, scores):
+            normalized = (score - low) / span if span > 0 else 1.0
+            fused[key] = fused.get(key, 0.0) + weight * normalized
+    return sorted(fused.items(), key=lambda item: -item[1])
+
+
+def to_arrays(results, top_k):
+    """
+    Turn a best-first [(key, score), ...] list into FAISS-style (scores, keys)
+    arrays of length top_k, padded with -1 like FAISS does.
+    """
+    scores = np.full(top_k, -np.inf, dtype=np.float32)
+    keys = np.full(top_k, -1, dtype=np.int64)
+    for rank, (key, score) in enumerate(results[:top_k]):
+        scores[rank] = score
+        keys[rank] = key
+    return scores, keys
+
+
+def fuse(result_lists, weights, method="rrf", top_k=10):
+    """
+    Fuse result lists with reciprocal-rank ("rrf") or weighted-score
+    ("weighted") fusion and return the top_k as (scores, keys) arrays.
+    """
+    if method == "rrf":
+        fused = reciprocal_rank_fusion(result_lists, weights)
+    else:
+        fused = weighted_score_fusion(result_lists, weights)
+    return to_arrays(fused, top_k)
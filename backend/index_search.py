@@ -0,0 +1,112 @@
+import faiss
+import numpy as np
+
+# Filters allowing at most this many rows are scored exactly instead of
+# searched through the graph, where so few allowed nodes would leave most of
+# the top-k empty
+BRUTE_FORCE_MAX_ROWS = 10000
+
+
+def read_index(path, mmap=False):
+    """
+    Read a FAISS index file, memory-mapped read-only if mmap is set.
+
+    A mapped index opens without reading its vectors, which are faulted in
+    from the page cache on first use and shared by every process on the
+    machine. FAISS builds without IO_FLAG_MMAP_IFC (before 1.10) map only
+    IVF inverted lists. Index types or files FAISS cannot map are read into
+    memory instead. Mapped indexes are read-only: adding to one, or to a
+    clone of one, aborts the process.
+    """
+    if not mmap:
+        return faiss.read_index(path)
+    flags = faiss.IO_FLAG_MMAP | getattr(faiss, "IO_FLAG_MMAP_IFC", 0) | faiss.IO_FLAG_READ_ONLY
+    try:
+        return faiss.read_index(path, flags)
+    except RuntimeError as e:
+        print(f"Cannot memory-map {path}, reading it into memory: {e}")
+        return faiss.read_index(path)
+
+
+def empty_results(num_queries, top_k):
+    """
+    FAISS-style (distances, indices) holding no results.
+    """
+    return (np.full((num_queries, top_k), -np.inf, dtype=np.float32),
+            np.full((num_queries, top_k), -1, dtype=np.int64))
+
+
+def exact_search(vectors, rows, query_embeddings, top_k):
+    """
+    Score query_embeddings against the given rows' vectors and keep the top_k.
+    """
+    distances, indices = empty_results(len(query_embeddings), top_k)
+    scores = query_embeddings @ vectors.T
+    best = np.argsort(-scores, axis=1, kind="stable")[:, :top_k]
+    count = best.shape[1]
+    distances[:, :count] = np.take_along_axis(scores, best, axis=1)
+    indices[:, :count] = rows[best]
+    return distances, indices
+
+
+def id_selector(allowed_rows, ntotal):
+    """
+    Return (selector, buffer) for a sorted array of allowed rows. The buffer
+    backs a bitmap selector and must stay referenced while it is used.
+    """
+    if len(allowed_rows) * 64 < ntotal:
+        return faiss.IDSelectorBatch(allowed_rows), None
+    mask = np.zeros(ntotal, dtype=bool)
+    mask[allowed_rows] = True
+    bitmap = np.packbits(mask, bitorder="little")
+    return faiss.IDSelectorBitmap(ntotal, faiss.swig_ptr(bitmap)), bitmap
+
+
+def search_index(index, query_embeddings, top_k, ef_search=None, allowed_rows=None):
+    """
+    Search a FAISS index or one of the backend's index wrappers with an
+    optional per-call efSearch.
+
+    Parameters:
+    - index: Native FAISS index, or a wrapper whose search() takes ef_search
+      and allowed_rows.
+    - query_embeddings: (num_queries, dim) float32 array.
+    - top_k: Number of nearest neighbors to retrieve.
+    - ef_search: HNSW search-time candidate list size; None keeps the index
+      default. Passed per call through SearchParameters, so concurrent
+      requests with different values do not interfere. Ignored by index
+      types without an HNSW graph.
+    - allowed_rows: Sorted int64 array of the only rows that may be returned,
+      or None for no filter. Small sets are scored exactly from the index's
+      stored vectors; larger ones are applied inside the search through an
+      IDSelector.
+
+    Returns:
+    - distances, indices: FAISS-style result arrays.
+    """
+    if not isinstance(index, faiss.Index):
+        return index.search(query_embeddings, top_k, ef_search=ef_search, allowed_rows=allowed_rows)
+    if allowed_rows is None:
+        if ef_search is not None and hasattr(index, "hnsw"):
+            params = faiss.SearchParametersHNSW(efSearch=ef_search)
+            return index.search(query_embeddings, top_k, params=params)
+        return index.search(query_embeddings, top_k)
+
+    if len(allowed_rows) == 0:
+        return empty_results(len(query_embeddings), top_k)
+    if len(allowed_rows) <= BRUTE_FORCE_MAX_ROWS:
+        try:
+            return exact_search(index.reconstruct_batch(allowed_rows), allowed_rows, query_embeddings, top_k)
+        except RuntimeError:
+            # Index cannot reconstruct vectors (e.g. IVF without a direct map)
+            pass
+    selector, bitmap = id_selector(allowed_rows, index.ntotal)
+    if hasattr(index, "hnsw"):
+        params = faiss.SearchParametersHNSW(sel=selector)
+        if ef_search is not None:
+            params.efSearch = ef_search
+    elif isinstance(index, faiss.IndexIVF):
+        params = faiss.SearchParametersIVF(sel=selector, nprobe=index.nprobe)
+    else:
+        params = faiss.SearchParameters(sel=selector)
+    return index.search(query_embeddings, top_k, params=params)
@@ -0,0 +1,434 @@
+import base64
+import json
+import os
+import shutil
+import threading
+import time
+
+import faiss
+import numpy as np
+
+from index_search import search_index
+from passage_store import PassageStore, write_passage_store
+from sharded_index import merge_topk
+
+# Files inside the state directory written next to each compacted index
+STATE_PASSAGES_DIR = "passages"  # passage store of the compacted upserted rows
+STATE_ROWS_FILE = "rows.npy"  # index row of each of those passages, ascending
+STATE_DELETED_FILE = "deleted.npy"  # every row deleted at the checkpoint
+
+
+def read_wal(wal_path):
+    """
+    Yield the records of a write-ahead log, skipping a torn final line.
+    """
+    if not wal_path or not os.path.exists(wal_path):
+        return
+    with open(wal_path) as f:
+        for line in f:
+            try:
+                yield json.loads(line)
+            except json.JSONDecodeError:
+                # Only the last line can be torn by a crash mid-write
+                return
+
+
+def current_index_path(wal_path, index_path):
+    """
+    Return the newest compacted index recorded in the WAL, or index_path if
+    nothing has been compacted yet.
+    """
+    for record in read_wal(wal_path):
+        if record["op"] == "checkpoint":
+            index_path = record["index_path"]
+    return index_path
+
+
+def remove_checkpoint(paths, keep=()):
+    """
+    Delete the index file and state directory of a superseded checkpoint.
+    """
+    for path in paths:
+        if not path or path in keep:
+            continue
+        if os.path.isdir(path):
+            shutil.rmtree(path, ignore_errors=True)
+        elif os.path.exists(path):
+            os.remove(path)
+
+
+class LiveIndex:
+    """
+    Search an immutable main index together with live upserts and deletes.
+
+    - Upserted vectors go to an exact in-memory delta index and get new rows
+      after the main index, so row ids stay stable.
+    - Deleted and replaced rows are marked in a tombstone bitmap and dropped
+      from results; the main index is over-fetched to make up for them.
+    - Every change is appended (and fsynced) to a JSON-lines write-ahead log
+      that is replayed on restart.
+    - compact() folds the delta into a copy of the main index, writes it to
+      disk and swaps it in without blocking searches. The passages of the
+      folded rows and the tombstones go to a state directory next to it, and
+      the WAL is rewritten to the checkpoint plus the rows still in the
+      delta, so neither the WAL nor the in-memory passages grow without bound.
+
+    Parameters:
+    - index: Main index; compaction needs a native FAISS index that supports add.
+    - passage_store: PassageStore holding the passages of the original rows.
+    - wal_path: Path of the write-ahead log, or None for an index without one.
+    - read_only: Only replay the write-ahead log, never open it for writing
+      (e.g. several workers serving the same files from a read-only volume);
+      upsert() and delete() then raise ValueError.
+    - max_overfetch: Cap on extra main-index results fetched to cover tombstones.
+    """
+
+    def __init__(self, index, passage_store, wal_path, read_only=False, max_overfetch=256):
+        self.main = index
+        self.passage_store = passage_store
+        self.wal_path = wal_path
+        self.max_overfetch = max_overfetch
+        self.d = index.d
+        self.base_ntotal = index.ntotal
+        self.delta = faiss.IndexFlatIP(self.d)
+        self.delta_vectors = []
+        self.deleted = np.zeros(self.base_ntotal, dtype=bool)
+        self.num_deleted = 0
+        # Passages of upserted rows, and passage id -> row for upserted passages
+        # (only rows still in the delta once a compaction has written a state)
+        self.overlay = {}
+        self.upserted_rows = {}
+        # Upserted passages folded into the main index by compaction, and their rows
+        self.compacted = None
+        self.compacted_rows = np.zeros(0, dtype=np.int64)
+        # Index file and state directory of the last checkpoint, removed once
+        # the next checkpoint is durable (the baseline index is never removed)
+        self.checkpoint_paths = ()
+        self._lock = threading.Lock()
+        self._compact_lock = threading.Lock()
+        self._replay()
+        self._wal = open(wal_path, "a") if wal_path and not read_only else None
+
+    @property
+    def ntotal(self):
+        return self.base_ntotal + self.delta.ntotal
+
+    def _replay(self):
+        replayed = 0
+        for record in read_wal(self.wal_path):
+            if record["op"] == "upsert":
+                vector = np.frombuffer(base64.b64decode(record["vector"]), dtype=np.float32)
+                self._apply_upsert(record["row"], record["id"], record["passage"], vector)
+                replayed += 1
+            elif record["op"] == "delete":
+                self._apply_delete(record["row"])
+                replayed += 1
+            elif record["op"] == "checkpoint":
+                self.checkpoint_paths = (record["index_path"], record.get("state_path"))
+                if record.get("state_path"):
+                    self._load_state(record["state_path"])
+        if replayed:
+            print(f"Replayed {replayed} changes from {self.wal_path}")
+
+    def _load_state(self, state_path):
+        self.compacted = PassageStore(os.path.join(state_path, STATE_PASSAGES_DIR))
+        self.compacted_rows = np.load(os.path.join(state_path, STATE_ROWS_FILE))
+        for row in np.load(os.path.join(state_path, STATE_DELETED_FILE)):
+            self._mark_deleted(int(row))
+
+    def _compacted_position(self, compacted_rows, row):
+        # Position of a row in the compacted passage store, or None
+        position = np.searchsorted(compacted_rows, row)
+        if position < len(compacted_rows) and compacted_rows[position] == row:
+            return int(position)
+        return None
+
+    def _check_writable(self):
+        if self._wal is None:
+            raise ValueError("Index is read-only")
+
+    def _append_wal(self, records):
+        for record in records:
+            self._wal.write(json.dumps(record) + "\n")
+        self._wal.flush()
+        os.fsync(self._wal.fileno())
+
+    def _mark_deleted(self, row):
+        if row >= len(self.deleted):
+            grown = np.zeros(max(row + 1, 2 * len(self.deleted)), dtype=bool)
+            grown[:len(self.deleted)] = self.deleted
+            self.deleted = grown
+        if not self.deleted[row]:
+            self.deleted[row] = True
+            self.num_deleted += 1
+
+    def _apply_upsert(self, row, passage_id, passage, vector):
+        self.overlay[row] = (passage_id, passage)
+        self.upserted_rows[passage_id] = row
+        # Rows below base_ntotal were already folded into the main index by compaction
+        if row >= self.base_ntotal:
+            self.delta.add(vector.reshape(1, -1))
+            self.delta_vectors.append(vector)
+
+    def _apply_delete(self, row):
+        self._mark_deleted(row)
+        passage_id = self.overlay.get(row, (None,))[0]
+        if passage_id is not None and self.upserted_rows.get(passage_id) == row:
+            del self.upserted_rows[passage_id]
+
+    def find_row(self, passage_id):
+        """
+        Return the live row of a passage id, or None if it is unknown or deleted.
+        """
+        with self._lock:
+            return self._find_row(passage_id)
+
+    def _find_row(self, passage_id):
+        # Called with self._lock held, so compaction cannot swap the stores midway
+        row = self.upserted_rows.get(passage_id)
+        if row is None and self.compacted is not None:
+            position = self.compacted.find_row(passage_id)
+            if position is not None:
+                row = int(self.compacted_rows[position])
+        if row is None:
+            row = self.passage_store.find_row(passage_id)
+        if row is None or (row < len(self.deleted) and self.deleted[row]):
+            return None
+        return row
+
+    def upsert(self, passage_ids, passages, vectors):
+        """
+        Insert passages, replacing any live passage with the same id.
+
+        Parameters:
+        - passage_ids: List of passage ids.
+        - passages: List of passage texts.
+        - vectors: (n, dim) float32 embeddings of the passages.
+        """
+        self._check_writable()
+        vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+        with self._lock:
+            records = []
+            for passage_id, passage, vector in zip(passage_ids, passages, vectors):
+                old_row = self._find_row(passage_id)
+                if old_row is not None:
+                    records.append({"op": "delete", "row": old_row, "id": passage_id})
+                    self._apply_delete(old_row)
+                row = self.ntotal
+                records.append({
+                    "op": "upsert", "row": row, "id": passage_id, "passage": passage,
+                    "vector": base64.b64encode(vector.tobytes()).decode("ascii"),
+                })
+                self._apply_upsert(row, passage_id, passage, vector)
+            self._append_wal(records)
+
+    def delete(self, passage_ids):
+        """
+        Hide passages from search results.
+
+        Returns:
+        - Number of passages that were live and are now deleted.
+        """
+        self._check_writable()
+        with self._lock:
+            records = []
+            for passage_id in passage_ids:
+                row = self._find_row(passage_id)
+                if row is None:
+                    continue
+                records.append({"op": "delete", "row": row, "id": passage_id})
+                self._apply_delete(row)
+            if records:
+                self._append_wal(records)
+            return len(records)
+
+    def _drop_deleted(self, distances, indices):
+        indices = indices.copy()
+        valid = indices >= 0
+        rows = indices[valid]
+        hidden = np.zeros(len(rows), dtype=bool)
+        in_bitmap = rows < len(self.deleted)
+        hidden[in_bitmap] = self.deleted[rows[in_bitmap]]
+        masked = np.zeros(indices.shape, dtype=bool)
+        masked[valid] = hidden
+        indices[masked] = -1
+        return distances, indices
+
+    def search(self, query_embeddings, top_k, ef_search=None, allowed_rows=None):
+        # Main index, its row count and delta are swapped together by compact();
+        # a delta replaced by compaction is never written to again
+        with self._lock:
+            main, base_ntotal, delta = self.main, self.base_ntotal, self.delta
+        if allowed_rows is None:
+            overfetch = min(self.num_deleted, self.max_overfetch)
+            results = [self._drop_deleted(*search_index(main, query_embeddings, top_k + overfetch, ef_search))]
+            delta_rows = None
+        else:
+            # Deleted rows are removed from the filter instead of over-fetching
+            deleted = self.deleted
+            live = np.ones(len(allowed_rows), dtype=bool)
+            in_bitmap = allowed_rows < len(deleted)
+            live[in_bitmap] = ~deleted[allowed_rows[in_bitmap]]
+            allowed_rows = allowed_rows[live]
+            split = np.searchsorted(allowed_rows, base_ntotal)
+            results = [search_index(main, query_embeddings, top_k, ef_search, allowed_rows[:split])]
+            delta_rows = allowed_rows[split:] - base_ntotal
+        with self._lock:
+            if delta.ntotal and (delta_rows is None or len(delta_rows)):
+                if delta_rows is None:
+                    distances, indices = delta.search(query_embeddings, min(top_k, delta.ntotal))
+                else:
+                    distances, indices = search_index(delta, query_embeddings, top_k, None, delta_rows)
+                indices = np.where(indices >= 0, indices + base_ntotal, -1)
+                results.append(self._drop_deleted(distances, indices))
+        return merge_topk(results, [0] * len(results), top_k)
+
+    def lookup(self, rows):
+        """
+        Map rows to passage ids and texts, including upserted passages.
+
+        A row found by a search may have been deleted and compacted away
+        since; its id and text are returned as None.
+        """
+        # compact() replaces these together; a consistent snapshot is enough,
+        # since the stores it replaces stay readable
+        with self._lock:
+            overlay, compacted, compacted_rows = self.overlay, self.compacted, self.compacted_rows
+        ids, texts = [], []
+        for row in rows:
+            row = int(row)
+            if row < 0:
+                continue
+            position = self._compacted_position(compacted_rows, row) if compacted is not None else None
+            if row in overlay:
+                passage_id, text = overlay[row]
+            elif position is not None:
+                passage_id, text = compacted.get_id(position), compacted.get_text(position)
+            elif row < len(self.passage_store):
+                passage_id, text = self.passage_store.get_id(row), self.passage_store.get_text(row)
+            else:
+                passage_id, text = None, None
+            ids.append(passage_id)
+            texts.append(text)
+        return ids, texts
+
+    def compact(self, output_dir):
+        """
+        Fold the delta into a new main index, save it and swap it in.
+
+        Searches keep using the old main index until the swap; upserts made
+        during compaction stay in the delta. The folded passages are written
+        to a state directory next to the new index, and the WAL is replaced by
+        one holding only the checkpoint and the rows still in the delta.
+        The previous checkpoint's index and state are then removed.
+
+        Returns:
+        - Path of the new index file, or None if there was nothing to fold.
+        """
+        if not isinstance(self.main, faiss.Index):
+            raise TypeError("Compaction needs a native FAISS index as the main index")
+        with self._compact_lock:
+            with self._lock:
+                fold = np.vstack(self.delta_vectors) if self.delta_vectors else None
+                main = self.main
+                new_ntotal = self.base_ntotal + len(self.delta_vectors)
+                # Folded rows only change by being deleted, so their passages
+                # can be written without holding the lock
+                folded = sorted(
+                    (row, passage_id, passage) for row, (passage_id, passage) in self.overlay.items()
+                    if row < new_ntotal and not (row < len(self.deleted) and self.deleted[row])
+                )
+                compacted, compacted_rows = self.compacted, self.compacted_rows
+                deleted = self.deleted
+            if fold is None:
+                return None
+
+            start = time.time()
+            new_main = faiss.clone_index(main)
+            new_main.add(fold)
+            new_path = os.path.join(output_dir, f"live_index_{new_main.ntotal}.bin")
+            faiss.write_index(new_main, new_path + ".tmp")
+            os.replace(new_path + ".tmp", new_path)
+
+            # Passages of every live upserted row now in the main index: those
+            # of earlier compactions plus the ones folded now
+            state_path = os.path.join(output_dir, f"live_index_{new_main.ntotal}.state")
+            earlier = []
+            if compacted is not None:
+                earlier = [
+                    (int(row), compacted.get_id(position), compacted.get_text(position))
+                    for position, row in enumerate(compacted_rows) if not (row < len(deleted) and deleted[row])
+                ]
+            passages = earlier + folded
+            write_passage_store(((passage_id, passage) for _, passage_id, passage in passages),
+                                os.path.join(state_path, STATE_PASSAGES_DIR))
+            np.save(os.path.join(state_path, STATE_ROWS_FILE), np.array([row for row, _, _ in passages], dtype=np.int64))
+            new_compacted = PassageStore(os.path.join(state_path, STATE_PASSAGES_DIR))
+
+            with self._lock:
+                np.save(os.path.join(state_path, STATE_DELETED_FILE), np.flatnonzero(self.deleted))
+                remaining = self.delta_vectors[len(fold):]
+                self.delta = faiss.IndexFlatIP(self.d)
+                if remaining:
+                    self.delta.add(np.vstack(remaining))
+                self.delta_vectors = remaining
+                self.main = new_main
+                self.base_ntotal = new_main.ntotal
+                self.compacted = new_compacted
+                self.compacted_rows = np.load(os.path.join(state_path, STATE_ROWS_FILE))
+                self.overlay = {row: passage for row, passage in self.overlay.items() if row >= self.base_ntotal}
+                self.upserted_rows = {
+                    passage_id: row for passage_id, row in self.upserted_rows.items() if row >= self.base_ntotal
+                }
+                self._rotate_wal([{"op": "checkpoint", "index_path": new_path, "ntotal": new_main.ntotal,
+                                   "state_path": state_path}])
+                previous, self.checkpoint_paths = self.checkpoint_paths, (new_path, state_path)
+            # The WAL no longer refers to the previous checkpoint; searches
+            # still holding its files keep reading them until they finish
+            remove_checkpoint(previous, keep=self.checkpoint_paths)
+            print(f"Compacted {len(fold)} rows into {new_path} in {time.time() - start:.1f}s")
+            return new_path
+
+    def _rotate_wal(self, checkpoint):
+        # Called with self._lock held: replace the WAL by the checkpoint
+        # followed by the rows that are still only in the delta
+        records = list(checkpoint)
+        for offset, vector in enumerate(self.delta_vectors):
+            row = self.base_ntotal + offset
+            passage_id, passage = self.overlay[row]
+            records.append({
+                "op": "upsert", "row": row, "id": passage_id, "passage": passage,
+                "vector": base64.b64encode(vector.tobytes()).decode("ascii"),
+            })
+        tmp_path = self.wal_path + ".tmp"
+        with open(tmp_path, "w") as f:
+            for record in records:
+                f.write(json.dumps(record) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.wal_path)
+        # Make the rename durable before the previous checkpoint is removed
+        dir_fd = os.open(os.path.dirname(os.path.abspath(self.wal_path)), os.O_RDONLY)
+        try:
+            os.fsync(dir_fd)
+        finally:
+            os.close(dir_fd)
+        self._wal.close()
+        self._wal = open(self.wal_path, "a")
+
+    def start_compactor(self, output_dir, interval_s=300, min_rows=10000):
+        """
+        Compact in a background thread whenever the delta holds at least min_rows vectors.
+        """
+        def run():
+            while True:
+                time.sleep(interval_s)
+                if self.delta.ntotal >= min_rows:
+                    try:
+                        self.compact(output_dir)
+                    except Exception as e:
+                        print(f"Compaction failed: {e}")
+
+        thread = threading.Thread(target=run, daemon=True)
+        thread.start()
+        return thread
@@ -0,0 +1,133 @@
+import glob
+import gzip
+import json
+import os
+import sys
+from array import array
+
+import numpy as np
+
+from passage_store import PassageStore
+
+# File names inside a metadata store directory
+DOCUMENTS_FILE = "documents.npy"
+DOCUMENT_CODES_FILE = "document_codes.npy"
+DOCUMENT_ROW_OFFSETS_FILE = "document_row_offsets.npy"
+DOCUMENT_ROWS_FILE = "document_rows.npy"
+
+
+def read_passage_records(shard_paths):
+    """
+    Yield the passage records of packed JSONL shards written by
+    index_creation/upload_msmarco_to_s3.py (synced locally first).
+    """
+    for path in shard_paths:
+        with gzip.open(path, "rt", encoding="utf-8") as f:
+            for line in f:
+                yield json.loads(line)
+
+
+def build_metadata_store(records, passage_store, store_dir):
+    """
+    Build a metadata column store keyed by FAISS row id.
+
+    The store is a directory holding:
+    - documents.npy: sorted fixed-width byte strings of the distinct
+      msmarco_document_id values.
+    - document_codes.npy: int32 per row, the position of the row's document
+      in documents.npy (-1 for rows without one).
+    - document_row_offsets.npy, document_rows.npy: the rows of document i are
+      document_rows[offsets[i]:offsets[i + 1]], in increasing order.
+
+    Parameters:
+    - records: Iterable of dicts with 'doc_id' (the passage id) and
+      'msmarco_document_id'.
+    - passage_store: PassageStore whose rows are the FAISS rows.
+    - store_dir: Directory to write the store into.
+
+    Returns:
+    - Number of rows with a document.
+    """
+    os.makedirs(store_dir, exist_ok=True)
+    rows = array("q")
+    row_documents = []
+    for count, record in enumerate(records, start=1):
+        row = passage_store.find_row(record["doc_id"])
+        if row is not None:
+            rows.append(row)
+            row_documents.append(record["msmarco_document_id"].encode("utf-8"))
+        if count % 1000000 == 0:
+            print(f"Read metadata for {count} passages")
+
+    width = max((len(d) for d in row_documents), default=1)
+    row_documents = np.array(row_documents, dtype=f"S{width}")
+    documents = np.unique(row_documents)
+    codes = np.full(len(passage_store), -1, dtype=np.int32)
+    codes[np.frombuffer(rows, dtype=np.int64)] = np.searchsorted(documents, row_documents)
+
+    has_document = np.nonzero(codes >= 0)[0]
+    document_rows = has_document[np.argsort(codes[has_document], kind="stable")]
+    counts = np.bincount(codes[has_document], minlength=len(documents))
+    offsets = np.concatenate([[0], np.cumsum(counts)]).astype(np.int64)
+
+    np.save(os.path.join(store_dir, DOCUMENTS_FILE), documents)
+    np.save(os.path.join(store_dir, DOCUMENT_CODES_FILE), codes)
+    np.save(os.path.join(store_dir, DOCUMENT_ROW_OFFSETS_FILE), offsets)
+    np.save(os.path.join(store_dir, DOCUMENT_ROWS_FILE), document_rows.astype(np.int64))
+    print(f"Metadata store with {len(documents)} documents over {len(has_document)} rows written to {store_dir}")
+    return len(has_document)
+
+
+class MetadataStore:
+    """
+    Read-only, memory-mapped view over a metadata store built by build_metadata_store.
+    """
+
+    def __init__(self, store_dir):
+        self.store_dir = store_dir
+        self.documents = np.load(os.path.join(store_dir, DOCUMENTS_FILE), mmap_mode="r")
+        self.document_codes = np.load(os.path.join(store_dir, DOCUMENT_CODES_FILE), mmap_mode="r")
+        self.document_row_offsets = np.load(os.path.join(store_dir, DOCUMENT_ROW_OFFSETS_FILE), mmap_mode="r")
+        self.document_rows = np.load(os.path.join(store_dir, DOCUMENT_ROWS_FILE), mmap_mode="r")
+
+    def document_code(self, document_id):
+        """
+        Return the code of a document id, or None if no row belongs to it.
+        """
+        key = document_id.encode("utf-8")
+        if len(key) > self.documents.dtype.itemsize:
+            return None
+        position = int(np.searchsorted(self.documents, key))
+        if position < len(self.documents) and self.documents[position] == key:
+            return position
+        return None
+
+    def rows_for_documents(self, document_ids):
+        """
+        Return the sorted rows of the passages belonging to any of the documents.
+        """
+        parts = []
+        for document_id in document_ids:
+            code = self.document_code(document_id)
+            if code is not None:
+                start, end = self.document_row_offsets[code], self.document_row_offsets[code + 1]
+                parts.append(self.document_rows[start:end])
+        if not parts:
+            return np.zeros(0, dtype=np.int64)
+        return np.unique(np.concatenate(parts)).astype(np.int64)
+
+    def document_of(self, row):
+        """
+        Return the msmarco_document_id of a row, or None.
+        """
+        if row >= len(self.document_codes) or self.document_codes[row] < 0:
+            return None
+        return self.documents[self.document_codes[row]].decode("utf-8")
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 4:
+        print("Usage: python metadata_store.py <passage_store_dir> <metadata_store_dir> <shard.jsonl.gz>...")
+        sys.exit(1)
+    shard_paths = sorted(path for pattern in sys.argv[3:] for path in glob.glob(pattern))
+    build_metadata_store(read_passage_records(shard_paths), PassageStore(sys.argv[1]), sys.argv[2])
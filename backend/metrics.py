@@ -0,0 +1,214 @@
+import cProfile
+import os
+import random
+import threading
+import time
+from contextlib import contextmanager
+
+# Latency buckets in seconds, from sub-millisecond cache hits to multi-second stalls
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128, 256, 512, 1024)
+
+
+def _label_text(labelnames, labelvalues, extra=()):
+    pairs = list(zip(labelnames, labelvalues)) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{value}"' for name, value in pairs) + "}"
+
+
+class Counter:
+    """
+    Monotonic counter, optionally split by labels.
+    """
+
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(str(labels[name]) for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_label_text(self.labelnames, key)} {value}")
+        return lines
+
+
+class Histogram:
+    """
+    Cumulative-bucket histogram, optionally split by labels.
+
+    Parameters:
+    - name, help: Metric name and description.
+    - labelnames: Label names every observation must provide.
+    - buckets: Increasing upper bounds; +Inf is added automatically.
+    """
+
+    def __init__(self, name, help, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        # labels -> [per-bucket counts (+Inf last), sum]
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(str(labels[name]) for name in self.labelnames)
+        position = next((i for i, bound in enumerate(self.buckets) if value <= bound), len(self.buckets))
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][position] += 1
+            series[1] += value
+
+    @contextmanager
+    def time(self, **labels):
+        """
+        Observe the wall time of a with-block, in seconds.
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = sorted((key, list(counts), total) for key, (counts, total) in self._series.items())
+        for key, counts, total in series:
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), counts):
+                cumulative += count
+                labels = _label_text(self.labelnames, key, [("le", bound)])
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _label_text(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {total}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+class CallbackMetric:
+    """
+    Metric whose samples are read from a function at scrape time, for values
+    other components already track (e.g. cache hit counts).
+
+    Parameters:
+    - kind: "counter" or "gauge".
+    - collect: Function returning a list of (label dict, value) pairs.
+    """
+
+    def __init__(self, name, help, kind, collect):
+        self.name = name
+        self.help = help
+        self.kind = kind
+        self.collect = collect
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        for labels, value in self.collect():
+            lines.append(f"{self.name}{_label_text(list(labels), list(labels.values()))} {value}")
+        return lines
+
+
+class Registry:
+    """
+    Collection of metrics rendered together in the Prometheus text format.
+
+    Metrics live in process memory, so with several gunicorn workers each
+    worker reports its own series.
+    """
+
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def counter(self, name, help, labelnames=()):
+        return self.register(Counter(name, help, labelnames))
+
+    def histogram(self, name, help, labelnames=(), buckets=LATENCY_BUCKETS):
+        return self.register(Histogram(name, help, labelnames, buckets))
+
+    def callback(self, name, help, kind, collect):
+        return self.register(CallbackMetric(name, help, kind, collect))
+
+    def render(self):
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+class SlowRequestProfiler:
+    """
+    Profile a random sample of requests with cProfile and keep the profiles
+    of those slower than a threshold, for loading into pstats or snakeviz.
+
+    Only one request is profiled at a time, since a profiler only sees its
+    own thread and Python allows one active profiler. Work done for the
+    request on other threads (the micro-batcher) shows up as waiting.
+
+    Parameters:
+    - sample_rate: Fraction of requests profiled (0 disables profiling).
+    - slow_ms: Profiles of requests faster than this are discarded.
+    - output_dir: Directory the .prof files are written to.
+    """
+
+    def __init__(self, sample_rate=0.0, slow_ms=500, output_dir="profiles"):
+        self.sample_rate = sample_rate
+        self.slow_ms = slow_ms
+        self.output_dir = output_dir
+        self._lock = threading.Lock()
+
+    def start(self):
+        """
+        Maybe start profiling the current request.
+
+        Returns:
+        - Token to pass to stop(), or None if this request is not profiled.
+        """
+        if self.sample_rate <= 0 or random.random() >= self.sample_rate:
+            return None
+        if not self._lock.acquire(blocking=False):
+            return None
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError:
+            # Another profiler (e.g. a debugger) is already active
+            self._lock.release()
+            return None
+        return profiler, time.perf_counter()
+
+    def stop(self, token, label):
+        """
+        Stop profiling and write the profile if the request was slow.
+
+        Returns:
+        - Path of the written profile, or None.
+        """
+        if token is None:
+            return None
+        profiler, start = token
+        profiler.disable()
+        self._lock.release()
+        elapsed_ms = 1000 * (time.perf_counter() - start)
+        if elapsed_ms < self.slow_ms:
+            return None
+        os.makedirs(self.output_dir, exist_ok=True)
+        path = os.path.join(self.output_dir, f"{int(time.time() * 1000)}_{os.getpid()}_{label}_{elapsed_ms:.0f}ms.prof")
+        profiler.dump_stats(path)
+        return path
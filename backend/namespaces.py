@@ -0,0 +1,156 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import yaml
+
+# Settings a collection entry may give; paths are resolved against the
+# collections file's directory
+COLLECTION_KEYS = ("index_path", "passage_store_path", "metadata_store_path", "refine_vectors_path", "bm25_index_path")
+REQUIRED_KEYS = ("index_path", "passage_store_path")
+
+
+class Namespace:
+    """
+    One searchable collection: its index and the stores that map its rows to passages.
+
+    Parameters:
+    - name: Collection name used in requests.
+    - index: LiveIndex over the collection's index (read-only outside the default collection).
+    - metadata_store: MetadataStore for filtered search, or None.
+    - lexical_searcher: LexicalSearcher for sparse/hybrid search, or None.
+    - resident_bytes: Estimated memory the loaded index takes.
+    """
+
+    def __init__(self, name, index, metadata_store=None, lexical_searcher=None, resident_bytes=0):
+        self.name = name
+        self.index = index
+        self.metadata_store = metadata_store
+        self.lexical_searcher = lexical_searcher
+        self.resident_bytes = resident_bytes
+
+
+def load_collection_specs(path):
+    """
+    Read the collections file: a YAML mapping under 'collections' of
+    collection name -> settings (see COLLECTION_KEYS).
+
+    Returns:
+    - Dict of name -> settings with every key of COLLECTION_KEYS and
+      absolute paths; raises ValueError on unknown or missing keys.
+    """
+    with open(path) as f:
+        collections = (yaml.safe_load(f) or {}).get("collections") or {}
+    base_dir = os.path.dirname(os.path.abspath(path))
+    specs = {}
+    for name, settings in collections.items():
+        settings = settings or {}
+        unknown = set(settings) - set(COLLECTION_KEYS)
+        if unknown:
+            raise ValueError(f"Unknown keys for collection '{name}': {', '.join(sorted(unknown))}")
+        missing = [key for key in REQUIRED_KEYS if not settings.get(key)]
+        if missing:
+            raise ValueError(f"Collection '{name}' needs {', '.join(missing)}")
+        specs[name] = {
+            key: os.path.join(base_dir, os.path.expanduser(settings[key])) if settings.get(key) else None
+            for key in COLLECTION_KEYS
+        }
+    return specs
+
+
+class NamespaceRegistry:
+    """
+    Route collection names to namespaces, loading them on first use and
+    evicting the least recently used ones once the resident indexes exceed
+    a memory budget.
+
+    Pinned namespaces (the default collection) are always resident and do
+    not count against the budget. A namespace larger than the whole budget
+    is still loaded, alone. Evicted namespaces are only dropped from the
+    registry; requests already using one keep it alive until they finish.
+
+    Parameters:
+    - specs: Dict of name -> settings, from load_collection_specs().
+    - load: Function (name, settings) -> Namespace.
+    - memory_budget_bytes: Budget for the resident, unpinned namespaces.
+    - pinned: Namespaces that are always resident.
+    """
+
+    def __init__(self, specs, load, memory_budget_bytes, pinned=()):
+        self.pinned = {namespace.name: namespace for namespace in pinned}
+        clashes = set(specs) & set(self.pinned)
+        if clashes:
+            raise ValueError(f"Collections file redefines {', '.join(sorted(clashes))}")
+        self.specs = specs
+        self.load = load
+        self.memory_budget_bytes = memory_budget_bytes
+        self.resident = OrderedDict()
+        self._lock = threading.Lock()
+        # One lock per collection, so concurrent first requests load it once
+        self._load_locks = {name: threading.Lock() for name in specs}
+        self.loads = dict.fromkeys(specs, 0)
+        self.evictions = dict.fromkeys(specs, 0)
+        self.load_seconds = dict.fromkeys(specs, 0.0)
+
+    def names(self):
+        return list(self.pinned) + list(self.specs)
+
+    def _resident(self, name):
+        with self._lock:
+            namespace = self.resident.get(name)
+            if namespace is not None:
+                self.resident.move_to_end(name)
+            return namespace
+
+    def get(self, name):
+        """
+        Return the namespace of a collection, loading it if needed; raises
+        KeyError for unknown collections.
+        """
+        namespace = self.pinned.get(name)
+        if namespace is not None:
+            return namespace
+        if name not in self.specs:
+            raise KeyError(name)
+        namespace = self._resident(name)
+        if namespace is not None:
+            return namespace
+        with self._load_locks[name]:
+            # Another request may have loaded it while this one waited
+            namespace = self._resident(name)
+            if namespace is not None:
+                return namespace
+            start = time.perf_counter()
+            namespace = self.load(name, self.specs[name])
+            elapsed = time.perf_counter() - start
+            with self._lock:
+                self.resident[name] = namespace
+                self.loads[name] += 1
+                self.load_seconds[name] += elapsed
+                evicted = self._evict()
+        print(f"Loaded collection {name} ({namespace.resident_bytes / 2**20:.0f} MiB) in {elapsed:.1f}s"
+              + (f", evicted {', '.join(evicted)}" if evicted else ""))
+        return namespace
+
+    def _evict(self):
+        # Called with self._lock held, right after a load; never evicts the newest namespace
+        evicted = []
+        while len(self.resident) > 1 and self.resident_bytes() > self.memory_budget_bytes:
+            name, _ = self.resident.popitem(last=False)
+            self.evictions[name] += 1
+            evicted.append(name)
+        return evicted
+
+    def resident_bytes(self):
+        return sum(namespace.resident_bytes for namespace in self.resident.values())
+
+    def stats(self):
+        with self._lock:
+            return {
+                "memory_budget_bytes": self.memory_budget_bytes,
+                "resident_bytes": {name: namespace.resident_bytes for name, namespace in self.resident.items()},
+                "loads": dict(self.loads),
+                "evictions": dict(self.evictions),
+                "load_seconds": {name: round(seconds, 3) for name, seconds in self.load_seconds.items()},
+            }
@@ -0,0 +1,170 @@
+import mmap
+import os
+import sys
+from array import array
+
+import numpy as np
+
+# File names inside a passage store directory
+TEXTS_FILE = "texts.bin"
+OFFSETS_FILE = "offsets.npy"
+IDS_FILE = "ids.npy"
+ID_ORDER_FILE = "id_order.npy"
+
+
+def build_passage_store(tsv_path, store_dir):
+    """
+    Build a passage store from a collection TSV file (id \t text).
+
+    Row i of the store is line i of the TSV, which is also FAISS row i.
+
+    Parameters:
+    - tsv_path: Path to the collection TSV file.
+    - store_dir: Directory to write the store into.
+
+    Returns:
+    - Number of passages written.
+    """
+    def read_tsv():
+        with open(tsv_path, "rb") as src:
+            for line in src:
+                line = line.rstrip(b"\r\n")
+                if not line:
+                    continue
+                passage_id, _, text = line.partition(b"\t")
+                yield passage_id, text
+
+    return write_passage_store(read_tsv(), store_dir)
+
+
+def write_passage_store(passages, store_dir):
+    """
+    Write a passage store from (passage_id, text) pairs, given as bytes or str.
+
+    The store is a directory holding:
+    - texts.bin: UTF-8 passage texts concatenated back to back.
+    - offsets.npy: uint64 array of length N + 1; passage i spans
+      texts.bin[offsets[i]:offsets[i + 1]].
+    - ids.npy: fixed-width byte string array of the N passage ids.
+    - id_order.npy: rows sorted by passage id, for id -> row lookups.
+
+    Parameters:
+    - passages: Iterable of (passage_id, text) pairs, in row order.
+    - store_dir: Directory to write the store into.
+
+    Returns:
+    - Number of passages written.
+    """
+    os.makedirs(store_dir, exist_ok=True)
+    offsets = array("Q", [0])
+    ids = []
+
+    with open(os.path.join(store_dir, TEXTS_FILE), "wb") as texts_out:
+        for passage_id, text in passages:
+            if isinstance(passage_id, str):
+                passage_id = passage_id.encode("utf-8")
+            if isinstance(text, str):
+                text = text.encode("utf-8")
+            texts_out.write(text)
+            offsets.append(offsets[-1] + len(text))
+            ids.append(passage_id)
+            if len(ids) % 1000000 == 0:
+                print(f"Stored {len(ids)} passages")
+
+    np.save(os.path.join(store_dir, OFFSETS_FILE), np.frombuffer(offsets, dtype=np.uint64))
+    width = max((len(i) for i in ids), default=1)
+    ids = np.array(ids, dtype=f"S{width}")
+    np.save(os.path.join(store_dir, IDS_FILE), ids)
+    np.save(os.path.join(store_dir, ID_ORDER_FILE), np.argsort(ids, kind="stable"))
+    print(f"Passage store with {len(ids)} passages written to {store_dir}")
+    return len(ids)
+
+
+class PassageStore:
+    """
+    Read-only, memory-mapped view over a passage store built by build_passage_store.
+
+    Nothing is parsed at open time, so opening is instant and every worker
+    process on a machine shares the same pages through the OS page cache.
+    """
+
+    def __init__(self, store_dir):
+        self.store_dir = store_dir
+        self.offsets = np.load(os.path.join(store_dir, OFFSETS_FILE), mmap_mode="r")
+        self.ids = np.load(os.path.join(store_dir, IDS_FILE), mmap_mode="r")
+        self._id_order = None
+        with open(os.path.join(store_dir, TEXTS_FILE), "rb") as f:
+            # mmap cannot map an empty file
+            if os.fstat(f.fileno()).st_size:
+                self._texts = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            else:
+                self._texts = b""
+
+    def __len__(self):
+        return len(self.ids)
+
+    def get_id(self, row):
+        """
+        Return the passage id stored at a FAISS row.
+        """
+        return self.ids[row].decode("utf-8")
+
+    def get_text(self, row):
+        """
+        Return the passage text stored at a FAISS row.
+        """
+        start, end = self.offsets[row], self.offsets[row + 1]
+        return self._texts[start:end].decode("utf-8")
+
+    def find_row(self, passage_id):
+        """
+        Return the row holding passage_id, or None, by binary search over id_order.npy.
+        """
+        if self._id_order is None:
+            order_path = os.path.join(self.store_dir, ID_ORDER_FILE)
+            if os.path.exists(order_path):
+                self._id_order = np.load(order_path, mmap_mode="r")
+            else:
+                # Stores built before id_order.npy existed
+                self._id_order = np.argsort(self.ids, kind="stable")
+        key = passage_id.encode("utf-8")
+        lo, hi = 0, len(self._id_order)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.ids[self._id_order[mid]] < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo < len(self._id_order) and self.ids[self._id_order[lo]] == key:
+            return int(self._id_order[lo])
+        return None
+
+    def lookup(self, rows):
+        """
+        Map FAISS row ids to passage ids and texts in O(len(rows)).
+
+        Parameters:
+        - rows: Iterable of FAISS row ids. Negative ids (FAISS padding for
+          missing neighbors) are skipped.
+
+        Returns:
+        - ids: List of passage ids.
+        - texts: List of passage texts.
+        """
+        ids, texts = [], []
+        for row in rows:
+            row = int(row)
+            if row < 0:
+                continue
+            ids.append(self.get_id(row))
+            texts.append(self.get_text(row))
+        return ids, texts
+
+    def close(self):
+        if isinstance(self._texts, mmap.mmap):
+            self._texts.close()
+
+
+if __name__ == "__main__":
+    # Usage: python passage_store.py collection.tsv passage_store/
+    build_passage_store(sys.argv[1], sys.argv[2])
@@ -0,0 +1,96 @@
+import threading
+import time
+from concurrent.futures import TimeoutError
+
+import numpy as np
+
+from batcher import MicroBatcher
+
+
+class CrossEncoderReranker:
+    """
+    Re-score (query, passage) pairs with a cross-encoder, batching the pairs
+    of concurrent requests into shared model calls.
+
+    Each request waits for its scores until a deadline; if the deadline
+    passes, its pending work is cancelled and the caller keeps the
+    first-stage order.
+
+    Parameters:
+    - model_name: sentence-transformers CrossEncoder model.
+    - max_batch_requests: Requests whose pairs are scored in one model call.
+    - max_wait_ms: Maximum time the oldest request waits for the batch to fill.
+    - batch_size: Pairs per forward pass inside a model call.
+    """
+
+    def __init__(self, model_name, max_batch_requests=8, max_wait_ms=2, batch_size=64):
+        from sentence_transformers import CrossEncoder
+        self.model = CrossEncoder(model_name)
+        self.batch_size = batch_size
+        self.batcher = MicroBatcher(self._score_batch, max_batch_size=max_batch_requests, max_wait_ms=max_wait_ms)
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.fallbacks = 0
+        self.model_calls = 0
+        self.pairs_scored = 0
+        self.scoring_seconds = 0.0
+
+    def _score_batch(self, batch):
+        pairs = [(query, passage) for query, passages in batch for passage in passages]
+        start = time.perf_counter()
+        scores = np.asarray(self.model.predict(pairs, batch_size=self.batch_size), dtype=np.float32)
+        elapsed = time.perf_counter() - start
+        with self._lock:
+            self.model_calls += 1
+            self.pairs_scored += len(pairs)
+            self.scoring_seconds += elapsed
+        results, start = [], 0
+        for _, passages in batch:
+            results.append(scores[start:start + len(passages)])
+            start += len(passages)
+        return results
+
+    def score_many(self, queries, passage_lists, timeout_s):
+        """
+        Score each query against its candidate passages.
+
+        Parameters:
+        - queries: List of query strings.
+        - passage_lists: One list of candidate passage texts per query.
+        - timeout_s: Time budget shared by all the queries.
+
+        Returns:
+        - One float32 score array per query, or None for queries whose scores
+          were not ready before the deadline.
+        """
+        deadline = time.monotonic() + timeout_s
+        futures = [
+            self.batcher.submit((query, passages)) if passages else None
+            for query, passages in zip(queries, passage_lists)
+        ]
+        results = []
+        for future in futures:
+            if future is None:
+                results.append(np.zeros(0, dtype=np.float32))
+                continue
+            try:
+                results.append(future.result(timeout=max(0.0, deadline - time.monotonic())))
+            except TimeoutError:
+                future.cancel()
+                results.append(None)
+        with self._lock:
+            self.requests += len(queries)
+            self.fallbacks += sum(result is None for result in results)
+        return results
+
+    def stats(self):
+        with self._lock:
+            return {
+                "requests": self.requests,
+                "fallbacks": self.fallbacks,
+                "model_calls": self.model_calls,
+                "pairs_scored": self.pairs_scored,
+                "scoring_seconds": self.scoring_seconds,
+                "pairs_per_call": self.pairs_scored / self.model_calls if self.model_calls else 0.0,
+                "ms_per_pair": 1000 * self.scoring_seconds / self.pairs_scored if self.pairs_scored else 0.0,
+            }
@@ -0,0 +1,83 @@
+import heapq
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+
+import numpy as np
+
+from index_search import empty_results, read_index, search_index
+
+
+def merge_topk(shard_results, offsets, top_k, largest=True):
+    """
+    Merge per-shard top-k results into a global top-k with a heap.
+
+    Parameters:
+    - shard_results: List of (distances, indices) pairs, one per shard, each
+      of shape (num_queries, top_k) and sorted best-first per query.
+    - offsets: Global row id of each shard's first vector.
+    - top_k: Number of results to keep per query.
+    - largest: True if higher scores are better (inner product), False for L2.
+
+    Returns:
+    - distances, indices: Arrays of shape (num_queries, top_k) with global row
+      ids; missing results are padded with -1 like FAISS does.
+    """
+    num_queries = shard_results[0][0].shape[0]
+    distances = np.full((num_queries, top_k), -np.inf if largest else np.inf, dtype=np.float32)
+    indices = np.full((num_queries, top_k), -1, dtype=np.int64)
+    for q in range(num_queries):
+        per_shard = [
+            [(float(d), int(i) + offset) for d, i in zip(shard_d[q], shard_i[q]) if i >= 0]
+            for (shard_d, shard_i), offset in zip(shard_results, offsets)
+        ]
+        merged = heapq.merge(*per_shard, key=lambda hit: hit[0], reverse=largest)
+        for rank, (d, i) in enumerate(islice(merged, top_k)):
+            distances[q, rank] = d
+            indices[q, rank] = i
+    return distances, indices
+
+
+class ShardedIndex:
+    """
+    Search the index shards listed in a shards.json manifest as one index.
+
+    Every shard is searched at once from a thread pool (FAISS releases the GIL
+    during search) and the per-shard results are merged into global row ids,
+    so callers can use it wherever a FAISS index is expected.
+
+    Parameters:
+    - manifest_path: Path to shards.json written by create_index.py --shards.
+    - num_threads: Size of the fan-out thread pool (default: one per shard).
+    - mmap: Memory-map the shard files read-only instead of reading them into memory.
+    """
+
+    def __init__(self, manifest_path, num_threads=None, mmap=False):
+        with open(manifest_path) as f:
+            manifest = json.load(f)
+        if not manifest.get("complete", False):
+            raise ValueError(f"{manifest_path} describes an unfinished build")
+
+        base_dir = os.path.dirname(manifest_path)
+        self.paths = [os.path.join(base_dir, s["path"]) for s in manifest["shards"]]
+        self.shards = [read_index(path, mmap) for path in self.paths]
+        self.offsets = [s["offset"] for s in manifest["shards"]]
+        self.largest = manifest.get("metric", "inner_product") == "inner_product"
+        self.d = manifest["dim"]
+        self.ntotal = sum(shard.ntotal for shard in self.shards)
+        self._executor = ThreadPoolExecutor(max_workers=num_threads or len(self.shards))
+
+    def search(self, query_embeddings, top_k, ef_search=None, allowed_rows=None):
+        shard_rows = [None] * len(self.shards)
+        if allowed_rows is not None:
+            # Split the global filter into each shard's local row ids
+            bounds = np.searchsorted(allowed_rows, self.offsets + [self.ntotal])
+            shard_rows = [allowed_rows[bounds[i]:bounds[i + 1]] - self.offsets[i] for i in range(len(self.shards))]
+        futures = [
+            None if rows is not None and len(rows) == 0
+            else self._executor.submit(search_index, shard, query_embeddings, top_k, ef_search, rows)
+            for shard, rows in zip(self.shards, shard_rows)
+        ]
+        results = [empty_results(len(query_embeddings), top_k) if f is None else f.result() for f in futures]
+        return merge_topk(results, self.offsets, top_k, self.largest)
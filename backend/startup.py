@@ -0,0 +1,70 @@
+import os
+import threading
+import time
+
+# Read size when pulling index files into the page cache
+PREFETCH_CHUNK_BYTES = 16 * 1024 * 1024
+
+
+class StartupTimer:
+    """
+    Record how long each startup stage took, for the startup report printed
+    when the app is loaded and the timings served on /ready.
+
+    Stages may run concurrently from several threads.
+    """
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.stages = {}
+        self._lock = threading.Lock()
+
+    def timed(self, stage, fn, *args, **kwargs):
+        """
+        Call fn(*args, **kwargs), record its wall time under stage and return its result.
+        """
+        start = time.perf_counter()
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            self.record(stage, time.perf_counter() - start)
+
+    def record(self, stage, seconds):
+        with self._lock:
+            self.stages[stage] = round(seconds, 3)
+
+    def elapsed(self):
+        return time.perf_counter() - self.start
+
+    def report(self):
+        """
+        One-line breakdown of the recorded stages, slowest first.
+        """
+        with self._lock:
+            stages = sorted(self.stages.items(), key=lambda item: -item[1])
+        breakdown = ", ".join(f"{stage} {seconds:.2f}s" for stage, seconds in stages)
+        return f"Loaded in {self.elapsed():.2f}s ({breakdown})"
+
+
+def prefetch_files(paths, chunk_bytes=PREFETCH_CHUNK_BYTES):
+    """
+    Read files sequentially so that later page faults into their memory
+    mappings hit the page cache instead of the disk. Sequential reads are
+    far faster than the random faults of the first searches, especially on
+    network-attached volumes restored from snapshots.
+
+    Returns:
+    - Number of bytes read.
+    """
+    buffer = bytearray(chunk_bytes)
+    total = 0
+    for path in paths:
+        with open(path, "rb", buffering=0) as f:
+            if hasattr(os, "posix_fadvise"):
+                os.posix_fadvise(f.fileno(), 0, 0, os.POSIX_FADV_SEQUENTIAL)
+            while True:
+                count = f.readinto(buffer)
+                if not count:
+                    break
+                total += count
+    return total
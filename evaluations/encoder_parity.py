@@ -0,0 +1,103 @@
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+import numpy as np
+
+from eval_HNSW import BATCH_ENDPOINT, QRELS_FILE, QUERIES_FILE, build_run_async, percentile
+from evaltools import evaluate, load_qrels, load_queries
+
+# Load both models exactly as the backend does
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "backend"))
+from encoders import load_sentence_transformer
+
+# Compares an ONNX / int8 export of the query encoder (backend/encoders.py)
+# against the reference SentenceTransformer: embedding drift and encode
+# latency locally, and NDCG through two running backends, one serving each
+# encoder, evaluated with the same harness as eval_HNSW.py.
+REFERENCE_MODEL = "msmarco-MiniLM-L6-cos-v5"
+LATENCY_QUERIES = 200  # queries encoded one at a time for the latency comparison
+
+def encode(model, texts, batch_size=64):
+    return np.asarray(model.encode(texts, batch_size=batch_size, show_progress_bar=False, convert_to_numpy=True),
+                      dtype=np.float32)
+
+def cosine_drift(reference, candidate):
+    """
+    Per-query 1 - cosine similarity between reference and candidate embeddings.
+    """
+    dots = np.sum(reference * candidate, axis=1)
+    norms = np.linalg.norm(reference, axis=1) * np.linalg.norm(candidate, axis=1)
+    return 1.0 - dots / np.maximum(norms, 1e-12)
+
+def encode_latencies(model, texts):
+    """
+    Wall time in seconds of encoding each text on its own, as the backend does
+    for a single uncached query.
+    """
+    encode(model, texts[:8])  # warm up
+    latencies = []
+    for text in texts:
+        start = time.perf_counter()
+        encode(model, [text])
+        latencies.append(time.perf_counter() - start)
+    return latencies
+
+def ndcg_for_endpoint(queries, qrels, endpoint, args):
+    run, stats = asyncio.run(build_run_async(queries, endpoint, args.concurrency, args.batch_size, args.top_k))
+    if stats["errors"]:
+        print(f"Warning: {stats['errors']} failed requests against {endpoint}")
+    return evaluate(qrels, run, ["ndcg"])["ndcg"]
+
+def main():
+    parser = argparse.ArgumentParser(description="Check an ONNX/int8 query encoder against the reference model.")
+    parser.add_argument("candidate_path", help="Model directory written by backend/encoders.py")
+    parser.add_argument("--candidate-file", default=None, help="ONNX file inside it, e.g. onnx/model_qint8_avx512_vnni.onnx")
+    parser.add_argument("--reference-model", default=REFERENCE_MODEL)
+    parser.add_argument("--threads", type=int, default=None, help="Intra-op threads for both models")
+    parser.add_argument("--max-drift", type=float, default=0.01,
+                        help="Fail if any query's 1 - cosine exceeds this")
+    parser.add_argument("--reference-endpoint", default=None,
+                        help="/search/batch URL of a backend serving the reference encoder")
+    parser.add_argument("--candidate-endpoint", default=None,
+                        help="/search/batch URL of a backend serving the candidate encoder")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--batch-size", type=int, default=16)
+    parser.add_argument("--top-k", type=int, default=10)
+    args = parser.parse_args()
+
+    queries = load_queries(QUERIES_FILE)
+    texts = list(queries.values())
+
+    if args.threads:
+        import torch
+        torch.set_num_threads(args.threads)
+    reference = load_sentence_transformer(args.reference_model)
+    candidate = load_sentence_transformer(args.candidate_path, "onnx", args.candidate_file, args.threads)
+
+    drift = cosine_drift(encode(reference, texts), encode(candidate, texts))
+    print(f"Cosine drift over {len(texts)} queries: mean {drift.mean():.2e}, "
+          f"p99 {np.percentile(drift, 99):.2e}, max {drift.max():.2e}")
+
+    sample = texts[:LATENCY_QUERIES]
+    reference_latencies = encode_latencies(reference, sample)
+    candidate_latencies = encode_latencies(candidate, sample)
+    for name, latencies in (("reference", reference_latencies), ("candidate", candidate_latencies)):
+        print(f"Encode latency ({name}) p50/p95: {percentile(latencies, 50) * 1000:.2f} / "
+              f"{percentile(latencies, 95) * 1000:.2f} ms")
+    print(f"Speedup at p50: {percentile(reference_latencies, 50) / percentile(candidate_latencies, 50):.2f}x")
+
+    if args.reference_endpoint or args.candidate_endpoint:
+        qrels = load_qrels(QRELS_FILE)
+        reference_ndcg = ndcg_for_endpoint(queries, qrels, args.reference_endpoint or BATCH_ENDPOINT, args)
+        candidate_ndcg = ndcg_for_endpoint(queries, qrels, args.candidate_endpoint or BATCH_ENDPOINT, args)
+        print(f"NDCG reference {reference_ndcg:.4f}, candidate {candidate_ndcg:.4f}, "
+              f"delta {candidate_ndcg - reference_ndcg:+.4f}")
+
+    if drift.max() > args.max_drift:
+        raise SystemExit(f"Max cosine drift {drift.max():.2e} exceeds {args.max_drift}")
+
+if __name__ == "__main__":
+    main()
@@ -1,99 +1,79 @@
-import pytrec_eval
-from pyserini.search import SimpleSearcher
+import argparse
+import os
+import sys
+import time
+
+from evaltools import DEFAULT_MEASURES, cached_run, evaluate, load_qrels, load_queries, print_metrics, queries_fingerprint
+
+# Search with the same BM25 setup as the backend's sparse/hybrid leg
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "backend"))
+from hybrid import LexicalSearcher
 
 # Paths to queries and qrels
 QUERIES_FILE = "queries.txt"  # Format: qid \t query_text
 QRELS_FILE = "qrels.txt"      # Format: qid 0 docid relevance
 INDEX_DIR = "msmarco_index"   # Path to your BM25 index
+RUNS_DIR = "runs"             # TREC run files, keyed by a hash of the run configuration
 TOP_K = 10
+THREADS = os.cpu_count() or 1  # Lucene search threads
+BATCH_SIZE = 1000  # queries per batch_search call
 
-def load_queries(queries_file):
-    """
-    Load queries from a file of the form: qid \t query_text
-    """
-    queries = {}
-    with open(queries_file, 'r') as f:
-        for line in f:
-            line = line.strip()
-            if not line:
-                continue
-            qid, qtext = line.split('\t', 1)
-            queries[qid] = qtext
-    return queries
-
-def load_qrels(qrels_file):
+def bm25_run(searcher, queries, top_k=TOP_K, batch_size=BATCH_SIZE):
     """
-    Load qrels in TREC format: qid 0 docid relevance
-    Returns a dict suitable for pytrec_eval: { qid: { docid: rel, ...}, ... }
+    Build a run dictionary run[qid][docid] = score with a LexicalSearcher's
+    multi-threaded batch search, batch_size queries at a time.
     """
-    qrels = {}
-    with open(qrels_file, 'r') as f:
-        for line in f:
-            line = line.strip()
-            if not line:
-                continue
-            qid, _, docid, rel = line.split()
-            rel = int(rel)
-            if qid not in qrels:
-                qrels[qid] = {}
-            qrels[qid][docid] = rel
-    return qrels
-
-def evaluate(qrels, run):
-    """
-    Evaluate the run using pytrec_eval, computing NDCG, MRR, and Recall@10.
-    """
-    metrics = {
-        "ndcg",
-        "recip_rank",   # MRR
-        "recall_10"     # recall at cutoff 10
-    }
-
-    evaluator = pytrec_eval.RelevanceEvaluator(qrels, metrics)
-    results = evaluator.evaluate(run)
-
-    ndcg_values = []
-    mrr_values = []
-    recall_values = []
-
-    for res in results.values():
-        if 'ndcg' in res:
-            ndcg_values.append(res['ndcg'])
-        if 'recip_rank' in res:
-            mrr_values.append(res['recip_rank'])
-        if 'recall_10' in res:
-            recall_values.append(res['recall_10'])
-
-    avg_ndcg = sum(ndcg_values) / len(ndcg_values) if ndcg_values else 0.0
-    avg_mrr = sum(mrr_values) / len(mrr_values) if mrr_values else 0.0
-    avg_recall = sum(recall_values) / len(recall_values) if recall_values else 0.0
-
-    return avg_ndcg, avg_mrr, avg_recall
+    qids = list(queries)
+    run = {}
+    for start in range(0, len(qids), batch_size):
+        batch_qids = qids[start:start + batch_size]
+        results = searcher.search_many([queries[qid] for qid in batch_qids], top_k)
+        for qid, hits in zip(batch_qids, results):
+            # Use the BM25 score as the retrieval score
+            run[qid] = dict(hits)
+    return run
 
 def main():
+    parser = argparse.ArgumentParser(description="Evaluate BM25 on the TREC query set.")
+    parser.add_argument("--queries", default=QUERIES_FILE)
+    parser.add_argument("--qrels", default=QRELS_FILE)
+    parser.add_argument("--index-dir", default=INDEX_DIR)
+    parser.add_argument("--runs-dir", default=RUNS_DIR)
+    parser.add_argument("--top-k", type=int, default=TOP_K)
+    # BM25 parameters for better performance
+    parser.add_argument("--k1", type=float, default=0.9)
+    parser.add_argument("--b", type=float, default=0.4)
+    parser.add_argument("--threads", type=int, default=THREADS)
+    parser.add_argument("--measures", nargs="+", default=list(DEFAULT_MEASURES),
+                        help="pytrec_eval measures, e.g. ndcg_cut_10 recall_100")
+    parser.add_argument("--force", action="store_true", help="Re-run the searches even if a cached run exists")
+    args = parser.parse_args()
+
     # Load queries and qrels
-    queries = load_queries(QUERIES_FILE)
-    qrels = load_qrels(QRELS_FILE)
+    queries = load_queries(args.queries)
+    qrels = load_qrels(args.qrels)
 
-    # Initialize a Pyserini searcher on the BM25 index
-    searcher = SimpleSearcher(INDEX_DIR)
-    # BM25 parameters for better performance
-    searcher.set_bm25(k1=0.9, b=0.4)
+    # Everything that changes the ranking; metrics and qrels are applied to the cached run
+    config = {
+        "index_dir": os.path.abspath(args.index_dir),
+        "k1": args.k1,
+        "b": args.b,
+        "top_k": args.top_k,
+        "queries": queries_fingerprint(queries),
+    }
 
-    # Build a run dictionary: run[qid][docid] = score
-    run = {}
-    for qid, qtext in queries.items():
-        hits = searcher.search(qtext, k=TOP_K)
-        run[qid] = {}
-        for i, hit in enumerate(hits):
-            # Use hit.score as the retrieval score
-            run[qid][hit.docid] = float(hit.score)
+    def build_run():
+        searcher = LexicalSearcher(args.index_dir, args.k1, args.b, args.threads)
+        start = time.perf_counter()
+        run = bm25_run(searcher, queries, args.top_k)
+        print(f"Searched {len(queries)} queries in {time.perf_counter() - start:.1f}s with {args.threads} threads")
+        return run, 0
+
+    run, path, cached = cached_run(args.runs_dir, "bm25", config, build_run, args.force)
+    print(f"{'Loaded cached' if cached else 'Wrote'} run {path}")
 
     # Evaluate using pytrec_eval
-    avg_ndcg, avg_mrr, avg_recall = evaluate(qrels, run)
-    print(f"Average NDCG: {avg_ndcg:.4f}")
-    print(f"Average MRR: {avg_mrr:.4f}")
-    print(f"Average Recall@10: {avg_recall:.4f}")
+    print_metrics(evaluate(qrels, run, args.measures))
 
 if __name__ == "__main__":
     main()
@@ -1,131 +1,242 @@
-import json
-import requests
-import pytrec_eval
+import argparse
+import asyncio
+import hashlib
+import time
+
+import aiohttp
+from aiohttp import web
+
+from evaltools import DEFAULT_MEASURES, cached_run, evaluate, load_qrels, load_queries, print_metrics, queries_fingerprint
 
 # Paths to your queries and qrels file
 QUERIES_FILE = "queries.txt"
 QRELS_FILE = "qrels.txt"
+RUNS_DIR = "runs"  # TREC run files, keyed by a hash of the run configuration
 EC2_ENDPOINT = "http://ec2-endpoint>:5000/search"
+BATCH_ENDPOINT = EC2_ENDPOINT + "/batch"
 TOP_K = 10  # number of results to retrieve per query
-
-def load_queries(queries_file):
-    """
-    Load queries from a tab-separated file: query_id\tquery_text
-    """
-    queries = {}
-    with open(queries_file, 'r') as f:
-        for line in f:
-            line = line.strip()
-            if not line:
-                continue
-            qid, qtext = line.split('\t', 1)
-            queries[qid] = qtext
-    return queries
-
-def load_qrels(qrels_file):
+BATCH_SIZE = 1  # queries per /search/batch request (1 measures per-query latency)
+EF_SEARCH = None  # HNSW efSearch sent with each request (None keeps the server default)
+MODE = "dense"  # dense, sparse (BM25) or hybrid
+FUSION = "rrf"  # hybrid fusion: rrf or weighted
+CONCURRENCY = 32  # requests in flight at once
+REQUEST_TIMEOUT_S = 30
+
+async def query_ec2_batch(session, endpoint, query_texts, top_k, ef_search, options=None):
     """
-    Load qrels from a TREC-format qrels file: qid 0 docid relevance
-    Returns a dict suitable for pytrec_eval:
-    {
-      'qid': {
-          'docid': relevance_score,
-          ...
-      },
-      ...
-    }
+    Post a list of query texts to the batch endpoint and return one hit list per query.
+    options holds extra request fields (mode, fusion, dense_weight, sparse_weight).
+    Expecting response as JSON: {"results": [{"query": "...", "hits": [{"id": "X", "passage": "...", "score": 0.8}, ...]}, ...]}
     """
-    qrels = {}
-    with open(qrels_file, 'r') as f:
-        for line in f:
-            line = line.strip()
-            if not line:
-                continue
-            qid, _, docid, rel = line.split()
-            rel = int(rel)
-            if qid not in qrels:
-                qrels[qid] = {}
-            qrels[qid][docid] = rel
-    return qrels
-
-def query_ec2_endpoint(query_text):
+    payload = {"queries": query_texts, "top_k": top_k}
+    if ef_search is not None:
+        payload["efSearch"] = ef_search
+    payload.update(options or {})
+    async with session.post(endpoint, json=payload) as response:
+        response.raise_for_status()
+        body = await response.json()
+    return [result["hits"] for result in body["results"]]
+
+async def build_run_async(queries, endpoint, concurrency=CONCURRENCY, batch_size=BATCH_SIZE, top_k=TOP_K, ef_search=EF_SEARCH,
+                          options=None):
     """
-    Given a query text, post it to the EC2 endpoint and return retrieved passages.
-    Expecting response as JSON array: [{"id": "X", "passage": "..."}, ...]
+    Build a run dictionary run[qid][docid] = score by sending the queries
+    concurrently over a pooled keep-alive HTTP client.
+
+    Returns:
+    - run: The system's retrieval results, scored by the backend's similarity scores.
+    - stats: Dict with the number of queries and requests, error count,
+      per-request latencies (seconds) and total wall time.
     """
-    payload = {"query": query_text}
-    response = requests.post(EC2_ENDPOINT, json=payload)
-    response.raise_for_status()
-    passages = response.json()
-    return passages
+    qids = list(queries)
+    batches = [qids[start:start + batch_size] for start in range(0, len(qids), batch_size)]
+    run = {}
+    latencies = []
+    errors = 0
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def run_batch(session, batch_qids):
+        nonlocal errors
+        async with semaphore:
+            start = time.perf_counter()
+            try:
+                batch_hits = await query_ec2_batch(session, endpoint, [queries[qid] for qid in batch_qids], top_k, ef_search,
+                                                   options)
+                latencies.append(time.perf_counter() - start)
+            except (aiohttp.ClientError, asyncio.TimeoutError, KeyError) as e:
+                errors += 1
+                print(f"Error querying {batch_qids[0]}: {e!r}")
+                batch_hits = [[] for _ in batch_qids]
+        for qid, hits in zip(batch_qids, batch_hits):
+            run[qid] = {hit['id']: float(hit['score']) for hit in hits}
+
+    connector = aiohttp.TCPConnector(limit=concurrency)
+    timeout = aiohttp.ClientTimeout(total=REQUEST_TIMEOUT_S)
+    wall_start = time.perf_counter()
+    async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+        await asyncio.gather(*(run_batch(session, batch_qids) for batch_qids in batches))
+    stats = {
+        "queries": len(qids),
+        "requests": len(batches),
+        "errors": errors,
+        "latencies": latencies,
+        "wall_time": time.perf_counter() - wall_start,
+    }
+    return run, stats
 
-def build_run(queries):
+def percentile(values, pct):
     """
-    Build a run dictionary:
-    run[qid][docid] = score
-    This represents the system's retrieval results for evaluation.
+    Nearest-rank percentile of a list of numbers (0.0 for an empty list).
     """
-    run = {}
-    for qid, qtext in queries.items():
-        # Query the EC2 endpoint
-        try:
-            results = query_ec2_endpoint(qtext)
-        except requests.RequestException as e:
-            print(f"Error querying {qid}: {e}")
-            results = []
-
-        # Assign a score for ranking. Assume returned results are in ranked order.
-        run[qid] = {}
-        for rank, passage in enumerate(results, start=1):
-            docid = passage['id']
-            # Using a simple scoring scheme: higher rank gets higher score
-            score = TOP_K - rank + 1
-            run[qid][docid] = score
-    return run
-
-def evaluate(qrels, run):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(1, int(round(pct / 100.0 * len(ordered))))
+    return ordered[min(rank, len(ordered)) - 1]
+
+def latency_report(stats):
     """
-    Evaluate using pytrec_eval, compute NDCG, MRR, and Recall@10.
+    Summarize throughput, request latency percentiles (ms) and error rate.
     """
-    metrics = {
-        'ndcg',
-        'recip_rank',   # for MRR
-        'recall_10'     # recall at cutoff 10
+    latencies = stats["latencies"]
+    return {
+        "qps": stats["queries"] / stats["wall_time"] if stats["wall_time"] else 0.0,
+        "p50_ms": percentile(latencies, 50) * 1000,
+        "p95_ms": percentile(latencies, 95) * 1000,
+        "p99_ms": percentile(latencies, 99) * 1000,
+        "error_rate": stats["errors"] / stats["requests"] if stats["requests"] else 0.0,
     }
 
-    evaluator = pytrec_eval.RelevanceEvaluator(qrels, metrics)
-    results = evaluator.evaluate(run)
-
-    ndcg_values = []
-    mrr_values = []
-    recall_values = []
-
-    for res in results.values():
-        if 'ndcg' in res:
-            ndcg_values.append(res['ndcg'])
-        if 'recip_rank' in res:
-            mrr_values.append(res['recip_rank'])
-        if 'recall_10' in res:
-            recall_values.append(res['recall_10'])
+def make_stand_in_app(doc_ids, latency_ms=0.0):
+    """
+    Local stand-in for the backend's /search/batch endpoint, for running the
+    harness in CI without the EC2 endpoint.
 
-    avg_ndcg = sum(ndcg_values) / len(ndcg_values) if ndcg_values else 0.0
-    avg_mrr = sum(mrr_values) / len(mrr_values) if mrr_values else 0.0
-    avg_recall = sum(recall_values) / len(recall_values) if recall_values else 0.0
+    Each query deterministically gets TOP_K documents drawn from doc_ids
+    (e.g. the qrels documents) with descending scores, after latency_ms of
+    simulated work.
+    """
+    doc_ids = sorted(doc_ids)
+
+    async def search_batch(request):
+        body = await request.json()
+        top_k = body.get("top_k", TOP_K)
+        if latency_ms:
+            await asyncio.sleep(latency_ms / 1000.0)
+        results = []
+        for query in body["queries"]:
+            seed = int.from_bytes(hashlib.md5(query.encode("utf-8")).digest()[:8], "little")
+            hits = [
+                {"id": doc_ids[(seed + i * 7919) % len(doc_ids)], "passage": "", "score": 1.0 / (i + 1)}
+                for i in range(min(top_k, len(doc_ids)))
+            ]
+            results.append({"query": query, "hits": hits})
+        return web.json_response({"results": results})
+
+    app = web.Application()
+    app.router.add_post("/search/batch", search_batch)
+    return app
+
+async def start_stand_in_server(doc_ids, latency_ms=0.0):
+    """
+    Start the stand-in server on a free localhost port.
 
-    return avg_ndcg, avg_mrr, avg_recall
+    Returns:
+    - runner: aiohttp AppRunner; call await runner.cleanup() to stop it.
+    - endpoint: URL of its /search/batch endpoint.
+    """
+    runner = web.AppRunner(make_stand_in_app(doc_ids, latency_ms))
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    port = runner.addresses[0][1]
+    return runner, f"http://127.0.0.1:{port}/search/batch"
+
+async def run_benchmark(queries, qrels, args):
+    runner = None
+    endpoint = args.endpoint
+    if args.local:
+        doc_ids = {docid for docs in qrels.values() for docid in docs}
+        runner, endpoint = await start_stand_in_server(doc_ids, args.stand_in_latency_ms)
+        print(f"Using local stand-in server at {endpoint}")
+    try:
+        options = {"mode": args.mode, "fusion": args.fusion,
+                   "dense_weight": args.dense_weight, "sparse_weight": args.sparse_weight}
+        return await build_run_async(queries, endpoint, args.concurrency, args.batch_size, args.top_k, args.ef_search,
+                                     options)
+    finally:
+        if runner is not None:
+            await runner.cleanup()
 
 def main():
+    parser = argparse.ArgumentParser(description="Evaluate the HNSW backend on the TREC query set.")
+    parser.add_argument("--endpoint", default=BATCH_ENDPOINT, help="Backend /search/batch URL")
+    parser.add_argument("--concurrency", type=int, default=CONCURRENCY)
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+    parser.add_argument("--top-k", type=int, default=TOP_K)
+    parser.add_argument("--ef-search", type=int, default=EF_SEARCH)
+    parser.add_argument("--mode", choices=["dense", "sparse", "hybrid"], default=MODE)
+    parser.add_argument("--fusion", choices=["rrf", "weighted"], default=FUSION)
+    parser.add_argument("--dense-weight", type=float, default=1.0)
+    parser.add_argument("--sparse-weight", type=float, default=1.0)
+    parser.add_argument("--local", action="store_true", help="Query a local stand-in server instead of the backend")
+    parser.add_argument("--stand-in-latency-ms", type=float, default=0.0)
+    parser.add_argument("--queries", default=QUERIES_FILE)
+    parser.add_argument("--qrels", default=QRELS_FILE)
+    parser.add_argument("--runs-dir", default=RUNS_DIR)
+    parser.add_argument("--label", default="",
+                        help="Server-side setup (index build, encoder, ...) to key the cached run by")
+    parser.add_argument("--measures", nargs="+", default=list(DEFAULT_MEASURES),
+                        help="pytrec_eval measures, e.g. ndcg_cut_10 recall_100")
+    parser.add_argument("--force", action="store_true",
+                        help="Query the backend even if a cached run exists (needed for latency numbers)")
+    args = parser.parse_args()
+
     # Load queries and qrels
-    queries = load_queries(QUERIES_FILE)
-    qrels = load_qrels(QRELS_FILE)
+    queries = load_queries(args.queries)
+    qrels = load_qrels(args.qrels)
+
+    # Everything sent to the backend that changes the ranking. Concurrency and
+    # batch size only change latency, and metrics and qrels are applied to the
+    # cached run, so none of them are part of the key.
+    config = {
+        "endpoint": "local" if args.local else args.endpoint,
+        "label": args.label,
+        "top_k": args.top_k,
+        "ef_search": args.ef_search,
+        "mode": args.mode,
+        "fusion": args.fusion,
+        "dense_weight": args.dense_weight,
+        "sparse_weight": args.sparse_weight,
+        "queries": queries_fingerprint(queries),
+    }
+    stats = None
+
+    def build_run():
+        # Build the run by querying the backend concurrently
+        nonlocal stats
+        run, stats = asyncio.run(run_benchmark(queries, qrels, args))
+        return run, stats["errors"]
 
-    # Build the run by querying the EC2 endpoint
-    run = build_run(queries)
+    run, path, cached = cached_run(args.runs_dir, "hnsw", config, build_run, args.force)
+    if path is None:
+        print(f"Not caching the run: {stats['errors']} of {stats['requests']} requests failed")
+    else:
+        print(f"{'Loaded cached' if cached else 'Wrote'} run {path}")
 
     # Evaluate using pytrec_eval
-    avg_ndcg, avg_mrr, avg_recall = evaluate(qrels, run)
-    print(f"Average NDCG: {avg_ndcg:.4f}")
-    print(f"Average MRR: {avg_mrr:.4f}")
-    print(f"Average Recall@10: {avg_recall:.4f}")
+    print_metrics(evaluate(qrels, run, args.measures))
+    if stats is not None and stats["errors"]:
+        print(f"Warning: {stats['errors']} failed requests; their queries are scored as having no hits")
+
+    if stats is None:
+        print("Latency not measured for a cached run; pass --force to query the backend")
+        return
+    report = latency_report(stats)
+    print(f"Throughput: {report['qps']:.1f} queries/s over {stats['requests']} requests "
+          f"(mode {args.mode}, concurrency {args.concurrency}, batch size {args.batch_size})")
+    print(f"Latency p50/p95/p99: {report['p50_ms']:.1f} / {report['p95_ms']:.1f} / {report['p99_ms']:.1f} ms")
+    print(f"Error rate: {report['error_rate']:.2%}")
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,3 @@
+from .data import load_qrels, load_queries, queries_fingerprint
+from .metrics import DEFAULT_MEASURES, evaluate, print_metrics
+from .runs import cached_run, config_hash, read_run, run_path, write_run
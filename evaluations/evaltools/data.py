@@ -0,0 +1,40 @@
+import hashlib
+
+def load_queries(queries_file):
+    """
+    Load queries from a tab-separated file: query_id\tquery_text
+    """
+    queries = {}
+    with open(queries_file, 'r') as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            qid, qtext = line.split('\t', 1)
+            queries[qid] = qtext
+    return queries
+
+def load_qrels(qrels_file):
+    """
+    Load qrels from a TREC-format qrels file: qid 0 docid relevance
+    Returns a dict suitable for pytrec_eval: { qid: { docid: rel, ...}, ... }
+    """
+    qrels = {}
+    with open(qrels_file, 'r') as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            qid, _, docid, rel = line.split()
+            qrels.setdefault(qid, {})[docid] = int(rel)
+    return qrels
+
+def queries_fingerprint(queries):
+    """
+    Short hash of a query set, so that cached runs are keyed by the queries
+    they were built from and not just by the queries file name.
+    """
+    digest = hashlib.sha1()
+    for qid in sorted(queries):
+        digest.update(f"{qid}\t{queries[qid]}\n".encode("utf-8"))
+    return digest.hexdigest()[:12]
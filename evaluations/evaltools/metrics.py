@@ -0,0 +1,40 @@
+import pytrec_eval
+
+# pytrec_eval measures reported by default: NDCG, MRR and Recall@10
+DEFAULT_MEASURES = ("ndcg", "recip_rank", "recall_10")
+
+# Display names of common measures
+MEASURE_NAMES = {
+    "ndcg": "NDCG",
+    "ndcg_cut_10": "NDCG@10",
+    "recip_rank": "MRR",
+    "recall_10": "Recall@10",
+    "recall_100": "Recall@100",
+    "recall_1000": "Recall@1000",
+    "map": "MAP",
+}
+
+def evaluate(qrels, run, measures=DEFAULT_MEASURES):
+    """
+    Evaluate a run with pytrec_eval.
+
+    Parameters:
+    - qrels: { qid: { docid: rel } }.
+    - run: { qid: { docid: score } }.
+    - measures: pytrec_eval measure names (e.g. "ndcg_cut_10", "recall_100").
+
+    Returns:
+    - Dict of measure name -> mean over the evaluated queries (0.0 if none).
+    """
+    evaluator = pytrec_eval.RelevanceEvaluator(qrels, set(measures))
+    results = evaluator.evaluate(run)
+    means = {}
+    for measure in measures:
+        values = [res[measure] for res in results.values() if measure in res]
+        means[measure] = sum(values) / len(values) if values else 0.0
+    return means
+
+def print_metrics(means, label=None):
+    prefix = f"[{label}] " if label else ""
+    for measure, value in means.items():
+        print(f"{prefix}Average {MEASURE_NAMES.get(measure, measure)}: {value:.4f}")
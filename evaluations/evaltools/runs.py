@@ -0,0 +1,80 @@
+import hashlib
+import json
+import os
+
+def config_hash(config):
+    """
+    Short, stable hash of a system configuration (a JSON-serializable dict).
+    """
+    return hashlib.sha1(json.dumps(config, sort_keys=True).encode("utf-8")).hexdigest()[:12]
+
+def run_path(runs_dir, system, config):
+    """
+    Path of the TREC run file of a system under a configuration.
+    """
+    return os.path.join(runs_dir, f"{system}-{config_hash(config)}.trec")
+
+def write_run(path, run, tag):
+    """
+    Write a run { qid: { docid: score } } as a TREC run file
+    (qid Q0 docid rank score tag), best first per query. The file is written
+    under a temporary name and renamed, so an interrupted write never leaves
+    a truncated run behind.
+    """
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w") as f:
+        for qid in sorted(run):
+            ranked = sorted(run[qid].items(), key=lambda hit: (-hit[1], hit[0]))
+            for rank, (docid, score) in enumerate(ranked, start=1):
+                f.write(f"{qid} Q0 {docid} {rank} {score!r} {tag}\n")
+    os.replace(tmp_path, path)
+
+def read_run(path):
+    """
+    Read a TREC run file into { qid: { docid: score } }.
+    """
+    run = {}
+    with open(path) as f:
+        for line in f:
+            parts = line.split()
+            if not parts:
+                continue
+            qid, _, docid, _, score = parts[:5]
+            run.setdefault(qid, {})[docid] = float(score)
+    return run
+
+def cached_run(runs_dir, system, config, build_run, force=False):
+    """
+    Return the run of a system under a configuration, building it only if no
+    run file for that configuration hash exists yet.
+
+    The configuration is written next to the run (<run>.json), so a run file
+    can be traced back to the settings that produced it. Metrics and qrels
+    are not part of the configuration: changing them re-scores the cached
+    run without querying the system again. A run whose build had errors
+    (e.g. failed backend requests, whose queries have no hits) is returned
+    but never cached, so it cannot be re-scored later as if it were valid.
+
+    Parameters:
+    - runs_dir: Directory holding the run files.
+    - system: System name used as the file name prefix and the TREC run tag.
+    - config: JSON-serializable dict of every setting that changes results.
+    - build_run: Function returning (run, errors): the run
+      { qid: { docid: score } } and the number of errors while building it.
+    - force: Rebuild even if a cached run exists.
+
+    Returns:
+    - (run, path, cached): cached is True if the run was read from disk;
+      path is None if the run had errors and was not written.
+    """
+    path = run_path(runs_dir, system, config)
+    if os.path.exists(path) and not force:
+        return read_run(path), path, True
+    run, errors = build_run()
+    if errors:
+        return run, None, False
+    os.makedirs(runs_dir, exist_ok=True)
+    with open(path + ".json", "w") as f:
+        json.dump({"system": system, "config": config}, f, indent=2, sort_keys=True)
+    write_run(path, run, system)
+    return run, path, False
@@ -0,0 +1,51 @@
+import argparse
+import glob
+import json
+import os
+
+from evaltools import DEFAULT_MEASURES, evaluate, load_qrels, read_run
+from evaltools.metrics import MEASURE_NAMES
+
+# Re-computes metrics from cached TREC run files (written by eval_BM25.py and
+# eval_HNSW.py) without querying any system, e.g. after changing the qrels or
+# the metric set.
+RUNS_DIR = "runs"
+QRELS_FILE = "qrels.txt"
+
+def run_label(path):
+    """
+    System name and configuration of a run, from the .json written next to it.
+    """
+    config_path = path + ".json"
+    if not os.path.exists(config_path):
+        return os.path.basename(path)
+    with open(config_path) as f:
+        info = json.load(f)
+    settings = ", ".join(f"{key}={value}" for key, value in sorted(info["config"].items())
+                         if key not in ("queries", "index_dir", "endpoint"))
+    return f"{os.path.basename(path)} ({settings})"
+
+def main():
+    parser = argparse.ArgumentParser(description="Score cached TREC run files against qrels.")
+    parser.add_argument("runs", nargs="*", help="Run files or globs (default: every run in --runs-dir)")
+    parser.add_argument("--runs-dir", default=RUNS_DIR)
+    parser.add_argument("--qrels", default=QRELS_FILE)
+    parser.add_argument("--measures", nargs="+", default=list(DEFAULT_MEASURES),
+                        help="pytrec_eval measures, e.g. ndcg_cut_10 recall_100")
+    args = parser.parse_args()
+
+    patterns = args.runs or [os.path.join(args.runs_dir, "*.trec")]
+    paths = sorted({path for pattern in patterns for path in glob.glob(pattern)})
+    if not paths:
+        raise SystemExit(f"No run files match {' '.join(patterns)}")
+
+    qrels = load_qrels(args.qrels)
+    header = "  ".join(f"{MEASURE_NAMES.get(measure, measure):>11}" for measure in args.measures)
+    print(f"{header}  run")
+    for path in paths:
+        means = evaluate(qrels, read_run(path), args.measures)
+        values = "  ".join(f"{means[measure]:>11.4f}" for measure in args.measures)
+        print(f"{values}  {run_label(path)}")
+
+if __name__ == "__main__":
+    main()
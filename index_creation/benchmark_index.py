@@ -0,0 +1,178 @@
+import argparse
+import csv
+import json
+import os
+import time
+
+import numpy as np
+import faiss
+
+from create_index import new_index, sample_embeddings
+from embedding_shards import open_embeddings
+
+# Parameter grid; every (M, ef_construction) pair is built once and searched
+# at every ef_search value
+M_VALUES = [8, 16, 32]
+EF_CONSTRUCTION_VALUES = [100, 200]
+EF_SEARCH_VALUES = [16, 32, 64, 128, 256]
+
+def current_rss_bytes():
+    """
+    Resident set size of this process in bytes, or None where /proc is unavailable.
+    """
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        return None
+
+def load_benchmark_data(file_path, sample_size, num_queries, seed=0):
+    """
+    Sample base vectors and held-out query vectors from the embeddings.
+
+    Queries are drawn from the sample and removed from the base, so no query
+    is its own nearest neighbor.
+
+    Returns:
+    - base: (sample_size - num_queries, dim) float32 array.
+    - queries: (num_queries, dim) float32 array.
+    """
+    with open_embeddings(file_path) as embedding_dataset:
+        sample = sample_embeddings(embedding_dataset, sample_size)
+    rng = np.random.default_rng(seed)
+    query_rows = rng.choice(len(sample), size=num_queries, replace=False)
+    is_query = np.zeros(len(sample), dtype=bool)
+    is_query[query_rows] = True
+    return np.ascontiguousarray(sample[~is_query]), np.ascontiguousarray(sample[is_query])
+
+def exact_ground_truth(base, queries, top_k):
+    """
+    Exact top-k inner-product neighbors by brute force.
+    """
+    index = faiss.IndexFlatIP(base.shape[1])
+    index.add(base)
+    _, ground_truth = index.search(queries, top_k)
+    return ground_truth
+
+def recall_at_k(indices, ground_truth, top_k):
+    """
+    Average fraction of the exact top-k found in the returned top-k.
+    """
+    hits = [len(set(found[:top_k]) & set(exact[:top_k])) for found, exact in zip(indices, ground_truth)]
+    return sum(hits) / (top_k * len(ground_truth))
+
+def pareto_front(results):
+    """
+    Return the results not dominated in both recall and QPS, by increasing recall.
+    """
+    front = []
+    for result in sorted(results, key=lambda r: (-r["qps"], -r["recall"])):
+        if not front or result["recall"] > front[-1]["recall"]:
+            front.append(result)
+    return front
+
+def run_benchmark(base, queries, top_k=10, m_values=M_VALUES, ef_construction_values=EF_CONSTRUCTION_VALUES,
+                  ef_search_values=EF_SEARCH_VALUES, search_repeats=3):
+    """
+    Build an HNSW index for every (M, ef_construction) pair and measure
+    recall@k and QPS at every ef_search.
+
+    Returns:
+    - List of result dicts, one per (M, ef_construction, ef_search).
+    """
+    ground_truth = exact_ground_truth(base, queries, top_k)
+    results = []
+    for M in m_values:
+        for ef_construction in ef_construction_values:
+            rss_before = current_rss_bytes()
+            start = time.perf_counter()
+            index = new_index(base.shape[1], "hnsw_flat", ef_construction, M)
+            index.add(base)
+            build_time = time.perf_counter() - start
+            rss_after = current_rss_bytes()
+            index_bytes = faiss.serialize_index(index).nbytes
+            print(f"M={M} ef_construction={ef_construction}: built in {build_time:.1f}s, "
+                  f"{index_bytes / 2**20:.1f} MiB")
+
+            for ef_search in ef_search_values:
+                params = faiss.SearchParametersHNSW(efSearch=ef_search)
+                # Best of a few runs, to keep scheduler noise out of the QPS
+                search_time = float("inf")
+                for _ in range(search_repeats):
+                    start = time.perf_counter()
+                    _, indices = index.search(queries, top_k, params=params)
+                    search_time = min(search_time, time.perf_counter() - start)
+                result = {
+                    "M": M,
+                    "ef_construction": ef_construction,
+                    "ef_search": ef_search,
+                    "recall": recall_at_k(indices, ground_truth, top_k),
+                    "qps": len(queries) / search_time,
+                    "build_time_s": build_time,
+                    "index_bytes": index_bytes,
+                    "memory_bytes": None if rss_before is None else rss_after - rss_before,
+                    "num_base": len(base),
+                    "num_queries": len(queries),
+                    "top_k": top_k,
+                    "threads": faiss.omp_get_max_threads(),
+                }
+                results.append(result)
+                print(f"  ef_search={ef_search}: recall@{top_k}={result['recall']:.4f}, qps={result['qps']:.0f}")
+            del index
+    return results
+
+def write_results(results, output_dir):
+    """
+    Write results.json, results.csv and pareto.json, plus a recall/QPS plot
+    when matplotlib is installed.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    front = pareto_front(results)
+    with open(os.path.join(output_dir, "results.json"), "w") as f:
+        json.dump({"results": results, "pareto": front}, f, indent=2)
+    with open(os.path.join(output_dir, "results.csv"), "w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=list(results[0]))
+        writer.writeheader()
+        writer.writerows(results)
+    with open(os.path.join(output_dir, "pareto.json"), "w") as f:
+        json.dump(front, f, indent=2)
+
+    try:
+        import matplotlib
+        matplotlib.use("Agg")
+        import matplotlib.pyplot as plt
+    except ImportError:
+        print("matplotlib not installed; skipping the Pareto plot")
+        return
+    fig, ax = plt.subplots(figsize=(8, 5))
+    configs = sorted({(r["M"], r["ef_construction"]) for r in results})
+    for M, ef_construction in configs:
+        curve = [r for r in results if r["M"] == M and r["ef_construction"] == ef_construction]
+        ax.plot([r["recall"] for r in curve], [r["qps"] for r in curve], marker="o",
+                label=f"M={M}, efC={ef_construction}")
+    ax.plot([r["recall"] for r in front], [r["qps"] for r in front], "k--", label="Pareto front")
+    ax.set_xlabel(f"recall@{results[0]['top_k']}")
+    ax.set_ylabel("queries / s")
+    ax.set_yscale("log")
+    ax.legend()
+    ax.grid(True, alpha=0.3)
+    fig.savefig(os.path.join(output_dir, "pareto.png"), dpi=120, bbox_inches="tight")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark HNSW parameters on a sample of the embeddings.")
+    parser.add_argument("--embeddings", default="collection_shards/manifest.json",
+                        help="Shard manifest or HDF5 embedding file")
+    parser.add_argument("--output", default="benchmark_results")
+    parser.add_argument("--sample-size", type=int, default=500000)
+    parser.add_argument("--num-queries", type=int, default=1000)
+    parser.add_argument("--top-k", type=int, default=10)
+    parser.add_argument("--M", type=int, nargs="+", default=M_VALUES)
+    parser.add_argument("--ef-construction", type=int, nargs="+", default=EF_CONSTRUCTION_VALUES)
+    parser.add_argument("--ef-search", type=int, nargs="+", default=EF_SEARCH_VALUES)
+    args = parser.parse_args()
+
+    base, queries = load_benchmark_data(args.embeddings, args.sample_size, args.num_queries)
+    print(f"Benchmarking on {len(base)} base vectors and {len(queries)} queries")
+    results = run_benchmark(base, queries, args.top_k, args.M, args.ef_construction, args.ef_search)
+    write_results(results, args.output)
+    print(f"Results written to {args.output}")
@@ -0,0 +1,140 @@
+import argparse
+import json
+import os
+
+import numpy as np
+import faiss
+
+from create_index import new_index, sample_embeddings
+from disk_index_format import FORMAT_VERSION, GRAPH_FILE, META_FILE, PQ_CENTROIDS_FILE, PQ_CODES_FILE, node_record_dtype
+from embedding_shards import iter_batches, open_embeddings
+
+def base_layer(hnsw_index):
+    """
+    Extract the flat neighbor table of a FAISS HNSW index.
+
+    Returns:
+    - offsets: Start of each node's neighbor block in neighbors.
+    - neighbors: Flat int32 neighbor table (-1 padded).
+    - max_degree: Number of base-layer neighbor slots per node (2 * M).
+    """
+    hnsw = hnsw_index.hnsw
+    offsets = faiss.vector_to_array(hnsw.offsets).astype(np.int64)
+    neighbors = faiss.vector_to_array(hnsw.neighbors)
+    return offsets, neighbors, hnsw.nb_neighbors(0)
+
+def base_layer_neighbors(offsets, neighbors, max_degree, start, end):
+    """
+    Return the base-layer neighbors of nodes [start, end) as a
+    (end - start, max_degree) int32 array, padded with -1.
+    """
+    # Layer 0 comes first in every node's neighbor block
+    positions = offsets[start:end, None] + np.arange(max_degree)[None, :]
+    return neighbors[positions].astype(np.int32)
+
+def create_disk_index(file_path, output_dir, hnsw_index_path=None, batch_size=200000,
+                      ef_construction=200, M=32, pq_m=48, train_size=200000):
+    """
+    Build a DiskANN-style disk-resident graph index.
+
+    The graph is the base layer of an HNSW index over the embeddings. Each
+    node is stored as a fixed-size record (neighbors + full vector) in
+    graph.bin, so the searcher can fetch any node with one read. PQ codes of
+    pq_m bytes per vector are written separately; they are the only
+    per-vector data the searcher keeps in RAM, to guide the beam search.
+
+    Parameters:
+    - file_path: Shard manifest or HDF5 embedding file.
+    - output_dir: Directory to write the disk index into.
+    - hnsw_index_path: Existing IndexHNSWFlat built over the same rows by
+      create_index.py; if None, one is built here (in RAM, build time only).
+    - batch_size: Number of embeddings read per batch.
+    - ef_construction: HNSW construction parameter when building the graph.
+    - M: HNSW graph connectivity when building the graph (node degree is 2 * M).
+    - pq_m: PQ sub-quantizers, i.e. bytes per in-memory code; must divide the dimension.
+    - train_size: Number of embeddings sampled to train the PQ.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    with open_embeddings(file_path) as embedding_dataset:
+        num_embeddings, embedding_dim = embedding_dataset.shape
+
+        if hnsw_index_path:
+            print(f"Reading graph from {hnsw_index_path}...")
+            graph_index = faiss.read_index(hnsw_index_path)
+        else:
+            print(f"Building HNSW graph over {num_embeddings} embeddings...")
+            graph_index = new_index(embedding_dim, "hnsw_flat", ef_construction, M)
+            for start, vectors in iter_batches(embedding_dataset, batch_size):
+                graph_index.add(vectors)
+                print(f"Processed batch {start} to {start + len(vectors)}")
+        if graph_index.ntotal != num_embeddings:
+            raise ValueError(f"Graph has {graph_index.ntotal} nodes but there are {num_embeddings} embeddings")
+        offsets, neighbors, max_degree = base_layer(graph_index)
+        del graph_index
+
+        print("Training PQ for in-memory codes...")
+        pq = faiss.ProductQuantizer(embedding_dim, pq_m, 8)
+        pq.train(sample_embeddings(embedding_dataset, train_size))
+        centroids = faiss.vector_to_array(pq.centroids).reshape(pq.M, pq.ksub, pq.dsub)
+        np.save(os.path.join(output_dir, PQ_CENTROIDS_FILE), centroids)
+
+        # Stream the node records and PQ codes; track the mean to pick the medoid
+        record_dtype = node_record_dtype(max_degree, embedding_dim)
+        codes = np.lib.format.open_memmap(
+            os.path.join(output_dir, PQ_CODES_FILE), mode="w+", dtype=np.uint8, shape=(num_embeddings, pq_m)
+        )
+        total = np.zeros(embedding_dim, dtype=np.float64)
+        with open(os.path.join(output_dir, GRAPH_FILE), "wb") as graph_out:
+            for start, vectors in iter_batches(embedding_dataset, batch_size):
+                end = start + len(vectors)
+                node_neighbors = base_layer_neighbors(offsets, neighbors, max_degree, start, end)
+                records = np.zeros(end - start, dtype=record_dtype)
+                records["neighbors"] = node_neighbors
+                records["degree"] = (node_neighbors >= 0).sum(axis=1)
+                records["vector"] = vectors
+                records.tofile(graph_out)
+                codes[start:end] = pq.compute_codes(vectors)
+                total += vectors.sum(axis=0, dtype=np.float64)
+                print(f"Wrote node records {start} to {end}")
+        codes.flush()
+
+        # Entry point: the vector with the highest similarity to the mean
+        mean = (total / num_embeddings).astype(np.float32)
+        entry_point, best = 0, -np.inf
+        for start, vectors in iter_batches(embedding_dataset, batch_size):
+            scores = vectors @ mean
+            if scores.max() > best:
+                entry_point, best = start + int(scores.argmax()), float(scores.max())
+
+    meta = {
+        "format": "disk_graph",
+        "version": FORMAT_VERSION,
+        "metric": "inner_product",
+        "dim": int(embedding_dim),
+        "ntotal": int(num_embeddings),
+        "max_degree": int(max_degree),
+        "record_size": record_dtype.itemsize,
+        "pq_m": pq_m,
+        "entry_point": entry_point,
+    }
+    with open(os.path.join(output_dir, META_FILE), "w") as f:
+        json.dump(meta, f, indent=2)
+    print(f"Disk index saved to {output_dir} ({record_dtype.itemsize} bytes per node)")
+    return meta
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build a disk-resident graph index.")
+    parser.add_argument("--embeddings", default="collection_shards/manifest.json",
+                        help="Shard manifest or HDF5 embedding file")
+    parser.add_argument("--output", default="disk_index", help="Output directory")
+    parser.add_argument("--hnsw-index", default=None,
+                        help="Reuse the base layer of an existing hnsw_flat index built over the same embeddings")
+    parser.add_argument("--batch-size", type=int, default=200000)
+    parser.add_argument("--ef-construction", type=int, default=200)
+    parser.add_argument("--M", type=int, default=32)
+    parser.add_argument("--pq-m", type=int, default=48)
+    parser.add_argument("--train-size", type=int, default=200000)
+    args = parser.parse_args()
+
+    create_disk_index(args.embeddings, args.output, args.hnsw_index, args.batch_size,
+                      args.ef_construction, args.M, args.pq_m, args.train_size)
@@ -1,45 +1,250 @@
-import h5py
+import argparse
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+
 import numpy as np
 import faiss
 
-def create_hnsw_index_streaming(file_path, index_path, batch_size=200000, ef_construction=200, M=8):
+from embedding_shards import iter_batches, open_embeddings
+
+# Manifest describing a sharded index; loaded by the backend
+SHARD_MANIFEST_FILE = "shards.json"
+
+# Index types selectable at build time:
+# - hnsw_flat: HNSW graph over full float32 vectors (4 * dim bytes per vector)
+# - hnsw_sq8:  HNSW graph over 8-bit scalar-quantized vectors (dim bytes per vector)
+# - ivf_pq:    inverted lists of product-quantized codes (pq_m bytes per vector)
+# Compressed types are meant to be served with exact re-ranking from the full
+# vectors on disk (backend/exact_refine.py).
+INDEX_TYPES = ("hnsw_flat", "hnsw_sq8", "ivf_pq")
+
+def new_index(embedding_dim, index_type="hnsw_flat", ef_construction=200, M=8, nlist=16384, pq_m=48, nprobe=32):
+    """
+    Create an empty inner-product index of the given type.
+
+    Parameters:
+    - embedding_dim: Dimension of the embeddings.
+    - index_type: One of INDEX_TYPES.
+    - ef_construction: HNSW construction parameter (HNSW types).
+    - M: HNSW graph connectivity (HNSW types).
+    - nlist: Number of inverted lists (ivf_pq).
+    - pq_m: Number of PQ sub-quantizers, i.e. bytes per code; must divide embedding_dim (ivf_pq).
+    - nprobe: Default number of inverted lists visited per query (ivf_pq).
+
+    Returns:
+    - FAISS index; hnsw_sq8 and ivf_pq need train_index before vectors are added.
+    """
+    if index_type == "hnsw_flat":
+        index = faiss.IndexHNSWFlat(embedding_dim, M, faiss.METRIC_INNER_PRODUCT)
+    elif index_type == "hnsw_sq8":
+        index = faiss.IndexHNSWSQ(embedding_dim, faiss.ScalarQuantizer.QT_8bit, M, faiss.METRIC_INNER_PRODUCT)
+    elif index_type == "ivf_pq":
+        index = faiss.index_factory(embedding_dim, f"IVF{nlist},PQ{pq_m}", faiss.METRIC_INNER_PRODUCT)
+        faiss.extract_index_ivf(index).nprobe = nprobe
+        return index
+    else:
+        raise ValueError(f"Unknown index type {index_type!r}; expected one of {INDEX_TYPES}")
+    index.hnsw.efConstruction = ef_construction
+    return index
+
+def sample_embeddings(embedding_dataset, sample_size=200000, num_chunks=20):
+    """
+    Read a float32 sample of the embeddings for training quantizers.
+
+    The sample is num_chunks contiguous slices spread evenly over the rows,
+    which keeps reads sequential while covering the whole collection.
+    """
+    num_embeddings = embedding_dataset.shape[0]
+    chunk = max(1, min(sample_size, num_embeddings) // num_chunks)
+    starts = np.unique(np.linspace(0, num_embeddings - chunk, num_chunks).astype(np.int64))
+    sample = np.concatenate([embedding_dataset[start:start + chunk] for start in starts])
+    return np.ascontiguousarray(sample, dtype=np.float32)
+
+def train_index(index, embedding_dataset, train_size=200000):
     """
-    Create an HNSW index by streaming embeddings from an HDF5 file.
+    Train a compressed index on a sample of the embeddings (no-op for hnsw_flat).
+    """
+    if index.is_trained:
+        return
+    sample = sample_embeddings(embedding_dataset, train_size)
+    print(f"Training index on {len(sample)} sampled embeddings...")
+    index.train(sample)
+
+def create_hnsw_index_streaming(file_path, index_path, batch_size=200000, ef_construction=200, M=8,
+                                index_type="hnsw_flat", nlist=16384, pq_m=48, train_size=200000):
+    """
+    Create an HNSW index by streaming embeddings from disk.
 
     Parameters:
-    - file_path: Path to the HDF5 file.
+    - file_path: Path to a shard manifest written by spark_embeddings.py, or
+      to an HDF5 file with an 'embedding' dataset.
     - index_path: Path to save the FAISS index.
     - batch_size: Number of embeddings to load per batch.
     - ef_construction: HNSW construction parameter for accuracy (default 200).
-    - M: HNSW graph connectivity (default 32).
+    - M: HNSW graph connectivity (default 8; see benchmark_index.py for the recall/speed trade-off).
+    - index_type: One of INDEX_TYPES (default hnsw_flat).
+    - nlist, pq_m: IVF-PQ parameters (ivf_pq only).
+    - train_size: Number of embeddings sampled to train compressed index types.
     """
-    print(f"Creating HNSW index for embeddings in {file_path}...")
+    print(f"Creating {index_type} index for embeddings in {file_path}...")
 
-    # Open the HDF5 file
-    with h5py.File(file_path, 'r') as f:
-        embedding_dataset = f['embedding']
+    # Open the embedding shards (or HDF5 file); rows are read lazily per batch
+    with open_embeddings(file_path) as embedding_dataset:
         num_embeddings, embedding_dim = embedding_dataset.shape
 
         print(f"Total embeddings: {num_embeddings}, Dimension: {embedding_dim}")
 
-        # Create the HNSW index
-        index = faiss.IndexHNSWFlat(embedding_dim, M, faiss.METRIC_INNER_PRODUCT)
-        index.hnsw.efConstruction = ef_construction
+        # Create the index, training it first if it is a compressed type
+        index = new_index(embedding_dim, index_type, ef_construction, M, nlist, pq_m)
+        train_index(index, embedding_dataset, train_size)
 
         # Stream embeddings in batches
-        for start in range(0, num_embeddings, batch_size):
-            end = min(start + batch_size, num_embeddings)
-            embeddings_batch = embedding_dataset[start:end]
+        for start, embeddings_batch in iter_batches(embedding_dataset, batch_size):
             index.add(embeddings_batch)
-            print(f"Processed batch {start} to {end}")
+            print(f"Processed batch {start} to {start + len(embeddings_batch)}")
 
         # Save the index
         faiss.write_index(index, index_path)
         print(f"Index saved to {index_path}")
 
-# File paths
-file_path = "embeddings.h5"
-index_path = "hnsw_index.bin"
+def build_index_shard(file_path, shard_path, start, end, batch_size, template_path, num_threads):
+    """
+    Build one index shard over embedding rows [start, end), checkpointing to
+    shard_path after every batch.
+
+    A new shard starts from the empty (trained) index in template_path. If
+    shard_path already exists, the build resumes after the rows it holds.
+
+    Returns:
+    - Number of vectors in the finished shard.
+    """
+    faiss.omp_set_num_threads(num_threads)
+    with open_embeddings(file_path) as embedding_dataset:
+        if os.path.exists(shard_path):
+            index = faiss.read_index(shard_path)
+            print(f"Resuming {shard_path} at row {start + index.ntotal}")
+        else:
+            index = faiss.read_index(template_path)
+
+        for batch_start, embeddings_batch in iter_batches(embedding_dataset, batch_size, start + index.ntotal, end):
+            batch_end = batch_start + len(embeddings_batch)
+            index.add(embeddings_batch)
+            # Write then rename, so a crash never leaves a torn checkpoint
+            faiss.write_index(index, shard_path + ".tmp")
+            os.replace(shard_path + ".tmp", shard_path)
+            print(f"{shard_path}: checkpointed rows {start} to {batch_end}")
+    return index.ntotal
+
+def create_hnsw_index_sharded(file_path, output_dir, num_shards, batch_size=200000, ef_construction=200, M=8,
+                              num_workers=None, index_type="hnsw_flat", nlist=16384, pq_m=48, train_size=200000):
+    """
+    Build N HNSW shards in parallel worker processes, each over a contiguous
+    range of embedding rows, and write a shard manifest for the backend.
+
+    Every shard checkpoints after each batch; re-running with the same
+    arguments resumes an interrupted build.
+
+    Parameters:
+    - file_path: Path to a shard manifest or HDF5 embedding file.
+    - output_dir: Directory for the index shards and shards.json.
+    - num_shards: Number of index shards.
+    - batch_size: Number of embeddings added between checkpoints.
+    - ef_construction: HNSW construction parameter for accuracy.
+    - M: HNSW graph connectivity.
+    - num_workers: Parallel worker processes (default: num_shards).
+    - index_type: One of INDEX_TYPES; compressed types are trained once and
+      every shard shares the same quantizer.
+    - nlist, pq_m: IVF-PQ parameters (ivf_pq only).
+    - train_size: Number of embeddings sampled to train compressed index types.
+
+    Returns:
+    - The shard manifest as a dict.
+    """
+    num_workers = num_workers or num_shards
+    os.makedirs(output_dir, exist_ok=True)
+    with open_embeddings(file_path) as embedding_dataset:
+        num_embeddings, embedding_dim = embedding_dataset.shape
+
+    bounds = np.linspace(0, num_embeddings, num_shards + 1).astype(np.int64)
+    manifest = {
+        "metric": "inner_product",
+        "dim": int(embedding_dim),
+        "ntotal": int(num_embeddings),
+        "source": file_path,
+        "params": {"index_type": index_type, "M": M, "ef_construction": ef_construction, "nlist": nlist, "pq_m": pq_m},
+        "complete": False,
+        "shards": [
+            {"path": f"shard-{i:05d}.bin", "offset": int(bounds[i]), "count": int(bounds[i + 1] - bounds[i])}
+            for i in range(num_shards)
+        ],
+    }
+
+    # A resumed build must use the same shard layout as the checkpoints on disk
+    manifest_path = os.path.join(output_dir, SHARD_MANIFEST_FILE)
+    if os.path.exists(manifest_path):
+        with open(manifest_path) as f:
+            previous = json.load(f)
+        if previous["shards"] != manifest["shards"] or previous["params"] != manifest["params"]:
+            raise ValueError(f"{manifest_path} was written for a different shard layout; use a new output_dir")
+    with open(manifest_path, "w") as f:
+        json.dump(manifest, f, indent=2)
+
+    # Train once; every shard starts from a copy of the same empty index
+    template_path = os.path.join(output_dir, "template.bin")
+    if not os.path.exists(template_path):
+        index = new_index(embedding_dim, index_type, ef_construction, M, nlist, pq_m)
+        with open_embeddings(file_path) as embedding_dataset:
+            train_index(index, embedding_dataset, train_size)
+        faiss.write_index(index, template_path + ".tmp")
+        os.replace(template_path + ".tmp", template_path)
+
+    print(f"Building {num_shards} {index_type} shards over {num_embeddings} embeddings with {num_workers} workers...")
+    num_threads = max(1, (os.cpu_count() or 1) // num_workers)
+    with ProcessPoolExecutor(max_workers=num_workers) as executor:
+        futures = [
+            executor.submit(
+                build_index_shard, file_path, os.path.join(output_dir, shard["path"]),
+                shard["offset"], shard["offset"] + shard["count"],
+                batch_size, template_path, num_threads,
+            )
+            for shard in manifest["shards"]
+        ]
+        for shard, future in zip(manifest["shards"], futures):
+            built = future.result()
+            if built != shard["count"]:
+                raise RuntimeError(f"{shard['path']} holds {built} vectors, expected {shard['count']}")
+
+    manifest["complete"] = True
+    with open(manifest_path, "w") as f:
+        json.dump(manifest, f, indent=2)
+    print(f"Shard manifest saved to {manifest_path}")
+    return manifest
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build the HNSW index from streamed embeddings.")
+    # File paths
+    parser.add_argument("--embeddings", default="collection_shards/manifest.json",
+                        help="Shard manifest (synced from s3://msmarcobucket/embeddings/collection_shards) or HDF5 file")
+    parser.add_argument("--output", default="hnsw_index.bin",
+                        help="Index file, or output directory when --shards is set")
+    parser.add_argument("--shards", type=int, default=0,
+                        help="Build this many shards in parallel with checkpoints (0 builds a single index)")
+    parser.add_argument("--workers", type=int, default=None, help="Parallel worker processes for a sharded build")
+    parser.add_argument("--batch-size", type=int, default=200000)
+    parser.add_argument("--ef-construction", type=int, default=200)
+    parser.add_argument("--M", type=int, default=8)
+    parser.add_argument("--index-type", choices=INDEX_TYPES, default="hnsw_flat")
+    parser.add_argument("--nlist", type=int, default=16384, help="Inverted lists for ivf_pq")
+    parser.add_argument("--pq-m", type=int, default=48, help="PQ bytes per vector for ivf_pq")
+    parser.add_argument("--train-size", type=int, default=200000, help="Training sample for compressed index types")
+    args = parser.parse_args()
 
-# Create HNSW index
-create_hnsw_index_streaming(file_path, index_path)
+    if args.shards:
+        create_hnsw_index_sharded(args.embeddings, args.output, args.shards, args.batch_size,
+                                  args.ef_construction, args.M, args.workers,
+                                  args.index_type, args.nlist, args.pq_m, args.train_size)
+    else:
+        # Create HNSW index
+        create_hnsw_index_streaming(args.embeddings, args.output, args.batch_size, args.ef_construction, args.M,
+                                    args.index_type, args.nlist, args.pq_m, args.train_size)
@@ -0,0 +1,21 @@
+import numpy as np
+
+# On-disk layout of a disk index directory, written by create_disk_index.py
+# and read by backend/disk_index.py
+META_FILE = "disk_index.json"
+GRAPH_FILE = "graph.bin"
+PQ_CODES_FILE = "pq_codes.npy"
+PQ_CENTROIDS_FILE = "pq_centroids.npy"
+FORMAT_VERSION = 1
+
+
+def node_record_dtype(max_degree, embedding_dim):
+    """
+    Fixed-size on-disk node record: neighbor count, neighbor ids (-1 padded)
+    and the full float32 vector.
+    """
+    return np.dtype([
+        ("degree", "<u4"),
+        ("neighbors", "<i4", (max_degree,)),
+        ("vector", "<f4", (embedding_dim,)),
+    ])
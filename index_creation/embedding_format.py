@@ -0,0 +1,275 @@
+import argparse
+
+import h5py
+import numpy as np
+
+from embedding_shards import ShardedEmbeddings
+
+# Versioned HDF5 embedding file:
+#   attrs:     format, version, storage ("float32" | "float16" | "int8"),
+#              count, dim, chunk_rows
+#   embedding: (count, dim) stored vectors, uncompressed, chunked by
+#              (chunk_rows, dim) so every chunk is a contiguous run of rows
+#   scale:     (count,) float32 per-row scales (int8 only); row i is
+#              embedding[i] * scale[i]
+#   ids:       (count,) fixed-width byte strings, row-aligned with embedding
+FORMAT_NAME = "msmarco-embeddings"
+FORMAT_VERSION = 1
+STORAGE_DTYPES = ("float32", "float16", "int8")
+DEFAULT_CHUNK_ROWS = 4096
+
+
+def quantize(embeddings, storage):
+    """
+    Convert float32 embeddings to the storage dtype.
+
+    int8 uses symmetric per-row scaling: each row is divided by max(|x|) / 127
+    and rounded.
+
+    Returns:
+    - (stored, scale): scale is None unless storage is int8.
+    """
+    embeddings = np.asarray(embeddings, dtype=np.float32)
+    if storage != "int8":
+        return embeddings.astype(storage), None
+    scale = np.abs(embeddings).max(axis=1) / 127.0
+    scale[scale == 0] = 1.0
+    stored = np.rint(embeddings / scale[:, None]).astype(np.int8)
+    return stored, scale.astype(np.float32)
+
+
+def dequantize(stored, scale=None):
+    """
+    Return stored vectors as float32 (a view, not a copy, for float32 storage).
+    """
+    if scale is not None:
+        return stored.astype(np.float32) * scale[:, None]
+    return stored if stored.dtype == np.float32 else stored.astype(np.float32)
+
+
+def is_embedding_file(h5_file):
+    return h5_file.attrs.get("format") == FORMAT_NAME
+
+
+def map_chunked_dataset(path, dataset):
+    """
+    Memory-map an uncompressed chunked dataset whose chunks were written in
+    row order and sit back to back in the file, or return None if they do not.
+    """
+    if dataset.compression is not None or dataset.chunks is None:
+        return None
+    chunk_rows = dataset.chunks[0]
+    if dataset.chunks[1:] != dataset.shape[1:] or dataset.id.get_num_chunks() != -(-dataset.shape[0] // chunk_rows):
+        return None
+    chunk_bytes = chunk_rows * int(np.prod(dataset.shape[1:], dtype=np.int64)) * dataset.dtype.itemsize
+    infos = sorted((dataset.id.get_chunk_info(i) for i in range(dataset.id.get_num_chunks())),
+                   key=lambda info: info.chunk_offset)
+    first = infos[0].byte_offset
+    if any(info.byte_offset != first + i * chunk_bytes or info.filter_mask for i, info in enumerate(infos)):
+        return None
+    # HDF5 stores the last chunk at full size, so the chunks map as one padded array
+    padded_rows = len(infos) * chunk_rows
+    mapped = np.memmap(path, dtype=dataset.dtype, mode="r", offset=first, shape=(padded_rows,) + dataset.shape[1:])
+    return mapped[:dataset.shape[0]]
+
+
+def map_dataset(path, dataset):
+    """
+    Memory-map a contiguous or row-ordered chunked dataset, or return None.
+    """
+    offset = dataset.id.get_offset()
+    if dataset.chunks is None and offset is not None:
+        # Contiguous, uncompressed dataset: map its bytes directly
+        return np.memmap(path, dtype=dataset.dtype, mode="r", offset=offset, shape=dataset.shape)
+    return map_chunked_dataset(path, dataset)
+
+
+class EmbeddingFileWriter:
+    """
+    Write an embedding file sequentially, chunk-aligned batches at a time.
+
+    Parameters:
+    - path: Output HDF5 path.
+    - count: Total number of rows that will be appended.
+    - dim: Embedding dimension.
+    - storage: One of STORAGE_DTYPES.
+    - id_width: Bytes reserved per passage id; longer ids are rejected.
+    - chunk_rows: Rows per HDF5 chunk.
+    """
+
+    def __init__(self, path, count, dim, storage="float16", id_width=32, chunk_rows=DEFAULT_CHUNK_ROWS):
+        if storage not in STORAGE_DTYPES:
+            raise ValueError(f"Unknown storage dtype {storage!r}; expected one of {STORAGE_DTYPES}")
+        chunk_rows = max(1, min(chunk_rows, count))
+        self.count = count
+        self.storage = storage
+        self.id_width = id_width
+        self.written = 0
+        self.file = h5py.File(path, "w")
+        self.file.attrs.update({
+            "format": FORMAT_NAME, "version": FORMAT_VERSION, "storage": storage,
+            "count": count, "dim": dim, "chunk_rows": chunk_rows,
+        })
+        self.embedding = self.file.create_dataset("embedding", (count, dim), dtype=storage, chunks=(chunk_rows, dim))
+        self.scale = self.file.create_dataset("scale", (count,), dtype="f4") if storage == "int8" else None
+        self.ids = self.file.create_dataset("ids", (count,), dtype=f"S{id_width}")
+
+    def append(self, ids, embeddings):
+        """
+        Append a batch of passage ids and their (n, dim) float32 embeddings.
+        """
+        start, end = self.written, self.written + len(embeddings)
+        if end > self.count:
+            raise ValueError(f"Appending rows {start}:{end} to a file sized for {self.count} rows")
+        encoded_ids = np.array([str(i).encode("utf-8") for i in ids], dtype=object)
+        if any(len(i) > self.id_width for i in encoded_ids):
+            raise ValueError(f"Passage id longer than {self.id_width} bytes")
+        stored, scale = quantize(embeddings, self.storage)
+        self.embedding[start:end] = stored
+        if self.scale is not None:
+            self.scale[start:end] = scale
+        self.ids[start:end] = encoded_ids.astype(f"S{self.id_width}")
+        self.written = end
+
+    def close(self):
+        if self.written != self.count:
+            self.file.close()
+            raise ValueError(f"Wrote {self.written} of {self.count} rows")
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.file.close()
+
+
+class EmbeddingFile:
+    """
+    Read-only (count, dim) float32 view over an embedding file.
+
+    The stored vectors are memory-mapped directly from the file when the
+    chunks are laid out in row order, so float32 slices are views into the
+    page cache and float16/int8 slices cost a single conversion; otherwise
+    reads fall back to h5py.
+
+    Parameters:
+    - path: File written by EmbeddingFileWriter, or a legacy HDF5 file with
+      an 'embedding' or 'embeddings' dataset (and optionally 'ids').
+    """
+
+    def __init__(self, path):
+        self.file = h5py.File(path, "r")
+        if is_embedding_file(self.file):
+            if self.file.attrs["version"] > FORMAT_VERSION:
+                raise ValueError(f"{path} has format version {self.file.attrs['version']}; "
+                                 f"this reader supports up to {FORMAT_VERSION}")
+            self.storage = self.file.attrs["storage"]
+            self.chunk_rows = int(self.file.attrs["chunk_rows"])
+            dataset = self.file["embedding"]
+            self._scale = self.file["scale"][:] if "scale" in self.file else None
+        elif "embedding" in self.file or "embeddings" in self.file:
+            dataset = self.file["embedding"] if "embedding" in self.file else self.file["embeddings"]
+            self.storage = dataset.dtype.name
+            self.chunk_rows = dataset.chunks[0] if dataset.chunks else 1
+            self._scale = None
+        else:
+            self.file.close()
+            raise ValueError(f"{path} is not a {FORMAT_NAME} file and has no 'embedding' dataset")
+        self.shape = dataset.shape
+        self.dtype = np.dtype(np.float32)
+        mapped = map_dataset(path, dataset)
+        self._stored = dataset if mapped is None else mapped
+        self._ids = self.file["ids"] if "ids" in self.file else None
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __getitem__(self, key):
+        if not isinstance(key, slice) or key.step not in (None, 1):
+            raise TypeError("EmbeddingFile only supports contiguous slices")
+        start, stop, _ = key.indices(self.shape[0])
+        stop = max(start, stop)
+        scale = None if self._scale is None else self._scale[start:stop]
+        return dequantize(self._stored[start:stop], scale)
+
+    def take(self, rows):
+        """
+        Return the float32 vectors of the given rows, in the given order.
+        """
+        rows = np.asarray(rows, dtype=np.int64)
+        order = np.argsort(rows)
+        out = np.empty((len(rows), self.shape[1]), dtype=np.float32)
+        sorted_rows = rows[order]
+        scale = None if self._scale is None else self._scale[sorted_rows]
+        out[order] = dequantize(self._stored[sorted_rows], scale)
+        return out
+
+    def ids(self, start=0, stop=None):
+        """
+        Return the passage ids of rows [start, stop) as fixed-width byte
+        strings (row numbers for legacy files without ids).
+        """
+        if self._ids is None:
+            stop = self.shape[0] if stop is None else stop
+            return np.arange(start, stop).astype("S")
+        return self._ids[start:stop]
+
+    def close(self):
+        self.file.close()
+
+
+def convert(source_path, output_path, storage="float16", chunk_rows=DEFAULT_CHUNK_ROWS, batch_size=262144):
+    """
+    Convert embeddings to the versioned format.
+
+    Parameters:
+    - source_path: Shard manifest (.json) written by spark_embeddings.py, or a
+      legacy HDF5 file with an 'embedding' or 'embeddings' dataset and an
+      optional 'ids' dataset (row numbers are used as ids without one).
+    - output_path: Output HDF5 path.
+    - storage: One of STORAGE_DTYPES.
+    """
+    if source_path.endswith(".json"):
+        source = ShardedEmbeddings(source_path)
+        all_ids = np.concatenate([source.ids(shard) for shard in range(len(source.shards))])
+        id_width = all_ids.dtype.itemsize
+        ids_of = lambda start, end: all_ids[start:end]
+        legacy = None
+    else:
+        legacy = h5py.File(source_path, "r")
+        source = legacy["embedding"] if "embedding" in legacy else legacy["embeddings"]
+        if "ids" in legacy:
+            ids_dataset = legacy["ids"]
+            id_width = max(len(str(i).encode("utf-8")) for i in ids_dataset.asstr()[:]) if len(ids_dataset) else 1
+            ids_of = lambda start, end: ids_dataset.asstr()[start:end]
+        else:
+            id_width = len(str(source.shape[0]))
+            ids_of = lambda start, end: np.arange(start, end)
+
+    count, dim = source.shape
+    try:
+        with EmbeddingFileWriter(output_path, count, dim, storage, id_width, chunk_rows) as writer:
+            # Whole chunks per write, so each chunk is allocated once and in order
+            batch_size = max(chunk_rows, batch_size - batch_size % chunk_rows)
+            for start in range(0, count, batch_size):
+                end = min(start + batch_size, count)
+                ids = [i.decode("utf-8") if isinstance(i, bytes) else i for i in ids_of(start, end)]
+                writer.append(ids, source[start:end])
+                print(f"Converted rows {start} to {end}")
+    finally:
+        if legacy is not None:
+            legacy.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Convert embeddings to the versioned HDF5 format.")
+    parser.add_argument("source", help="Shard manifest.json or legacy HDF5 file")
+    parser.add_argument("output", help="Output .h5 path")
+    parser.add_argument("--storage", choices=STORAGE_DTYPES, default="float16")
+    parser.add_argument("--chunk-rows", type=int, default=DEFAULT_CHUNK_ROWS)
+    args = parser.parse_args()
+    convert(args.source, args.output, args.storage, args.chunk_rows)
@@ -0,0 +1,242 @@
+import json
+import os
+import shutil
+import tempfile
+from contextlib import contextmanager
+
+import fsspec
+import numpy as np
+from fsspec.implementations.local import LocalFileSystem
+
+MANIFEST_FILE = "manifest.json"
+
+
+def open_output(url, mode="wb"):
+    """
+    Open a local path or fsspec URL for writing, creating local parent directories.
+    """
+    fs, path = fsspec.core.url_to_fs(url)
+    if isinstance(fs, LocalFileSystem):
+        fs.makedirs(os.path.dirname(path), exist_ok=True)
+    return fs.open(path, mode)
+
+
+def shard_file_names(shard_id):
+    """
+    Return the (embeddings, ids) file names used for a shard.
+    """
+    return f"part-{shard_id:05d}.npy", f"part-{shard_id:05d}.ids.npy"
+
+
+class ShardWriter:
+    """
+    Stream the embeddings of one Spark partition into a float32 .npy shard
+    plus a fixed-width id sidecar.
+
+    Chunks are spooled to a local temporary file as they arrive, so only one
+    chunk is held in memory at a time; the .npy header is written once the
+    final row count is known and the shard is copied to output_dir, which may
+    be any fsspec URL (local path, s3://...).
+
+    Parameters:
+    - output_dir: Directory or URL the shard files are written to.
+    - shard_id: Index of the partition; fixes the shard's place in the manifest.
+    """
+
+    def __init__(self, output_dir, shard_id):
+        self.output_dir = output_dir
+        self.shard_id = shard_id
+        self.count = 0
+        self.dim = None
+        self.ids = []
+        self._spool = tempfile.TemporaryFile()
+
+    def append(self, ids, embeddings):
+        """
+        Append a chunk of ids and their (n, dim) embeddings.
+        """
+        embeddings = np.ascontiguousarray(embeddings, dtype="<f4")
+        if self.dim is None:
+            self.dim = embeddings.shape[1]
+        self._spool.write(embeddings.tobytes())
+        self.ids.extend(ids)
+        self.count += len(embeddings)
+
+    def close(self):
+        """
+        Write the shard files and return its manifest entry, or None if the
+        partition was empty.
+        """
+        if self.count == 0:
+            self._spool.close()
+            return None
+
+        embeddings_name, ids_name = shard_file_names(self.shard_id)
+        header = {
+            "descr": np.lib.format.dtype_to_descr(np.dtype("<f4")),
+            "fortran_order": False,
+            "shape": (self.count, self.dim),
+        }
+        self._spool.seek(0)
+        with open_output(f"{self.output_dir}/{embeddings_name}") as f:
+            np.lib.format.write_array_header_1_0(f, header)
+            shutil.copyfileobj(self._spool, f, length=16 * 1024 * 1024)
+        self._spool.close()
+
+        ids = [str(i).encode("utf-8") for i in self.ids]
+        width = max(len(i) for i in ids)
+        with open_output(f"{self.output_dir}/{ids_name}") as f:
+            np.save(f, np.array(ids, dtype=f"S{width}"))
+
+        return {
+            "shard": self.shard_id,
+            "embeddings": embeddings_name,
+            "ids": ids_name,
+            "count": self.count,
+            "dim": self.dim,
+        }
+
+
+def write_manifest(output_dir, entries):
+    """
+    Write the manifest describing how shards concatenate into global rows.
+
+    Shards are ordered by partition index, which for a single input file is
+    the order of the lines in collection.tsv, so global row i is line i of the
+    collection (the same order as the passage store).
+
+    Parameters:
+    - output_dir: Directory or URL holding the shards.
+    - entries: Manifest entries returned by ShardWriter.close (None entries are skipped).
+
+    Returns:
+    - The manifest as a dict.
+    """
+    shards = sorted((e for e in entries if e is not None), key=lambda e: e["shard"])
+    offset = 0
+    for entry in shards:
+        entry["offset"] = offset
+        offset += entry["count"]
+    manifest = {
+        "dtype": "float32",
+        "dim": shards[0]["dim"] if shards else 0,
+        "count": offset,
+        "shards": shards,
+    }
+    with open_output(f"{output_dir}/{MANIFEST_FILE}", "w") as f:
+        json.dump(manifest, f, indent=2)
+    return manifest
+
+
+class ShardedEmbeddings:
+    """
+    Read-only (num_rows, dim) view over the shards listed in a manifest.
+
+    Shards are memory-mapped, so slicing streams rows from disk without
+    loading whole shards. Shards written to S3 must be synced locally first
+    (e.g. aws s3 sync).
+
+    Parameters:
+    - manifest_path: Path to manifest.json; shard paths are resolved relative to it.
+    """
+
+    def __init__(self, manifest_path):
+        with open(manifest_path) as f:
+            self.manifest = json.load(f)
+        base_dir = os.path.dirname(manifest_path)
+        self.shards = self.manifest["shards"]
+        self._arrays = [
+            np.load(os.path.join(base_dir, s["embeddings"]), mmap_mode="r") for s in self.shards
+        ]
+        self._id_paths = [os.path.join(base_dir, s["ids"]) for s in self.shards]
+        self._offsets = np.array([s["offset"] for s in self.shards] + [self.manifest["count"]])
+        self.shape = (self.manifest["count"], self.manifest["dim"])
+        self.dtype = np.dtype(self.manifest["dtype"])
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __getitem__(self, key):
+        if not isinstance(key, slice) or key.step not in (None, 1):
+            raise TypeError("ShardedEmbeddings only supports contiguous slices")
+        start, stop, _ = key.indices(self.shape[0])
+        if stop <= start:
+            return np.empty((0, self.shape[1]), dtype=self.dtype)
+
+        parts = []
+        shard = int(np.searchsorted(self._offsets, start, side="right")) - 1
+        while start < stop:
+            shard_start = self._offsets[shard]
+            shard_stop = self._offsets[shard + 1]
+            end = min(stop, shard_stop)
+            parts.append(self._arrays[shard][start - shard_start:end - shard_start])
+            start = end
+            shard += 1
+        return parts[0] if len(parts) == 1 else np.concatenate(parts)
+
+    def take(self, rows):
+        """
+        Return the float32 vectors of the given rows, in the given order.
+        """
+        rows = np.asarray(rows, dtype=np.int64)
+        out = np.empty((len(rows), self.shape[1]), dtype=np.float32)
+        shard_of_row = np.searchsorted(self._offsets, rows, side="right") - 1
+        for shard in np.unique(shard_of_row):
+            positions = np.nonzero(shard_of_row == shard)[0]
+            out[positions] = self._arrays[shard][rows[positions] - self._offsets[shard]]
+        return out
+
+    def ids(self, shard):
+        """
+        Return the passage ids of a shard as a memory-mapped byte string array.
+        """
+        return np.load(self._id_paths[shard], mmap_mode="r")
+
+
+def iter_batches(embedding_dataset, batch_size, start=0, stop=None):
+    """
+    Yield (batch_start, float32 batch) over rows [start, stop) of any
+    sliceable embedding dataset.
+
+    When the dataset has chunk_rows (an EmbeddingFile), batch ends are rounded
+    to chunk boundaries so no chunk is read twice.
+    """
+    stop = len(embedding_dataset) if stop is None else stop
+    chunk_rows = getattr(embedding_dataset, "chunk_rows", 1)
+    batch_start = start
+    while batch_start < stop:
+        batch_end = batch_start + max(batch_size, chunk_rows)
+        batch_end = min(stop, batch_end - batch_end % chunk_rows)
+        yield batch_start, np.ascontiguousarray(embedding_dataset[batch_start:batch_end], dtype=np.float32)
+        batch_start = batch_end
+
+
+@contextmanager
+def open_embeddings(path):
+    """
+    Open an embedding source for streaming.
+
+    Parameters:
+    - path: A shard manifest (.json) written by spark_embeddings.py, a
+      versioned embedding file written by embedding_format.py, or a legacy
+      HDF5 file with an 'embedding' (or 'embeddings') dataset.
+
+    Yields:
+    - Array-like object with .shape that supports contiguous row slicing.
+    """
+    if path.endswith(".json"):
+        yield ShardedEmbeddings(path)
+        return
+
+    import h5py
+    from embedding_format import EmbeddingFile, is_embedding_file
+    with h5py.File(path, "r") as f:
+        versioned = is_embedding_file(f)
+        if not versioned:
+            yield f["embedding"] if "embedding" in f else f["embeddings"]
+            return
+    embedding_file = EmbeddingFile(path)
+    try:
+        yield embedding_file
+    finally:
+        embedding_file.close()
@@ -0,0 +1,65 @@
+from itertools import islice
+
+import numpy as np
+import torch
+from sentence_transformers import SentenceTransformer
+
+# Models loaded in this Python worker. Spark reuses Python workers across
+# tasks, so a model loaded for one partition serves every later partition
+# handled by the same worker.
+_models = {}
+
+
+def get_model(model_name, num_threads=0):
+    """
+    Return the SentenceTransformer for model_name, loading it at most once per process.
+
+    Parameters:
+    - model_name: Name or path of the SentenceTransformer model.
+    - num_threads: Intra-op threads for torch; 0 keeps torch's default.
+    """
+    model = _models.get(model_name)
+    if model is None:
+        if num_threads:
+            torch.set_num_threads(num_threads)
+        model = SentenceTransformer(model_name)
+        _models[model_name] = model
+    return model
+
+
+def iter_chunks(iterable, chunk_size):
+    """
+    Yield lists of at most chunk_size items from an iterable.
+    """
+    iterator = iter(iterable)
+    while True:
+        chunk = list(islice(iterator, chunk_size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def encode_records(records, model, chunk_size=8192, batch_size=128):
+    """
+    Encode (id, text) records in fixed-size chunks.
+
+    Only one chunk is held in memory at a time. SentenceTransformer.encode
+    sorts each chunk by text length before batching, so batches pad to
+    similar lengths, and returns embeddings in the original order.
+
+    Parameters:
+    - records: Iterable of (id, text) records.
+    - model: Loaded SentenceTransformer model.
+    - chunk_size: Number of records pulled from the iterator per chunk.
+    - batch_size: Number of texts per forward pass.
+
+    Yields:
+    - (ids, embeddings) per chunk, with embeddings a packed (n, dim) float32 array.
+    """
+    for chunk in iter_chunks(records, chunk_size):
+        ids = [r[0] for r in chunk]
+        texts = [r[1] or "" for r in chunk]
+        embeddings = model.encode(
+            texts, batch_size=batch_size, convert_to_numpy=True, show_progress_bar=False
+        )
+        yield ids, np.ascontiguousarray(embeddings, dtype=np.float32)
@@ -1,16 +1,22 @@
+import os
+
 from pyspark.sql import SparkSession
-from sentence_transformers import SentenceTransformer
-import numpy as np
-import h5py
-import s3fs
-import io
+
+from embedding_shards import ShardWriter, write_manifest
+from partition_encoder import encode_records, get_model
 
 # Initialize Spark
 spark = SparkSession.builder.appName("MSMARCO_Embeddings").getOrCreate()
+# Ship the shard writer and encoder to the executors
+module_dir = os.path.dirname(os.path.abspath(__file__))
+spark.sparkContext.addPyFile(os.path.join(module_dir, "embedding_shards.py"))
+spark.sparkContext.addPyFile(os.path.join(module_dir, "partition_encoder.py"))
 
 # S3 Paths
 s3_input_path = "s3a://msmarcobucket/collection.tsv"
-s3_output_path = "s3://msmarcobucket/embeddings/collection_embeddings.hdf5"
+# Each partition writes part-NNNNN.npy (float32) + part-NNNNN.ids.npy here,
+# and the driver writes manifest.json describing the row order
+s3_output_dir = "s3://msmarcobucket/embeddings/collection_shards"
 
 # read the MS MARCO collection from S3
 # collection.tsv is typically: id \t text
@@ -19,48 +25,31 @@ df = spark.read.csv(s3_input_path, sep="\t", header=False).toDF("id", "text")
 # Broadcast model name so that all executors know what to load
 model_name = "msmarco-MiniLM-L6-cos-v5"
 bc_model_name = spark.sparkContext.broadcast(model_name)
-
-def embed_partitions(iter_records):
-    # Load the model once per partition
-    model = SentenceTransformer(bc_model_name.value)
-    
-    # Collect texts
-    records = list(iter_records)
-    if len(records) == 0:
-        return []
-    
-    ids = [r[0] for r in records]
-    texts = [r[1] for r in records]
-    
-    # Encode all texts in the partition
-    embeddings = model.encode(texts, show_progress_bar=False)
-    
-    # Return (id, embedding) pairs
-    # Convert embedding to a list so it can be serialized easily
-    return zip(ids, embeddings.tolist())
-
-# Apply the mapPartitions function
-id_embeddings_rdd = df.rdd.mapPartitions(embed_partitions)
-
-all_data = id_embeddings_rdd.collect()
-
-# all_data is now a list of (id, embedding) pairs on the driver.
-all_data.sort(key=lambda x: x[0])
-
-ids = [x[0] for x in all_data]
-embeddings = np.array([x[1] for x in all_data], dtype='float32')
-
-# Write to HDF5 on S3
-# use s3fs + h5py to write directly to S3
-fs = s3fs.S3FileSystem()
-
-# Open an S3 file for writing
-with fs.open(s3_output_path, 'wb') as f:
-    with h5py.File(f, 'w') as hf:
-        # Create a dataset for ids and embeddings
-        # Store ids as strings (variable length)
-        dt = h5py.special_dtype(vlen=str)
-        hf.create_dataset('ids', data=np.array(ids, dtype=object), dtype=dt)
-        hf.create_dataset('embeddings', data=embeddings)
+bc_output_dir = spark.sparkContext.broadcast(s3_output_dir)
+
+# Encoding knobs: records pulled from the partition per chunk, texts per
+# forward pass, and torch intra-op threads per executor Python worker
+# (0 keeps torch's default; set it to cores / concurrent tasks per executor)
+chunk_size = 8192
+encode_batch_size = 128
+encode_threads = int(os.environ.get("EMBED_THREADS", "0"))
+
+def embed_partitions(partition_id, iter_records):
+    # The model is loaded once per executor Python worker and reused across partitions
+    model = get_model(bc_model_name.value, encode_threads)
+
+    # Encode the partition chunk by chunk and write each chunk straight from
+    # the executor, so memory stays flat regardless of partition size; only
+    # the shard's small manifest entry is returned to the driver
+    writer = ShardWriter(bc_output_dir.value, partition_id)
+    for ids, embeddings in encode_records(iter_records, model, chunk_size, encode_batch_size):
+        writer.append(ids, embeddings)
+    return [writer.close()]
+
+# Apply the mapPartitions function; only manifest entries reach the driver
+shard_entries = df.rdd.mapPartitionsWithIndex(embed_partitions).collect()
+
+manifest = write_manifest(s3_output_dir, shard_entries)
+print(f"Wrote {manifest['count']} embeddings in {len(manifest['shards'])} shards to {s3_output_dir}")
 
 spark.stop()
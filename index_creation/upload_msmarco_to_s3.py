@@ -1,44 +1,241 @@
-import boto3
-import ir_datasets
+import argparse
+import gzip
 import json
+import os
+import tempfile
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 from io import BytesIO
+from itertools import islice
+
+import boto3
+from boto3.s3.transfer import TransferConfig
+from botocore.config import Config
 
 # AWS S3 configuration
 BUCKET_NAME = "msmarcobucket"  #  S3 bucket name
 S3_PREFIX = "msmarco-passages/"  # Folder name in the bucket
+SHARD_PREFIX = "msmarco-passage-shards/"  # Folder for packed shards and their manifest
 
-# Initialize the S3 client
-s3 = boto3.client("s3")
+# Packed upload knobs
+SHARD_SIZE = 100000  # passages per shard (~15-20 MB of gzipped JSONL)
+MAX_IN_FLIGHT = 8  # concurrent shard uploads
+UPLOAD_RETRIES = 5
+CHECKPOINT_FILE = "upload_checkpoint.json"
 
-# Load the MS MARCO Passage v2 dataset
-dataset = ir_datasets.load("msmarco-passage-v2")
+def s3_client():
+    """
+    Create the S3 client. Set S3_ENDPOINT_URL to point it at a local stand-in
+    such as MinIO or a moto server.
+    """
+    config = Config(retries={"max_attempts": 10, "mode": "adaptive"}, max_pool_connections=64)
+    return boto3.client("s3", endpoint_url=os.environ.get("S3_ENDPOINT_URL"), config=config)
 
-def upload_passage_to_s3(doc):
+def passage_record(doc):
     """
-    Upload a single document (passage) to S3 as a JSON file.
+    JSON-serializable record of a passage.
     :param doc: The namedtuple containing doc_id and text.
     """
-    # Prepare the JSON content
-    content = {
+    return {
         "doc_id": doc.doc_id,
         "text": doc.text,
         "spans": doc.spans,
         "msmarco_document_id": doc.msmarco_document_id
     }
-    
+
+def upload_passage_to_s3(s3, doc):
+    """
+    Upload a single document (passage) to S3 as a JSON file.
+    :param doc: The namedtuple containing doc_id and text.
+    """
     # Convert JSON to string and then to bytes
-    json_content = json.dumps(content)
+    json_content = json.dumps(passage_record(doc))
     file_obj = BytesIO(json_content.encode("utf-8"))
-    
+
     # Define the S3 object key (file name)
     s3_key = f"{S3_PREFIX}{doc.doc_id}.json"
-    
+
     # Upload to S3
     s3.upload_fileobj(file_obj, BUCKET_NAME, s3_key)
     print(f"Uploaded {doc.doc_id} to s3://{BUCKET_NAME}/{s3_key}")
 
-# Stream and upload documents to S3
-for doc in dataset.docs_iter():
-    upload_passage_to_s3(doc)
+def shard_key(prefix, shard_id, shard_format):
+    extension = "jsonl.gz" if shard_format == "jsonl" else "parquet"
+    return f"{prefix}part-{shard_id:05d}.{extension}"
+
+def write_shard(docs, path, shard_format):
+    """
+    Write passages to a local shard file.
+    :param docs: List of passage namedtuples.
+    :param shard_format: "jsonl" (gzip-compressed JSON lines) or "parquet".
+    """
+    records = [passage_record(doc) for doc in docs]
+    if shard_format == "parquet":
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        pq.write_table(pa.Table.from_pylist(records), path, compression="zstd")
+        return
+    with gzip.open(path, "wt", encoding="utf-8", compresslevel=6) as f:
+        for record in records:
+            f.write(json.dumps(record) + "\n")
+
+def upload_with_retries(s3, path, key, transfer_config, retries=UPLOAD_RETRIES):
+    """
+    Upload a file (multipart above the transfer threshold), retrying the whole
+    upload with exponential backoff when it fails.
+    """
+    for attempt in range(retries):
+        try:
+            s3.upload_file(path, BUCKET_NAME, key, Config=transfer_config)
+            return
+        except Exception as e:
+            if attempt == retries - 1:
+                raise
+            delay = 2 ** attempt
+            print(f"Upload of {key} failed ({e!r}); retrying in {delay}s")
+            time.sleep(delay)
+
+def upload_shard(s3, path, entry, transfer_config):
+    """
+    Upload a packed shard, delete the local file and return its manifest
+    entry with the shard's size filled in.
+    """
+    try:
+        size = os.path.getsize(path)
+        upload_with_retries(s3, path, entry["key"], transfer_config)
+    finally:
+        os.remove(path)
+    return dict(entry, bytes=size)
+
+def load_checkpoint(checkpoint_path, params):
+    """
+    Return the manifest entries of shards uploaded by an earlier run, keyed by
+    shard id. A checkpoint written with different parameters is rejected.
+    """
+    if not os.path.exists(checkpoint_path):
+        return {}
+    with open(checkpoint_path) as f:
+        checkpoint = json.load(f)
+    if checkpoint["params"] != params:
+        raise ValueError(f"{checkpoint_path} was written with different parameters: {checkpoint['params']}")
+    return {entry["shard"]: entry for entry in checkpoint["shards"]}
+
+def save_checkpoint(checkpoint_path, params, done):
+    tmp_path = checkpoint_path + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump({"params": params, "shards": [done[s] for s in sorted(done)]}, f)
+    os.replace(tmp_path, checkpoint_path)
+
+def record_uploads(futures, done, checkpoint_path, params):
+    """
+    Wait for finished uploads and checkpoint every one that succeeded; the
+    first failure is raised after the checkpoint is saved.
+    """
+    errors = []
+    for future in futures:
+        try:
+            entry = future.result()
+        except Exception as e:
+            errors.append(e)
+            continue
+        done[entry["shard"]] = entry
+        print(f"Uploaded shard {entry['shard']} ({entry['count']} passages) to s3://{BUCKET_NAME}/{entry['key']}")
+    save_checkpoint(checkpoint_path, params, done)
+    if errors:
+        raise errors[0]
+
+def upload_packed_shards(s3, docs_iter, prefix=SHARD_PREFIX, shard_size=SHARD_SIZE, shard_format="jsonl",
+                         max_in_flight=MAX_IN_FLIGHT, checkpoint_path=CHECKPOINT_FILE):
+    """
+    Pack the passages into compressed shards and upload them concurrently,
+    followed by a manifest.json listing every shard.
+
+    Shard i always holds passages [i * shard_size, (i + 1) * shard_size) of
+    the dataset, so a restarted run skips the shards recorded in the
+    checkpoint file and only packs and uploads the rest.
+
+    :param s3: boto3 S3 client.
+    :param docs_iter: Iterator over the passages, in dataset order.
+    :param max_in_flight: Bound on concurrent shard uploads.
+    :return: The manifest dict.
+    """
+    params = {"bucket": BUCKET_NAME, "prefix": prefix, "shard_size": shard_size, "format": shard_format}
+    done = load_checkpoint(checkpoint_path, params)
+    if done:
+        print(f"Resuming: {len(done)} shards already uploaded")
+    transfer_config = TransferConfig(multipart_threshold=8 * 2**20, multipart_chunksize=8 * 2**20, max_concurrency=4)
+
+    docs_iter = iter(docs_iter)
+    shard_id = 0
+    in_flight = set()
+    with tempfile.TemporaryDirectory() as work_dir, ThreadPoolExecutor(max_workers=max_in_flight) as executor:
+        while True:
+            if shard_id in done:
+                # Skip the passages of an uploaded shard without packing them
+                skipped = sum(1 for _ in islice(docs_iter, shard_size))
+                if skipped == 0:
+                    break
+                shard_id += 1
+                continue
+            docs = list(islice(docs_iter, shard_size))
+            if not docs:
+                break
+            if len(in_flight) >= max_in_flight:
+                finished, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                record_uploads(finished, done, checkpoint_path, params)
+            # Pack here so only one shard of passages is held in memory;
+            # at most max_in_flight packed files wait on disk for upload
+            key = shard_key(prefix, shard_id, shard_format)
+            path = os.path.join(work_dir, os.path.basename(key))
+            write_shard(docs, path, shard_format)
+            entry = {
+                "shard": shard_id,
+                "key": key,
+                "count": len(docs),
+                "first_doc_id": docs[0].doc_id,
+                "last_doc_id": docs[-1].doc_id,
+            }
+            in_flight.add(executor.submit(upload_shard, s3, path, entry, transfer_config))
+            shard_id += 1
+        record_uploads(in_flight, done, checkpoint_path, params)
+
+    offset = 0
+    shards = []
+    for shard in sorted(done):
+        shards.append(dict(done[shard], offset=offset))
+        offset += done[shard]["count"]
+    manifest = dict(params, count=offset, shards=shards)
+    s3.put_object(Bucket=BUCKET_NAME, Key=f"{prefix}manifest.json",
+                  Body=json.dumps(manifest, indent=2).encode("utf-8"))
+    print(f"Wrote manifest for {len(shards)} shards ({offset} passages) to s3://{BUCKET_NAME}/{prefix}manifest.json")
+    return manifest
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Upload the MS MARCO passages to S3.")
+    parser.add_argument("--mode", choices=["packed", "objects"], default="packed",
+                        help="Packed shards with a manifest, or one JSON object per passage")
+    parser.add_argument("--format", choices=["jsonl", "parquet"], default="jsonl")
+    parser.add_argument("--shard-size", type=int, default=SHARD_SIZE)
+    parser.add_argument("--max-in-flight", type=int, default=MAX_IN_FLIGHT)
+    parser.add_argument("--prefix", default=SHARD_PREFIX)
+    parser.add_argument("--checkpoint", default=CHECKPOINT_FILE)
+    args = parser.parse_args()
+
+    # Only needed to read the dataset; tests import this module without it
+    import ir_datasets
+
+    # Initialize the S3 client
+    s3 = s3_client()
+
+    # Load the MS MARCO Passage v2 dataset
+    dataset = ir_datasets.load("msmarco-passage-v2")
+
+    if args.mode == "packed":
+        upload_packed_shards(s3, dataset.docs_iter(), args.prefix, args.shard_size, args.format,
+                             args.max_in_flight, args.checkpoint)
+    else:
+        # Stream and upload documents to S3
+        for doc in dataset.docs_iter():
+            upload_passage_to_s3(s3, doc)
 
-print("All passages uploaded successfully.")
+    print("All passages uploaded successfully.")
@@ -1,17 +1,242 @@
 import json
 import os
+import threading
+import time
+
 import requests
+from requests.adapters import HTTPAdapter
 
 #  public DNS or IP of the EC2 instance where the Flask server is running
-EC2_ENDPOINT = "http://ec2-endpoint:5000/search"
+EC2_ENDPOINT = os.environ.get("EC2_ENDPOINT", "http://ec2-endpoint:5000/search")
+EC2_BATCH_ENDPOINT = os.environ.get("EC2_BATCH_ENDPOINT", EC2_ENDPOINT.rstrip("/") + "/batch")
+# (connect, read) timeouts in seconds; keep the read timeout below the Lambda timeout
+REQUEST_TIMEOUT = (float(os.environ.get("CONNECT_TIMEOUT_S", 2)), float(os.environ.get("READ_TIMEOUT_S", 10)))
+# Queries per /search/batch call (the backend accepts up to 1024)
+MAX_BATCH_QUERIES = int(os.environ.get("MAX_BATCH_QUERIES", 256))
+# Optional SQS queue the results of SQS-driven searches are sent to
+RESULTS_QUEUE_URL = os.environ.get("RESULTS_QUEUE_URL")
+
+JSON_HEADERS = { "Content-Type": "application/json" }
+
+# Created once per container, so warm invocations reuse keep-alive
+# connections instead of opening a new one per request
+session = requests.Session()
+session.mount("http://", HTTPAdapter(pool_connections=1, pool_maxsize=int(os.environ.get("POOL_SIZE", 4))))
+session.mount("https://", HTTPAdapter(pool_connections=1, pool_maxsize=int(os.environ.get("POOL_SIZE", 4))))
+
+class BackendUnavailable(Exception):
+    """
+    The backend failed (connection error, timeout or 5xx), or the circuit
+    breaker is open and the backend was not called.
+    """
+
+class CircuitBreaker:
+    """
+    Stop calling a failing backend for a while instead of piling retries on it.
+
+    After failure_threshold consecutive failures the breaker opens and calls
+    fail fast for a cooldown. The first call after the cooldown is a trial:
+    success closes the breaker, failure reopens it with the cooldown doubled
+    (up to max_cooldown_s).
+
+    Parameters:
+    - failure_threshold: Consecutive failures that open the breaker.
+    - cooldown_s: First cooldown in seconds.
+    - max_cooldown_s: Upper bound of the doubled cooldown.
+    """
+
+    def __init__(self, failure_threshold=5, cooldown_s=5.0, max_cooldown_s=120.0):
+        self.failure_threshold = failure_threshold
+        self.cooldown_s = cooldown_s
+        self.max_cooldown_s = max_cooldown_s
+        self.failures = 0
+        self.opens = 0
+        self.open_until = 0.0
+        self.trial_running = False
+        self.lock = threading.Lock()
+
+    def allow(self):
+        """
+        Return True if a call may go to the backend now.
+        """
+        with self.lock:
+            if self.opens == 0:
+                return True
+            if time.monotonic() < self.open_until or self.trial_running:
+                return False
+            self.trial_running = True
+            return True
+
+    def retry_after(self):
+        """
+        Seconds until the next call is allowed (0 when closed).
+        """
+        with self.lock:
+            return max(0.0, self.open_until - time.monotonic())
+
+    def record_success(self):
+        with self.lock:
+            self.failures = 0
+            self.opens = 0
+            self.trial_running = False
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            self.trial_running = False
+            if self.opens > 0 or self.failures >= self.failure_threshold:
+                cooldown = min(self.max_cooldown_s, self.cooldown_s * 2 ** self.opens)
+                self.opens += 1
+                self.open_until = time.monotonic() + cooldown
+
+    def end_call(self):
+        """
+        Let the next trial through even if this call neither succeeded nor
+        failed (e.g. it raised an unexpected exception).
+        """
+        with self.lock:
+            self.trial_running = False
+
+breaker = CircuitBreaker(
+    failure_threshold=int(os.environ.get("BREAKER_FAILURES", 5)),
+    cooldown_s=float(os.environ.get("BREAKER_COOLDOWN_S", 5)),
+    max_cooldown_s=float(os.environ.get("BREAKER_MAX_COOLDOWN_S", 120)),
+)
+
+def call_backend(url, payload):
+    """
+    POST a JSON payload to the backend through the pooled session and the breaker.
+
+    Returns:
+    - The requests.Response for 2xx and 4xx answers (4xx is the caller's
+      fault and does not count against the backend); raises
+      BackendUnavailable otherwise.
+    """
+    if not breaker.allow():
+        raise BackendUnavailable("circuit breaker open")
+    try:
+        try:
+            response = session.post(url, json=payload, timeout=REQUEST_TIMEOUT)
+        except requests.exceptions.RequestException as e:
+            breaker.record_failure()
+            raise BackendUnavailable(str(e)) from e
+        if response.status_code >= 500:
+            breaker.record_failure()
+            raise BackendUnavailable(f"backend returned {response.status_code}")
+        breaker.record_success()
+        return response
+    finally:
+        # Otherwise an unexpected exception in a trial call would keep the
+        # breaker open for the life of the container
+        breaker.end_call()
+
+def unavailable_response():
+    retry_after = max(1, round(breaker.retry_after()))
+    return {
+        "statusCode": 503,
+        "headers": dict(JSON_HEADERS, **{ "Retry-After": str(retry_after) }),
+        "body": json.dumps({"error": "Search backend unavailable, retry later."})
+    }
+
+def parse_message(body):
+    """
+    Parse an SQS message body of the form {"query": ..., <search options>}.
+
+    Returns:
+    - The message dict, or None if the body is not a valid search request.
+    """
+    try:
+        data = json.loads(body)
+    except (json.JSONDecodeError, TypeError):
+        return None
+    if not isinstance(data, dict) or not isinstance(data.get('query'), str) or not data['query']:
+        return None
+    return data
+
+def send_results(results):
+    """
+    Send (message_id, result) pairs to RESULTS_QUEUE_URL.
+
+    Returns:
+    - Set of message ids whose results could not be sent.
+    """
+    import boto3  # available in the Lambda runtime; only needed with a results queue
+
+    sqs = boto3.client("sqs")
+    failed = set()
+    for start in range(0, len(results), 10):
+        chunk = results[start:start + 10]
+        entries = [
+            {"Id": str(i), "MessageBody": json.dumps(dict(result, message_id=message_id))}
+            for i, (message_id, result) in enumerate(chunk)
+        ]
+        try:
+            response = sqs.send_message_batch(QueueUrl=RESULTS_QUEUE_URL, Entries=entries)
+        except Exception as e:
+            print(f"Sending results failed: {e}")
+            failed.update(message_id for message_id, _ in chunk)
+            continue
+        failed.update(chunk[int(entry["Id"])][0] for entry in response.get("Failed", []))
+    return failed
+
+def handle_sqs_batch(records):
+    """
+    Search the queries of a batch of SQS messages with as few /search/batch
+    calls as possible.
+
+    Messages sharing the same search options (top_k, mode, filter, ...) go
+    into one call of up to MAX_BATCH_QUERIES queries. Malformed messages and
+    requests the backend rejects (4xx) are logged and dropped, since retrying
+    them cannot succeed. Messages whose call failed, or whose result could
+    not be delivered, are reported back so that SQS retries only those;
+    this needs ReportBatchItemFailures on the event source mapping.
+
+    Returns:
+    - {"batchItemFailures": [{"itemIdentifier": message_id}, ...]}
+    """
+    groups = {}
+    for record in records:
+        data = parse_message(record.get('body'))
+        if data is None:
+            print(f"Dropping malformed message {record['messageId']}")
+            continue
+        options = {key: value for key, value in data.items() if key != 'query'}
+        key = json.dumps(options, sort_keys=True)
+        groups.setdefault(key, (options, []))[1].append((record['messageId'], data['query']))
+
+    failed = []
+    results = []
+    for options, messages in groups.values():
+        for start in range(0, len(messages), MAX_BATCH_QUERIES):
+            chunk = messages[start:start + MAX_BATCH_QUERIES]
+            try:
+                response = call_backend(EC2_BATCH_ENDPOINT, dict(options, queries=[query for _, query in chunk]))
+            except BackendUnavailable as e:
+                print(f"Backend unavailable for {len(chunk)} messages: {e}")
+                failed.extend(message_id for message_id, _ in chunk)
+                continue
+            if response.status_code >= 400:
+                print(f"Backend rejected {len(chunk)} messages ({response.status_code}): {response.text}")
+                continue
+            for (message_id, _), result in zip(chunk, response.json()["results"]):
+                results.append((message_id, result))
+
+    if RESULTS_QUEUE_URL and results:
+        failed.extend(send_results(results))
+    return {"batchItemFailures": [{"itemIdentifier": message_id} for message_id in failed]}
 
 def lambda_handler(event, context):
+    # SQS event source: drain the message batch through the batch endpoint
+    records = event.get('Records')
+    if records and records[0].get('eventSource') == 'aws:sqs':
+        return handle_sqs_batch(records)
+
     # Parse the incoming event, which should contain a body with { "query": "<the query>" }
     # If using API Gateway with a Lambda proxy integration, the request payload will be in event['body']
     if 'body' not in event or event['body'] is None:
         return {
             "statusCode": 400,
-            "headers": { "Content-Type": "application/json" },
+            "headers": JSON_HEADERS,
             "body": json.dumps({"error": "No request body provided."})
         }
 
@@ -21,7 +246,7 @@ def lambda_handler(event, context):
     except json.JSONDecodeError:
         return {
             "statusCode": 400,
-            "headers": { "Content-Type": "application/json" },
+            "headers": JSON_HEADERS,
             "body": json.dumps({"error": "Invalid JSON in request body."})
         }
 
@@ -30,32 +255,22 @@ def lambda_handler(event, context):
     if not query:
         return {
             "statusCode": 400,
-            "headers": { "Content-Type": "application/json" },
+            "headers": JSON_HEADERS,
             "body": json.dumps({"error": "No 'query' field found in request."})
         }
 
-    # Make a POST request to the EC2-based Flask service
+    # Make a POST request to the EC2-based Flask service. A failing backend
+    # is reported as 503 (and, while the breaker is open, without calling it)
+    # so clients back off instead of retrying immediately.
     try:
-        response = requests.post(EC2_ENDPOINT, json={"query": query})
-        response.raise_for_status()  # Raises an HTTPError if response is not 2xx
-
-        # The backend should return a JSON array of passages
-        passages = response.json()
+        response = call_backend(EC2_ENDPOINT, {"query": query})
+    except BackendUnavailable as e:
+        print(f"Backend unavailable: {e}")
+        return unavailable_response()
 
-        # Return the results back to the caller
-        return {
-            "statusCode": 200,
-            "headers": { "Content-Type": "application/json" },
-            "body": json.dumps(passages)
-        }
-
-    except requests.exceptions.RequestException as e:
-        # If there's an error calling the backend, return a dummy data response similar to the front end fallback
-        dummy_data = [
-            { "id": "0", "passage": "This is a dummy passage. Backend is unreachable." }
-        ]
-        return {
-            "statusCode": 200,
-            "headers": { "Content-Type": "application/json" },
-            "body": json.dumps(dummy_data)
-        }
+    # The backend returns a JSON array of passages, or an error for a bad request
+    return {
+        "statusCode": response.status_code,
+        "headers": JSON_HEADERS,
+        "body": response.text
+    }
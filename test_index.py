@@ -3,6 +3,8 @@ import numpy as np
 import pandas as pd
 from sentence_transformers import SentenceTransformer
 
+from backend.passage_store import PassageStore
+
 def load_tsv(file_path):
     """
     Load a TSV file into a Pandas DataFrame.
@@ -47,13 +49,13 @@ def query_index(index, query_embeddings, top_k=10):
 
 # File paths
 queries_path = "queries.tsv"
-collection_path = "collection.tsv"
+passage_store_path = "passage_store"  # built with backend/passage_store.py
 index_path = "hnsw_index.bin"
 
 # Load queries and collection
 print("Loading queries and collection...")
 queries_df = load_tsv(queries_path)
-collection_df = load_tsv(collection_path)
+passage_store = PassageStore(passage_store_path)
 
 # Select 5 random queries for testing
 selected_queries = queries_df.sample(2, random_state=42)
@@ -77,13 +79,14 @@ distances, indices = query_index(index, query_embeddings, top_k)
 print("Mapping results to passages...")
 results = []
 for query_idx, retrieved_indices in enumerate(indices):
-    retrieved_passages = collection_df.iloc[retrieved_indices]
+    retrieved_ids, retrieved_texts = passage_store.lookup(retrieved_indices)
     results.append({
         "query_id": selected_queries["id"].iloc[query_idx],
         "query_text": selected_queries["text"].iloc[query_idx],
-        "retrieved_ids": retrieved_passages["id"].tolist(),
-        "retrieved_texts": retrieved_passages["text"].tolist(),
-        "distances": distances[query_idx].tolist()
+        "retrieved_ids": retrieved_ids,
+        "retrieved_texts": retrieved_texts,
+        # lookup() skips -1 padding, so drop the same positions from the distances
+        "distances": distances[query_idx][retrieved_indices >= 0].tolist()
     })
 
 # Display results
@@ -0,0 +1,250 @@
+import json
+import os
+import sys
+import threading
+import time
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import mock
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "lambda"))
+
+import sqs_to_ec2_lambda as bridge
+
+try:
+    import boto3
+    from moto import mock_aws
+except ImportError:
+    mock_aws = None
+
+
+class StandInBackend:
+    """
+    Local stand-in for the backend's /search/batch endpoint.
+
+    Every request is recorded in self.requests. The answer is a 200 with
+    one hit per query, unless status is set (answered with an error) or
+    delay_s is set (answered late, to trigger the bridge's read timeout).
+    """
+
+    def __init__(self):
+        self.requests = []
+        self.status = 200
+        self.delay_s = 0.0
+        backend = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                payload = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+                backend.requests.append(payload)
+                if backend.delay_s:
+                    time.sleep(backend.delay_s)
+                if backend.status == 200:
+                    body = {"results": [{"query": query, "hits": [{"id": query, "score": 1.0}]}
+                                        for query in payload["queries"]]}
+                else:
+                    body = {"error": "stand-in error"}
+                data = json.dumps(body).encode("utf-8")
+                try:
+                    self.send_response(backend.status)
+                    self.send_header("Content-Type", "application/json")
+                    self.send_header("Content-Length", str(len(data)))
+                    self.end_headers()
+                    self.wfile.write(data)
+                except (BrokenPipeError, ConnectionResetError):
+                    pass  # the bridge timed out and hung up
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}/search/batch"
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+
+def sqs_record(message_id, body):
+    return {"messageId": message_id, "eventSource": "aws:sqs",
+            "body": body if isinstance(body, str) else json.dumps(body)}
+
+
+def failed_ids(response):
+    return sorted(item["itemIdentifier"] for item in response["batchItemFailures"])
+
+
+class HandleSqsBatchTest(unittest.TestCase):
+    def setUp(self):
+        self.backend = StandInBackend()
+        self.addCleanup(self.backend.close)
+        for name, value in [
+            ("EC2_BATCH_ENDPOINT", self.backend.url),
+            ("REQUEST_TIMEOUT", (1.0, 0.2)),
+            ("MAX_BATCH_QUERIES", 2),
+            ("RESULTS_QUEUE_URL", None),
+            ("breaker", bridge.CircuitBreaker(failure_threshold=2, cooldown_s=60.0)),
+        ]:
+            patcher = mock.patch.object(bridge, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_groups_messages_by_search_options(self):
+        records = [
+            sqs_record("m1", {"query": "a", "top_k": 5}),
+            sqs_record("m2", {"query": "b"}),
+            sqs_record("m3", {"top_k": 5, "query": "c"}),
+            sqs_record("m4", {"query": "d", "top_k": 5}),
+            sqs_record("m5", {"query": "e"}),
+        ]
+        response = bridge.handle_sqs_batch(records)
+        self.assertEqual(failed_ids(response), [])
+        # top_k=5 has three queries, split at MAX_BATCH_QUERIES; the rest fit one call
+        self.assertCountEqual(self.backend.requests, [
+            {"top_k": 5, "queries": ["a", "c"]},
+            {"top_k": 5, "queries": ["d"]},
+            {"queries": ["b", "e"]},
+        ])
+
+    def test_server_errors_are_reported_for_retry(self):
+        self.backend.status = 503
+        response = bridge.handle_sqs_batch([sqs_record("m1", {"query": "a"}), sqs_record("m2", {"query": "b"})])
+        self.assertEqual(failed_ids(response), ["m1", "m2"])
+
+    def test_timeouts_are_reported_for_retry(self):
+        self.backend.delay_s = 0.5
+        response = bridge.handle_sqs_batch([sqs_record("m1", {"query": "a"})])
+        self.assertEqual(failed_ids(response), ["m1"])
+
+    def test_open_breaker_fails_without_calling_the_backend(self):
+        self.backend.status = 500
+        bridge.handle_sqs_batch([sqs_record("m1", {"query": "a", "top_k": 1}),
+                                 sqs_record("m2", {"query": "b", "top_k": 2})])
+        calls = len(self.backend.requests)
+        self.assertEqual(calls, 2)
+        self.assertFalse(bridge.breaker.allow())
+
+        response = bridge.handle_sqs_batch([sqs_record("m3", {"query": "c"})])
+        self.assertEqual(failed_ids(response), ["m3"])
+        self.assertEqual(len(self.backend.requests), calls)
+
+    def test_rejected_and_malformed_messages_are_dropped(self):
+        self.backend.status = 400
+        records = [
+            sqs_record("m1", {"query": "a"}),
+            sqs_record("m2", "not json"),
+            sqs_record("m3", {"query": ""}),
+            sqs_record("m4", ["a", "list"]),
+        ]
+        response = bridge.handle_sqs_batch(records)
+        self.assertEqual(failed_ids(response), [])
+        self.assertEqual([payload["queries"] for payload in self.backend.requests], [["a"]])
+        # 4xx is the caller's fault and does not count against the backend
+        self.assertEqual(bridge.breaker.failures, 0)
+
+    def test_lambda_handler_routes_sqs_events(self):
+        response = bridge.lambda_handler({"Records": [sqs_record("m1", {"query": "a"})]}, None)
+        self.assertEqual(response, {"batchItemFailures": []})
+        self.assertEqual(self.backend.requests, [{"queries": ["a"]}])
+
+    @unittest.skipIf(mock_aws is None, "needs boto3 and moto")
+    def test_results_are_sent_to_the_results_queue(self):
+        with mock.patch.dict(os.environ, {"AWS_DEFAULT_REGION": "us-east-1", "AWS_ACCESS_KEY_ID": "testing",
+                                          "AWS_SECRET_ACCESS_KEY": "testing"}), mock_aws():
+            sqs = boto3.client("sqs")
+            queue_url = sqs.create_queue(QueueName="results")["QueueUrl"]
+            with mock.patch.object(bridge, "RESULTS_QUEUE_URL", queue_url):
+                response = bridge.handle_sqs_batch([sqs_record("m1", {"query": "a"}),
+                                                    sqs_record("m2", {"query": "b"})])
+            self.assertEqual(failed_ids(response), [])
+            messages = sqs.receive_message(QueueUrl=queue_url, MaxNumberOfMessages=10)["Messages"]
+            results = sorted((json.loads(message["Body"]) for message in messages),
+                             key=lambda result: result["message_id"])
+            self.assertEqual([(result["message_id"], result["query"]) for result in results],
+                             [("m1", "a"), ("m2", "b")])
+
+    def test_undeliverable_results_are_reported_for_retry(self):
+        with mock.patch.object(bridge, "RESULTS_QUEUE_URL", "https://sqs.invalid/results"), \
+                mock.patch.object(bridge, "send_results", return_value={"m2"}):
+            response = bridge.handle_sqs_batch([sqs_record("m1", {"query": "a"}),
+                                                sqs_record("m2", {"query": "b"})])
+        self.assertEqual(failed_ids(response), ["m2"])
+
+
+class CircuitBreakerTest(unittest.TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        patcher = mock.patch.object(bridge, "time", self.clock)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.breaker = bridge.CircuitBreaker(failure_threshold=3, cooldown_s=5.0, max_cooldown_s=12.0)
+
+    def open_breaker(self):
+        for _ in range(3):
+            self.assertTrue(self.breaker.allow())
+            self.breaker.record_failure()
+
+    def test_opens_after_consecutive_failures(self):
+        self.breaker.record_failure()
+        self.breaker.record_success()
+        self.breaker.record_failure()
+        self.breaker.record_failure()
+        self.assertTrue(self.breaker.allow())
+        self.breaker.record_failure()
+        self.assertFalse(self.breaker.allow())
+        self.assertEqual(self.breaker.retry_after(), 5.0)
+
+    def test_allows_one_trial_after_the_cooldown(self):
+        self.open_breaker()
+        self.clock.now += 4.9
+        self.assertFalse(self.breaker.allow())
+        self.clock.now += 0.1
+        self.assertTrue(self.breaker.allow())
+        self.assertFalse(self.breaker.allow())
+
+    def test_failed_trial_doubles_the_cooldown(self):
+        self.open_breaker()
+        self.clock.now += 5.0
+        self.assertTrue(self.breaker.allow())
+        self.breaker.record_failure()
+        self.assertEqual(self.breaker.retry_after(), 10.0)
+        self.clock.now += 10.0
+        self.assertTrue(self.breaker.allow())
+        self.breaker.record_failure()
+        self.assertEqual(self.breaker.retry_after(), 12.0)  # capped at max_cooldown_s
+
+    def test_successful_trial_closes_the_breaker(self):
+        self.open_breaker()
+        self.clock.now += 5.0
+        self.assertTrue(self.breaker.allow())
+        self.breaker.record_success()
+        self.assertTrue(self.breaker.allow())
+        self.assertTrue(self.breaker.allow())
+        self.assertEqual(self.breaker.retry_after(), 0.0)
+        # Closed again: it takes failure_threshold failures to reopen
+        self.breaker.record_failure()
+        self.assertTrue(self.breaker.allow())
+
+    def test_unexpected_error_in_a_trial_allows_the_next_trial(self):
+        self.open_breaker()
+        self.clock.now += 5.0
+        session = mock.Mock()
+        session.post.side_effect = ValueError("unexpected")
+        with mock.patch.object(bridge, "breaker", self.breaker), mock.patch.object(bridge, "session", session):
+            with self.assertRaises(ValueError):
+                bridge.call_backend("http://127.0.0.1:1/search/batch", {"queries": ["a"]})
+        self.assertTrue(self.breaker.allow())
+
+
+if __name__ == "__main__":
+    unittest.main()
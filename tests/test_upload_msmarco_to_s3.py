@@ -0,0 +1,100 @@
+import gzip
+import json
+import os
+import sys
+import tempfile
+import unittest
+from collections import namedtuple
+from unittest import mock
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "index_creation"))
+
+try:
+    import boto3
+    from moto import mock_aws
+except ImportError:
+    mock_aws = None
+
+Doc = namedtuple("Doc", ["doc_id", "text", "spans", "msmarco_document_id"])
+
+
+def make_docs(count):
+    return [Doc(f"msmarco_passage_{i:02d}", f"passage {i}", [], f"msmarco_doc_{i // 3:02d}") for i in range(count)]
+
+
+@unittest.skipIf(mock_aws is None, "needs boto3 and moto")
+class UploadPackedShardsTest(unittest.TestCase):
+    def setUp(self):
+        patcher = mock.patch.dict(os.environ, {"AWS_DEFAULT_REGION": "us-east-1", "AWS_ACCESS_KEY_ID": "testing",
+                                               "AWS_SECRET_ACCESS_KEY": "testing"})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        aws = mock_aws()
+        aws.start()
+        self.addCleanup(aws.stop)
+
+        import upload_msmarco_to_s3 as uploader
+        self.uploader = uploader
+        self.s3 = uploader.s3_client()
+        self.s3.create_bucket(Bucket=uploader.BUCKET_NAME)
+        work_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(work_dir.cleanup)
+        self.checkpoint = os.path.join(work_dir.name, "checkpoint.json")
+        # Failed uploads are retried with backoff; do not actually wait
+        patcher = mock.patch.object(uploader.time, "sleep")
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def upload(self, docs, **kwargs):
+        return self.uploader.upload_packed_shards(self.s3, iter(docs), prefix="shards/", shard_size=10,
+                                                  checkpoint_path=self.checkpoint, **kwargs)
+
+    def read_object(self, key):
+        return self.s3.get_object(Bucket=self.uploader.BUCKET_NAME, Key=key)["Body"].read()
+
+    def test_packs_shards_and_writes_the_manifest(self):
+        docs = make_docs(25)
+        manifest = self.upload(docs)
+
+        self.assertEqual(manifest["count"], 25)
+        self.assertEqual([(s["shard"], s["offset"], s["count"]) for s in manifest["shards"]],
+                         [(0, 0, 10), (1, 10, 10), (2, 20, 5)])
+        self.assertEqual(json.loads(self.read_object("shards/manifest.json")), manifest)
+        for shard in manifest["shards"]:
+            lines = gzip.decompress(self.read_object(shard["key"])).decode("utf-8").splitlines()
+            records = [json.loads(line) for line in lines]
+            expected = docs[shard["offset"]:shard["offset"] + shard["count"]]
+            self.assertEqual([r["doc_id"] for r in records], [doc.doc_id for doc in expected])
+            self.assertEqual((shard["first_doc_id"], shard["last_doc_id"]), (expected[0].doc_id, expected[-1].doc_id))
+            self.assertEqual(records[0]["msmarco_document_id"], expected[0].msmarco_document_id)
+
+    def test_resumes_after_a_failed_shard_upload(self):
+        docs = make_docs(25)
+        upload_file = self.s3.upload_file
+
+        def fail_shard_1(path, bucket, key, **kwargs):
+            if key.endswith("part-00001.jsonl.gz"):
+                raise ConnectionError("stand-in failure")
+            return upload_file(path, bucket, key, **kwargs)
+
+        with mock.patch.object(self.s3, "upload_file", side_effect=fail_shard_1):
+            with self.assertRaises(ConnectionError):
+                self.upload(docs)
+        with open(self.checkpoint) as f:
+            self.assertEqual([entry["shard"] for entry in json.load(f)["shards"]], [0, 2])
+
+        with mock.patch.object(self.s3, "upload_file", side_effect=upload_file) as resumed:
+            manifest = self.upload(docs)
+        self.assertEqual([call.args[2] for call in resumed.call_args_list], ["shards/part-00001.jsonl.gz"])
+        self.assertEqual([(s["shard"], s["offset"], s["count"]) for s in manifest["shards"]],
+                         [(0, 0, 10), (1, 10, 10), (2, 20, 5)])
+
+    def test_rejects_a_checkpoint_with_different_parameters(self):
+        self.upload(make_docs(15))
+        with self.assertRaises(ValueError):
+            self.uploader.upload_packed_shards(self.s3, iter(make_docs(15)), prefix="shards/", shard_size=5,
+                                               checkpoint_path=self.checkpoint)
+
+
+if __name__ == "__main__":
+    unittest.main()